@@ -1,16 +1,30 @@
 # === Chel Massage Backend Plan ===
+import atexit
 import base64
+import binascii
+import bisect
 import datetime
 import hashlib
 import hmac
 import html
 import io
+import json
+import multiprocessing
 import os
+import queue
 import random
 import re
+import sqlite3
+import string
+import tempfile
 import threading
 import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
 from datetime import timedelta, timezone
 from email import encoders
 from email.mime.base import MIMEBase
@@ -29,17 +43,17 @@ from flask import (
     send_from_directory,
     url_for,
 )
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials as UserCredentials
 from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload
-from PIL import Image
+from googleapiclient.http import MediaIoBaseUpload, build_http
 from square.client import Client  # Ensure Square Client is imported at the top
 
+from intake_pdf import render_intake_pdf
+
 # 1. Load environment variables from .env file immediately
 load_dotenv()
 
@@ -110,6 +124,10 @@ if not os.path.exists(SERVICE_ACCOUNT_FILE):
     print(f"SYSTEM WARNING: {SERVICE_ACCOUNT_FILE} not found. Calendar/Sheets integration will fail.")
 
 app = Flask(__name__, template_folder='templates', static_folder='static') # Flask app initialized after all global configuration is loaded
+# Bodies larger than this get a 413 before they are read. The intake form, with its two canvas
+# drawings, is by far the largest request.
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(8 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BODY_BYTES
 
 @app.after_request
 def add_static_cache_headers(response):
@@ -183,6 +201,97 @@ def _get_credentials():
 
     return None
 
+# --- Google API Transport Pool ---
+# Built service objects are shared by every thread, but httplib2.Http is not thread-safe, so
+# they are built over PooledGoogleHttp instead of their own connection. Each API call checks
+# out an authorized transport for just that request. The pool is sized for everything that
+# can call Google at once (request threads, background job workers, calendar fan-out threads,
+# reminder dispatch workers, plus one each for the single-threaded Sheets flusher, job-queue
+# consumer and cache refresh), so callers get real parallelism while the number of open
+# connections stays bounded.
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "2"))
+GOOGLE_HTTP_SINGLE_THREAD_USERS = 3
+GOOGLE_HTTP_POOL_SIZE = int(os.getenv(
+    "GOOGLE_HTTP_POOL_SIZE",
+    str(
+        GUNICORN_THREADS
+        + int(os.getenv("BACKGROUND_JOB_WORKERS", "2"))
+        + int(os.getenv("CALENDAR_FANOUT_WORKERS", "4"))
+        + max(1, int(os.getenv("REMINDER_SMS_CONCURRENCY", "2")))
+        + max(1, int(os.getenv("REMINDER_EMAIL_CONCURRENCY", "4")))
+        + GOOGLE_HTTP_SINGLE_THREAD_USERS
+    )
+))
+GOOGLE_HTTP_CHECKOUT_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_CHECKOUT_TIMEOUT_SECONDS", "30"))
+
+class AuthorizedHttpPool:
+    """Bounded pool of authorized httplib2 transports; each checkout is used by one thread at a time."""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checkout_timeouts = 0
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Yields a transport (or None when credentials are unavailable) and returns it afterwards."""
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            http = None
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                creds = _get_credentials()
+                if creds is None:
+                    with self._lock:
+                        self._created -= 1
+                    yield None
+                    return
+                http = AuthorizedHttp(creds, http=build_http())
+            else:
+                try:
+                    http = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._checkout_timeouts += 1
+                    raise RuntimeError(
+                        f"No Google API connection became free within {timeout}s (all {self.size} in use); "
+                        "consider raising GOOGLE_HTTP_POOL_SIZE."
+                    ) from None
+        try:
+            yield http
+        finally:
+            self._idle.put(http)
+
+    def stats(self):
+        return {"size": self.size, "created": self._created, "idle": self._idle.qsize(), "checkout_timeouts": self._checkout_timeouts}
+
+class PooledGoogleHttp:
+    """httplib2.Http stand-in for build(): every request runs on a transport checked out from the pool."""
+
+    def __init__(self, pool, checkout_timeout):
+        self._pool = pool
+        self._checkout_timeout = checkout_timeout
+
+    @property
+    def credentials(self):
+        # Read by googleapiclient's batch requests to authorize their parts.
+        return _get_credentials()
+
+    def request(self, *args, **kwargs):
+        with self._pool.checkout(timeout=self._checkout_timeout) as http:
+            if http is None:
+                raise RuntimeError("Google credentials are unavailable.")
+            return http.request(*args, **kwargs)
+
+_google_http_pool = AuthorizedHttpPool(GOOGLE_HTTP_POOL_SIZE)
+_google_http = PooledGoogleHttp(_google_http_pool, GOOGLE_HTTP_CHECKOUT_TIMEOUT_SECONDS)
+
 def get_google_service(service_name, version):
     """Unified helper to get a Google API service, caching the built service objects."""
     cache_key = f"{service_name}_{version}"
@@ -200,7 +309,8 @@ def get_google_service(service_name, version):
 
         creds = _get_credentials()
         if creds:
-            service = build(service_name, version, credentials=creds)
+            # One shared client per API over the bundled (static) discovery document.
+            service = build(service_name, version, http=_google_http, static_discovery=True)
             _google_service_cache[cache_key] = service
             print(f"DEBUG: Built and cached {service_name} service.")
             return service
@@ -220,27 +330,114 @@ def get_drive_service():
 def get_gmail_service():
     return get_google_service('gmail', 'v1')
 
-def execute_with_retry(request, max_retries=3):
-    """Executes a Google API request with simple exponential backoff."""
+def execute_with_retry(request, max_retries=3, idempotent=True):
+    """
+    Executes a Google API request with simple exponential backoff. Requests that must not be
+    applied twice (idempotent=False) are only retried on 429, which Google returns before doing
+    anything; a 5xx may come after the change was made, so it is raised to the caller.
+    """
+    retry_statuses = [429, 500, 502, 503, 504] if idempotent else [429]
     for i in range(max_retries):
         try:
             return request.execute()
         except HttpError as e:
-            if e.resp.status in [429, 500, 502, 503, 504] and i < max_retries - 1:
+            if e.resp.status in retry_statuses and i < max_retries - 1:
                 time.sleep((2 ** i) + random.random())
                 continue
             raise
 
-def patch_event_description_with_etag(service, calendar_id, event_id, description, etag):
-    """Patch a Calendar event description with optimistic concurrency (If-Match ETag)."""
+def patch_event_with_etag(service, calendar_id, event_id, body, etag):
+    """Patch a Calendar event with optimistic concurrency (If-Match ETag)."""
     req = service.events().patch(
         calendarId=calendar_id,
         eventId=event_id,
-        body={'description': description}
+        body=body
     )
     # googleapiclient patch() does not accept a `headers=` kwarg directly.
     req.headers['If-Match'] = etag
-    return execute_with_retry(req)
+    # A 5xx retry of an applied patch would only come back as a 412, so callers handle 5xx.
+    return execute_with_retry(req, idempotent=False)
+
+def patch_event_description_with_etag(service, calendar_id, event_id, description, etag):
+    """Patch a Calendar event description with optimistic concurrency (If-Match ETag)."""
+    return patch_event_with_etag(service, calendar_id, event_id, {'description': description}, etag)
+
+# --- Event Description Pipeline ---
+# Admin links (SOAP, Square, intake PDF) used to be appended with a GET + PATCH each. Edits are
+# now collected per event and applied together in one If-Match patch against the last known
+# (etag, description); the event is only re-read when that isn't cached or the patch gets a 412.
+EVENT_DESCRIPTION_CACHE_SIZE = 256
+
+class EventDescriptionPipeline:
+    """Coalesces safe_append_description() edits per event into single ETag-guarded patches."""
+
+    def __init__(self, max_entries, lock_stripes=32):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._known = OrderedDict()  # (calendar_id, event_id) -> (etag, description)
+        self._pending = {}           # (calendar_id, event_id) -> [(tag, content), ...]
+        self._event_locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def remember(self, calendar_id, event):
+        """Records an event's etag and description from an insert/get/patch response."""
+        if not event or not event.get('id') or not event.get('etag'):
+            return
+        key = (calendar_id, event['id'])
+        with self._lock:
+            self._known[key] = (event['etag'], event.get('description', ''))
+            self._known.move_to_end(key)
+            while len(self._known) > self.max_entries:
+                self._known.popitem(last=False)
+
+    def forget(self, calendar_id, event_id):
+        with self._lock:
+            self._known.pop((calendar_id, event_id), None)
+
+    def append(self, service, calendar_id, event_id, sections):
+        """
+        Queues (tag, content) sections for an event and applies every pending section in one
+        patch. A caller whose sections were already applied by a concurrent caller returns None.
+        """
+        key = (calendar_id, event_id)
+        with self._lock:
+            self._pending.setdefault(key, []).extend(sections)
+        with self._event_locks[hash(key) % len(self._event_locks)]:
+            with self._lock:
+                edits = self._pending.pop(key, [])
+            if edits:
+                return self._apply(service, calendar_id, event_id, edits)
+        return None
+
+    def _apply(self, service, calendar_id, event_id, edits, max_attempts=3):
+        for _ in range(max_attempts):
+            with self._lock:
+                known = self._known.get((calendar_id, event_id))
+            if known is None:
+                event = execute_with_retry(service.events().get(calendarId=calendar_id, eventId=event_id, fields='id,etag,description'))
+                self.remember(calendar_id, event)
+                known = (event.get('etag'), event.get('description', ''))
+            etag, description = known
+            updated = description or ''
+            for tag, content in edits:
+                updated = safe_append_description(updated, tag, content)
+            if updated == (description or ''):
+                return None
+            try:
+                patched = patch_event_description_with_etag(service, calendar_id, event_id, updated, etag)
+            except HttpError as e:
+                if e.resp.status != 412 and e.resp.status < 500:
+                    raise
+                # Someone else changed the event, or a 5xx left it unknown whether our patch was
+                # applied; re-read it and re-apply whichever sections are still missing.
+                self.forget(calendar_id, event_id)
+                if e.resp.status >= 500:
+                    time.sleep(1 + random.random())
+                continue
+            self.remember(calendar_id, patched)
+            return patched
+        raise RuntimeError(f"Event {event_id} kept changing; gave up after {max_attempts} attempts")
+
+_event_descriptions = EventDescriptionPipeline(EVENT_DESCRIPTION_CACHE_SIZE)
 
 def parse_iso_datetime(value: str | None) -> datetime.datetime:
     """Parse ISO-8601 datetimes reliably, including trailing `Z` (UTC)."""
@@ -251,10 +448,18 @@ def parse_iso_datetime(value: str | None) -> datetime.datetime:
         normalized = normalized[:-1] + '+00:00'
     return datetime.datetime.fromisoformat(normalized)
 
+def parse_utc_day(value: str) -> datetime.datetime:
+    """Midnight UTC of the day in a 'YYYY-MM-DD' (or ISO datetime) query parameter."""
+    return datetime.datetime.fromisoformat(value).replace(hour=0, minute=0, second=0, tzinfo=timezone.utc)
+
 def norm_email(email):
     """Strips and lowercases email addresses for comparison."""
     return email.strip().lower() if email else ""
 
+def norm_phone_digits(phone):
+    """Extracts digits only from a phone number."""
+    return "".join(filter(str.isdigit, phone)) if phone else ""
+
 def safe_append_description(description, tag, content):
     """Appends a tagged section to a description only if the tag isn't present."""
     if not description:
@@ -291,22 +496,68 @@ def build_intake_form_url(first_name, last_name, booking_date_formatted, booking
     }
     return url_for('intake_page', _external=True) + '?' + urlencode(intake_params)
 
+# --- Description Metadata ---
+# One case-insensitive scan finds every "<field>:" key; the field's value pattern is then tried
+# right after it. The first key whose value matches wins, exactly as the old per-field
+# re.search() calls behaved. Parsed results are memoized per (event_id, etag) so cron passes
+# never re-parse an event that hasn't changed.
+DESCRIPTION_METADATA_FIELDS = ("phone", "email", "duration", "service", "comments")
+_DESCRIPTION_KEY_RE = re.compile(r'(phone|email|duration|service|comments):', re.IGNORECASE)
+_DESCRIPTION_VALUE_RES = {
+    "phone": re.compile(r'\s*([\+\d\s\-\(\)]+)'),
+    "email": re.compile(r'\s*([^\s<\n\r]+)'),
+    "duration": re.compile(r'\s*([^<\n\r]+)'),
+    "service": re.compile(r'\s*([^<\n\r]+)'),
+    "comments": re.compile(r'\s*([^<\n\r]+)'),
+}
+DESCRIPTION_METADATA_CACHE_SIZE = 512
+
 def parse_appointment_description_metadata(description):
     """Extracts Phone/Email/Duration/Service/Comments from a calendar event description."""
     desc = description or ""
-    phone_match = re.search(r'phone:\s*([\+\d\s\-\(\)]+)', desc, re.IGNORECASE)
-    email_match = re.search(r'email:\s*([^\s<\n\r]+)', desc, re.IGNORECASE)
-    duration_match = re.search(r'duration:\s*([^<\n\r]+)', desc, re.IGNORECASE)
-    service_match = re.search(r'service:\s*([^<\n\r]+)', desc, re.IGNORECASE)
-    comments_match = re.search(r'comments:\s*([^<\n\r]+)', desc, re.IGNORECASE)
-
-    return {
-        "phone": phone_match.group(1).strip() if phone_match else "",
-        "email": email_match.group(1).strip() if email_match else "",
-        "duration": duration_match.group(1).strip() if duration_match else "",
-        "service": service_match.group(1).strip() if service_match else "",
-        "comments": comments_match.group(1).strip() if comments_match else "",
-    }
+    meta = dict.fromkeys(DESCRIPTION_METADATA_FIELDS, "")
+    remaining = set(DESCRIPTION_METADATA_FIELDS)
+    for key_match in _DESCRIPTION_KEY_RE.finditer(desc):
+        field = key_match.group(1).lower()
+        if field not in remaining:
+            continue
+        value_match = _DESCRIPTION_VALUE_RES[field].match(desc, key_match.end())
+        if value_match:
+            meta[field] = value_match.group(1).strip()
+            remaining.discard(field)
+            if not remaining:
+                break
+    return meta
+
+class DescriptionMetadataCache:
+    """Bounded LRU of parsed description metadata keyed by (event_id, etag)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, event):
+        """Returns the parsed metadata for a listed event, parsing only on a cache miss."""
+        description = event.get('description', '') or ""
+        etag = event.get('etag')
+        if not event.get('id') or not etag:
+            return parse_appointment_description_metadata(description)
+        key = (event['id'], etag)
+        with self._lock:
+            meta = self._entries.get(key)
+            if meta is not None:
+                self._entries.move_to_end(key)
+                return dict(meta)
+        meta = parse_appointment_description_metadata(description)
+        with self._lock:
+            self._entries[key] = meta
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(meta)
+
+_description_metadata = DescriptionMetadataCache(DESCRIPTION_METADATA_CACHE_SIZE)
 
 def description_has_sms_reminder_tag(description, *timestamps):
     """
@@ -323,12 +574,10 @@ def description_has_sms_reminder_tag(description, *timestamps):
         if line.startswith("EMAIL_REMINDER_SENT_FOR:"):
             continue
         if (
-            line.startswith("SMS_REMINDER_SENT_FOR:")
-            or line.startswith("REMINDER_SENT_FOR:")
-            or line.startswith("REMINDER_LOCKED_FOR:")
+            line.startswith(("SMS_REMINDER_SENT_FOR:", "REMINDER_SENT_FOR:", "REMINDER_LOCKED_FOR:"))
+            and any(ts in line for ts in valid_timestamps)
         ):
-            if any(ts in line for ts in valid_timestamps):
-                return True
+            return True
     return False
 
 def verify_textbee_signature(raw_payload, signature, secret):
@@ -342,8 +591,8 @@ def verify_textbee_signature(raw_payload, signature, secret):
     ).hexdigest()
     return hmac.compare_digest(signature, expected)
 
-def create_event(service, summary, start_time, end_time, description="", calendar_id='primary', color_id: str | None = None):
-    """Creates a new event on the specified calendar."""
+def create_event(service, summary, start_time, end_time, description="", calendar_id='primary', color_id: str | None = None, event_id=None):
+    """Creates a new event on the specified calendar. `event_id` lets the caller choose the ID up front."""
     event = {
         'summary': summary,
         'description': description,
@@ -357,15 +606,289 @@ def create_event(service, summary, start_time, end_time, description="", calenda
         },
         'colorId': color_id,
     }
+    if event_id:
+        event['id'] = event_id
 
     try:
         created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
         print(f"Event created: {created_event.get('htmlLink')}")
+        # Make the new event visible to availability checks before the next sync round-trip.
+        _event_mirror.record_event(calendar_id, created_event)
+        _event_descriptions.remember(calendar_id, created_event)
         return created_event
     except HttpError as error:
         print(f'An error occurred: {error}')
         return None
 
+# --- Calendar Event Listing ---
+# Every events().list() goes through iter_calendar_events so results are never truncated
+# at the first page and only the fields a caller actually reads are downloaded.
+EVENT_LIST_FIELDS = ('id', 'etag', 'status', 'summary', 'start', 'end')
+
+def iter_calendar_events(service, calendar_id, item_fields=EVENT_LIST_FIELDS, sync_state=None, **params):
+    """
+    Yields events from events().list(), following nextPageToken until the last page.
+    Only `item_fields` are requested for each event. If `sync_state` is a dict, the final
+    page's nextSyncToken is stored in it under 'nextSyncToken'.
+    """
+    fields = f"nextPageToken,nextSyncToken,items({','.join(item_fields)})"
+    page_token = None
+    while True:
+        page_params = dict(params, calendarId=calendar_id, fields=fields)
+        if page_token:
+            page_params['pageToken'] = page_token
+        page = execute_with_retry(service.events().list(**page_params))
+        yield from page.get('items', [])
+
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            if sync_state is not None:
+                sync_state['nextSyncToken'] = page.get('nextSyncToken')
+            return
+
+# --- Calendar Event Mirror ---
+# Availability, booking and waitlist lookups used to re-list every calendar on every request.
+# The mirror loads each calendar once and then applies Calendar's incremental syncToken deltas,
+# so most requests are answered from memory with a single cheap delta call (or none at all).
+CALENDAR_MIRROR_REFRESH_SECONDS = float(os.getenv("CALENDAR_MIRROR_REFRESH_SECONDS", "30"))
+# Events that ended longer ago than this are dropped; nothing queries the past.
+CALENDAR_MIRROR_RETENTION = timedelta(days=1)
+
+def event_time_bounds(event):
+    """Returns (start, end) as aware datetimes for a Calendar event, or (None, None) if untimed."""
+    start = event.get('start') or {}
+    end = event.get('end') or {}
+    try:
+        if 'dateTime' in start and 'dateTime' in end:
+            return parse_iso_datetime(start['dateTime']), parse_iso_datetime(end['dateTime'])
+        if 'date' in start and 'date' in end:
+            # All-day events are anchored to local midnight, matching how Calendar filters them.
+            local_tz = ZoneInfo(LOCAL_TIMEZONE)
+            return (
+                datetime.datetime.combine(datetime.date.fromisoformat(start['date']), datetime.time(0), tzinfo=local_tz),
+                datetime.datetime.combine(datetime.date.fromisoformat(end['date']), datetime.time(0), tzinfo=local_tz),
+            )
+    except ValueError:
+        pass
+    return None, None
+
+class _MirroredCalendar:
+    """Event store for one calendar plus a start-sorted index for range queries."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.sync_token = None
+        self.last_synced = None
+        self.index = []
+        self.index_starts = []
+        self.max_span = timedelta(0)
+        self.index_dirty = False
+
+    def apply(self, event):
+        event_id = event.get('id')
+        if not event_id:
+            return
+        if event.get('status') == 'cancelled':
+            self.index_dirty |= self.events.pop(event_id, None) is not None
+            return
+        start, end = event_time_bounds(event)
+        if start is None or end < datetime.datetime.now(timezone.utc) - CALENDAR_MIRROR_RETENTION:
+            self.index_dirty |= self.events.pop(event_id, None) is not None
+            return
+        self.events[event_id] = {key: event[key] for key in EVENT_LIST_FIELDS if key in event}
+        self.index_dirty = True
+
+    def rebuild_index(self):
+        entries = []
+        max_span = timedelta(0)
+        for event_id, event in self.events.items():
+            start, end = event_time_bounds(event)
+            entries.append((start, end, event_id))
+            max_span = max(max_span, end - start)
+        entries.sort(key=lambda entry: entry[0])
+        self.index = entries
+        self.index_starts = [entry[0] for entry in entries]
+        self.max_span = max_span
+        self.index_dirty = False
+
+    def query(self, time_min, time_max):
+        if self.index_dirty:
+            self.rebuild_index()
+        # Only events starting within max_span before time_min can still overlap it.
+        lo = bisect.bisect_left(self.index_starts, time_min - self.max_span)
+        hi = bisect.bisect_left(self.index_starts, time_max)
+        return [
+            self.events[event_id]
+            for start, end, event_id in self.index[lo:hi]
+            if end > time_min
+        ]
+
+class CalendarEventMirror:
+    """Process-wide mirror of the configured calendars, refreshed with incremental syncToken deltas."""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._calendars = {}
+        self._calendars_lock = threading.Lock()
+
+    def _get(self, calendar_id):
+        with self._calendars_lock:
+            mirrored = self._calendars.get(calendar_id)
+            if mirrored is None:
+                mirrored = self._calendars[calendar_id] = _MirroredCalendar()
+            return mirrored
+
+    def _sync(self, service, calendar_id, mirrored):
+        """Runs a full load (no token) or a delta sync; must be called with mirrored.lock held."""
+        params = {'singleEvents': True, 'maxResults': 2500}
+        if mirrored.sync_token:
+            params['syncToken'] = mirrored.sync_token
+        else:
+            # A full load must still be a sync request (no timeMin/timeMax/orderBy) to yield a syncToken.
+            mirrored.events.clear()
+            mirrored.index_dirty = True
+
+        sync_state = {}
+        try:
+            for event in iter_calendar_events(service, calendar_id, sync_state=sync_state, **params):
+                mirrored.apply(event)
+        except HttpError as e:
+            if e.resp.status == 410 and mirrored.sync_token:
+                # Token expired or invalidated by Calendar: fall back to a full reload.
+                print(f"DEBUG: CalendarEventMirror: Sync token expired for {calendar_id}; reloading.")
+                mirrored.sync_token = None
+                return self._sync(service, calendar_id, mirrored)
+            raise
+
+        mirrored.sync_token = sync_state.get('nextSyncToken')
+        mirrored.last_synced = time.monotonic()
+
+    def refresh(self, service, calendar_id, max_age=None):
+        """Brings one calendar up to date if its last sync is older than max_age seconds."""
+        if max_age is None:
+            max_age = self.refresh_seconds
+        mirrored = self._get(calendar_id)
+        with mirrored.lock:
+            if mirrored.last_synced is None or time.monotonic() - mirrored.last_synced >= max_age:
+                self._sync(service, calendar_id, mirrored)
+
+    def list_events(self, service, calendar_id, time_min, time_max, max_age=None):
+        """Returns mirrored events overlapping [time_min, time_max), ordered by start time."""
+        self.refresh(service, calendar_id, max_age=max_age)
+        mirrored = self._get(calendar_id)
+        with mirrored.lock:
+            return mirrored.query(time_min, time_max)
+
+    def record_event(self, calendar_id, event):
+        """Applies an event we just wrote so it is visible without waiting for the next delta."""
+        mirrored = self._get(calendar_id)
+        with mirrored.lock:
+            mirrored.apply(event)
+
+_event_mirror = CalendarEventMirror(CALENDAR_MIRROR_REFRESH_SECONDS)
+
+# --- Parallel Calendar Fan-Out ---
+# Per-calendar mirror refreshes run concurrently on a small shared pool, so request latency
+# tracks the slowest calendar rather than the sum of all of them.
+CALENDAR_FANOUT_WORKERS = int(os.getenv("CALENDAR_FANOUT_WORKERS", "4"))
+CALENDAR_FANOUT_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_FANOUT_TIMEOUT_SECONDS", "20"))
+_calendar_executor = ThreadPoolExecutor(
+    max_workers=max(1, CALENDAR_FANOUT_WORKERS),
+    thread_name_prefix="calendar_fanout",
+)
+
+def fan_out_calendars(fn, calendar_ids=None, timeout=None):
+    """
+    Runs fn(calendar_id) for each calendar concurrently.
+    Returns (results, failures): results maps calendar_id -> return value in calendar order
+    (same merge order as a serial loop); failures maps calendar_id -> exception, including
+    TimeoutError for calls that exceeded the per-call timeout.
+    """
+    if calendar_ids is None:
+        calendar_ids = CALENDAR_IDS
+    if timeout is None:
+        timeout = CALENDAR_FANOUT_TIMEOUT_SECONDS
+
+    futures = {calendar_id: _calendar_executor.submit(fn, calendar_id) for calendar_id in calendar_ids}
+    deadline = time.monotonic() + timeout
+    results = {}
+    failures = {}
+    for calendar_id, future in futures.items():
+        try:
+            results[calendar_id] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            failures[calendar_id] = TimeoutError(f"timed out after {timeout:g}s")
+        except Exception as e:
+            failures[calendar_id] = e
+    return results, failures
+
+def list_events_across_calendars(service, time_min, time_max, caller, max_age=None):
+    """Fetches mirrored events for every calendar in parallel; logs per-calendar failures for `caller`."""
+    results, failures = fan_out_calendars(
+        lambda calendar_id: _event_mirror.list_events(service, calendar_id, time_min, time_max, max_age=max_age)
+    )
+    for calendar_id, error in failures.items():
+        print(f"ERROR: {caller}: Failed to scan {calendar_id}: {error}")
+    return results
+
+# --- Busy-Time Index ---
+class BusyIntervalIndex:
+    """Merged, sorted busy intervals answering overlap and free-slot queries with bisect."""
+
+    def __init__(self, intervals=()):
+        merged = []
+        for start, end in sorted(intervals):
+            if end < start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [interval[0] for interval in merged]
+        self.ends = [interval[1] for interval in merged]
+
+    @classmethod
+    def from_events(cls, events):
+        """Builds an index from Calendar events, ignoring all-day and untimed entries."""
+        intervals = []
+        for event in events:
+            if 'dateTime' not in event.get('start', {}) or 'dateTime' not in event.get('end', {}):
+                continue
+            intervals.append((parse_iso_datetime(event['start']['dateTime']), parse_iso_datetime(event['end']['dateTime'])))
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _conflict_end(self, start, end):
+        """Returns the end of the busy interval overlapping [start, end), or None if it is free."""
+        # Intervals are disjoint, so only the last one starting before `end` can overlap.
+        i = bisect.bisect_left(self.starts, end) - 1
+        if i >= 0 and self.ends[i] > start:
+            return self.ends[i]
+        return None
+
+    def is_free(self, start, end):
+        return self._conflict_end(start, end) is None
+
+    def free_slots(self, window_start, window_end, duration, step, not_before=None):
+        """Yields step-aligned slot starts inside the window whose full duration is free."""
+        potential_start = window_start
+        if not_before is not None and potential_start < not_before:
+            skipped_steps = -((window_start - not_before) // step)
+            potential_start = window_start + skipped_steps * step
+        while potential_start + duration <= window_end:
+            conflict_end = self._conflict_end(potential_start, potential_start + duration)
+            if conflict_end is None:
+                yield potential_start
+                potential_start += step
+            else:
+                # Jump straight past the blocking interval, staying on the window's step grid.
+                skipped_steps = max(1, -((potential_start - conflict_end) // step))
+                potential_start += skipped_steps * step
+
 def parse_waitlist_date(date_str):
     """Parses dates posted by the waitlist form into a local date."""
     if not date_str:
@@ -386,40 +909,14 @@ def find_waitlist_event_slot(service, requested_date):
     event_duration = timedelta(minutes=30)
     slot_interval = timedelta(minutes=15)
 
-    busy_slots = []
-    for calendar_id in CALENDAR_IDS:
-        try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=window_start.isoformat(),
-                timeMax=window_end.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            for event in events_result.get('items', []):
-                if 'dateTime' not in event.get('start', {}) or 'dateTime' not in event.get('end', {}):
-                    continue
-
-                busy_slots.append({
-                    'start': parse_iso_datetime(event['start']['dateTime']),
-                    'end': parse_iso_datetime(event['end']['dateTime'])
-                })
-        except Exception as e:
-            print(f"ERROR: find_waitlist_event_slot: Failed to scan {calendar_id}: {e}")
+    busy_events = []
+    for calendar_events in list_events_across_calendars(service, window_start, window_end, "find_waitlist_event_slot").values():
+        busy_events.extend(calendar_events)
 
-    potential_start = window_start
-    while potential_start + event_duration <= window_end:
+    busy_index = BusyIntervalIndex.from_events(busy_events)
+    for potential_start in busy_index.free_slots(window_start, window_end, event_duration, slot_interval):
         potential_end = potential_start + event_duration
-        has_overlap = any(
-            potential_start < busy['end'] and potential_end > busy['start']
-            for busy in busy_slots
-        )
-
-        if not has_overlap:
-            return potential_start.astimezone(timezone.utc), potential_end.astimezone(timezone.utc)
-
-        potential_start += slot_interval
+        return potential_start.astimezone(timezone.utc), potential_end.astimezone(timezone.utc)
 
     return None, None
 
@@ -431,92 +928,112 @@ def _format_waitlist_client_date_line(option_num, data):
         return f"Date {option_num}: N/A"
     return f"Date {option_num}: {time_val} on {date_val}"
 
-def _handle_waitlist_emails_background(first_name, client_email, data, event_descriptions):
-    """Background task to send waitlist confirmation emails to client and admin."""
-    esc = html.escape
-
-    if client_email:
-        try:
-            date_lines = [
-                _format_waitlist_client_date_line(option_num, data)
-                for option_num in range(1, 4)
-            ]
-            date_lines_html = "<br>".join(esc(line) for line in date_lines)
-            client_subject = "Waitlist Confirmation"
-            client_body_html = f"""
-            <p>Hi {esc(first_name)}!</p>
-            <p>Thanks for adding yourself to the waitlist for the following dates:</p>
-            <p>{date_lines_html}</p>
-            <p>If any appointments open up that match your request I will be sure to reach out to you!</p>
-            <p>High Five!<br>Chelsea</p>
-            """
-            client_email_sent, _ = send_email(client_email, client_subject, client_body_html)
-            if client_email_sent:
-                print(f"BACKGROUND_TASK: Waitlist confirmation email sent to client {client_email}")
-            else:
-                print(f"BACKGROUND_TASK: WARNING: Failed to send waitlist confirmation email to client {client_email}")
-        except Exception as e:
-            print(f"ERROR: Failed to send waitlist confirmation email to client: {e}")
-
-    try:
-        admin_email = SENDER_EMAIL
-        admin_subject = "Client added to waitlist"
-        admin_body_text = "\n\n---\n\n".join(event_descriptions)
-        admin_body_html = f'<pre style="font-family: inherit; white-space: pre-wrap;">{esc(admin_body_text)}</pre>'
-        admin_email_sent, _ = send_email(admin_email, admin_subject, admin_body_html)
-        if admin_email_sent:
-            print("BACKGROUND_TASK: Waitlist notification email sent to admin.")
-        else:
-            print("BACKGROUND_TASK: WARNING: Failed to send waitlist notification email to admin.")
-    except Exception as e:
-        print(f"ERROR: Failed to send waitlist notification email to admin: {e}")
-
-def send_email(receiver_email, subject, body_html, attachment_data=None, attachment_filename=None):
-    """Sends an email using the Google Gmail API (Port 443)."""
-
-    if not receiver_email:
-        error_msg = "ERROR: send_email: Receiver email address is required but was empty."
-        print(error_msg)
-        return False, error_msg
-
-    service = get_gmail_service()
-    if not service:
-        print("CRITICAL ERROR: Could not build Gmail service.")
-        return False, "Could not build Gmail service."
-
-    message = MIMEMultipart()
-    message["Subject"] = subject
-    message["From"] = SENDER_EMAIL
-    message["To"] = receiver_email
-    # Ensure replies go to the business email, even if sent by the service account
-    message["Reply-To"] = SENDER_EMAIL
-
-    message.attach(MIMEText(body_html, "html"))
-
+# --- Email Delivery ---
+# Every send used to build a MIMEMultipart, then go out on the shared Gmail client's single
+# httplib2 connection, which is not safe to use from the booking/intake/waitlist/reminder threads
+# at once. Sends now go through the pooled Google transport, messages that go out together
+# (client + admin) share one Gmail batch request, and email bodies are precompiled templates
+# that only substitute their variable parts.
+class EmailTemplate:
+    """A subject/body pair compiled once; render() substitutes only the $placeholders."""
+
+    def __init__(self, subject, body_html):
+        self.subject = string.Template(subject)
+        self.body_html = string.Template(body_html)
+
+    def render(self, **fields):
+        """Returns (subject, body_html). Callers pass values already HTML-escaped."""
+        return self.subject.substitute(fields), self.body_html.substitute(fields)
+
+def build_email_body(receiver_email, subject, body_html, attachment_data=None, attachment_filename=None):
+    """Returns the Gmail API send body for one message."""
     if attachment_data and attachment_filename:
+        message = MIMEMultipart()
+        message.attach(MIMEText(body_html, "html"))
         part = MIMEBase("application", "pdf")
         part.set_payload(attachment_data)
         encoders.encode_base64(part)
         part.add_header("Content-Disposition", f"attachment; filename=\"{attachment_filename}\"")
         message.attach(part)
+    else:
+        # No attachment: a single text/html part, without the multipart wrapper.
+        message = MIMEText(body_html, "html")
+    message["Subject"] = subject
+    message["From"] = SENDER_EMAIL
+    message["To"] = receiver_email
+    # Ensure replies go to the business email, even if sent by the service account
+    message["Reply-To"] = SENDER_EMAIL
 
     # Encode the message for the Gmail API
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    body = {'raw': raw_message}
+    return {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
+
+def send_emails(messages):
+    """
+    Sends [(receiver_email, subject, body_html[, attachment_data, attachment_filename]), ...]
+    using the Google Gmail API (Port 443). Two or more messages go out as one batch request.
+    Returns [(success, error_message), ...] in the same order.
+    """
+    results = [None] * len(messages)
+    pending = []
+    for index, message in enumerate(messages):
+        if not message[0]:
+            error_msg = "ERROR: send_email: Receiver email address is required but was empty."
+            print(error_msg)
+            results[index] = (False, error_msg)
+        else:
+            pending.append((index, build_email_body(*message)))
+    if pending:
+        _send_email_bodies(pending, results)
+    return results
+
+def _send_email_bodies(pending, results):
+    """Sends [(index, body), ...] and writes each outcome into results[index]."""
+    service = get_gmail_service()
+    if not service:
+        print("CRITICAL ERROR: Could not build Gmail service.")
+        for index, _ in pending:
+            results[index] = (False, "Could not build Gmail service.")
+        return
+
+    def record(index, sent_message, error):
+        if error is None:
+            print(f"Email sent successfully! Message ID: {sent_message['id']}")
+            results[index] = (True, None)
+        else:
+            error_msg = f'An error occurred sending email: {error}'
+            print(error_msg)
+            results[index] = (False, error_msg)
 
     try:
         # Use SENDER_EMAIL as userId to ensure the Gmail API sends from the correct Workspace account
-        sent_message = service.users().messages().send(userId=SENDER_EMAIL, body=body).execute()
-        print(f"Email sent successfully! Message ID: {sent_message['id']}")
-        return True, None
-    except HttpError as error:
-        error_msg = f'An error occurred sending email: {error}'
-        print(error_msg)
-        return False, error_msg
+        if len(pending) == 1:
+            index, body = pending[0]
+            try:
+                sent_message = service.users().messages().send(userId=SENDER_EMAIL, body=body).execute()
+            except HttpError as error:
+                record(index, None, error)
+            else:
+                record(index, sent_message, None)
+            return
+
+        batch = service.new_batch_http_request()
+        for index, body in pending:
+            batch.add(
+                service.users().messages().send(userId=SENDER_EMAIL, body=body),
+                callback=lambda request_id, response, exception: record(int(request_id), response, exception),
+                request_id=str(index)
+            )
+        batch.execute()
     except Exception as e:
         error_msg = f"Unexpected error sending email: {e}"
         print(error_msg)
-        return False, error_msg
+        for index, _ in pending:
+            if results[index] is None:
+                results[index] = (False, error_msg)
+
+def send_email(receiver_email, subject, body_html, attachment_data=None, attachment_filename=None):
+    """Sends an email using the Google Gmail API (Port 443)."""
+    return send_emails([(receiver_email, subject, body_html, attachment_data, attachment_filename)])[0]
 
 
 # --- Frontend Routes ---
@@ -595,14 +1112,8 @@ def intake_page():
             sheets_service = get_sheets_service()
             if sheets_service:
                 # Check column I (Calendar ID) in Intake Forms sheet
-                result = sheets_service.spreadsheets().values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range="'Intake Forms'!I:I"
-                ).execute()
-
-                rows = result.get('values', [])
-                # Flatten rows into a list of strings
-                existing_ids = [row[0] for row in rows if row]
+                rows = read_sheet_ranges(sheets_service, {'ids': ("'Intake Forms'!I:I", SingleColumnRow)})['ids']
+                existing_ids = [row.value for row in rows]
 
                 if calendar_id in existing_ids:
                     return redirect(url_for('intake_confirmation_page'))
@@ -641,261 +1152,1491 @@ def intake_confirmation_page():
     """Serves the intake form confirmation page."""
     return render_template('IntakeConfirm.html')
 
-def _get_available_dates_list(days_to_scan=180):
-    """Internal helper to get a list of dates with "open for bookings" events."""
+# --- Available-Days Cache ---
+# "Open for bookings" blocks rarely change, so the 180-day scan behind /api/available-days is
+# memoized. Fresh entries are served directly; stale ones are served once more while a single
+# background refresh runs. Creating events clears the cache immediately.
+DEFAULT_TENANT_ID = "default"
+AVAILABLE_DAYS_CACHE_TTL_SECONDS = float(os.getenv("AVAILABLE_DAYS_CACHE_TTL_SECONDS", "300"))
+AVAILABLE_DAYS_CACHE_STALE_SECONDS = float(os.getenv("AVAILABLE_DAYS_CACHE_STALE_SECONDS", "3600"))
+# ?range= is client-supplied: it is clamped to AVAILABLE_DAYS_MAX_RANGE and the cache keeps at most
+# AVAILABLE_DAYS_CACHE_MAX_ENTRIES scans (least recently used dropped), so odd values can't pile up.
+AVAILABLE_DAYS_MAX_RANGE = 365
+AVAILABLE_DAYS_CACHE_MAX_ENTRIES = 16
+
+class StaleWhileRevalidateCache:
+    """Thread-safe, size-bounded (LRU) TTL cache with stale-while-revalidate refresh and hit/miss counters."""
+
+    def __init__(self, name, ttl_seconds, stale_seconds, max_entries):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0, "invalidations": 0, "evictions": 0,
+        }
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() on a miss.
+        loader must return (value, cacheable); incomplete results are returned but not stored.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry[1]
+                if age < self.ttl_seconds:
+                    self._stats["hits"] += 1
+                    return entry[0]
+                if age < self.ttl_seconds + self.stale_seconds:
+                    self._stats["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(
+                            target=self._refresh, name=f"{self.name}_refresh", args=(key, loader, self._generation), daemon=True
+                        ).start()
+                    return entry[0]
+            self._stats["misses"] += 1
+            generation = self._generation
+
+        value, cacheable = loader()
+        if cacheable:
+            self._store(key, value, generation)
+        return value
+
+    def _refresh(self, key, loader, generation):
+        try:
+            value, cacheable = loader()
+            if cacheable:
+                self._store(key, value, generation)
+            with self._lock:
+                self._stats["refreshes"] += 1
+        except Exception as e:
+            print(f"ERROR: {self.name}: Background refresh failed for {key}: {e}")
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            # Drop results computed before an invalidation; they may predate the change.
+            if generation == self._generation:
+                self._entries[key] = (value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+_available_days_cache = StaleWhileRevalidateCache(
+    "available_days_cache", AVAILABLE_DAYS_CACHE_TTL_SECONDS, AVAILABLE_DAYS_CACHE_STALE_SECONDS,
+    AVAILABLE_DAYS_CACHE_MAX_ENTRIES
+)
+
+def _get_available_dates_list(days_to_scan=180, tenant_id=DEFAULT_TENANT_ID):
+    """Internal helper to get a list of dates with "open for bookings" events (cached)."""
+    return _available_days_cache.get((tenant_id, days_to_scan), lambda: _scan_available_dates(days_to_scan))
+
+def _scan_available_dates(days_to_scan):
+    """Scans every calendar; returns (sorted dates, whether all calendars were read successfully)."""
     start_date = datetime.datetime.now(timezone.utc)
     end_date = start_date + timedelta(days=days_to_scan)
 
     service = get_calendar_service()
     if not service:
         print("DEBUG: _get_available_dates_list: Could not get calendar service.")
-        return []
+        return [], False
 
     # Final safety check to prevent 404 // malformed URLs
     available_dates_set = set()
 
-    for calendar_id in CALENDAR_IDS:
-        try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=start_date.isoformat(),
-                timeMax=end_date.isoformat(),
-                singleEvents=True
-            ).execute()
-            all_events = events_result.get('items', [])
-
-            for event in all_events:
-                # Added .strip() to handle accidental leading/trailing spaces in Calendar event titles
-                if event.get('summary', '').strip().lower() == 'open for bookings':
-                    if 'dateTime' in event['start']:
-                        available_dates_set.add(event['start']['dateTime'].split('T')[0])
-                    elif 'date' in event['start']:
-                        available_dates_set.add(event['start']['date'])
-        except Exception as e:
-            print(f"ERROR: _get_available_dates_list: Failed to scan {calendar_id}: {e}")
+    results = list_events_across_calendars(service, start_date, end_date, "_get_available_dates_list")
+    for all_events in results.values():
+        for event in all_events:
+            # Added .strip() to handle accidental leading/trailing spaces in Calendar event titles
+            if event.get('summary', '').strip().lower() == 'open for bookings':
+                if 'dateTime' in event['start']:
+                    available_dates_set.add(event['start']['dateTime'].split('T')[0])
+                elif 'date' in event['start']:
+                    available_dates_set.add(event['start']['date'])
 
     if not available_dates_set:
         print(f"DEBUG: _get_available_dates_list: No 'Open for Bookings' events found in {CALENDAR_IDS}")
 
-    return sorted(available_dates_set)
-
-
-# --- API Endpoints ---
+    return sorted(available_dates_set), len(results) == len(CALENDAR_IDS)
+
+
+# --- Sheets Read Layer ---
+# Reads go through read_sheet_ranges, which fetches every range a request or background task
+# needs in one values().batchGet() and wraps each row in a typed view with named columns.
+def _sheet_column(index):
+    return property(lambda self: self.values[index] if len(self.values) > index else "")
+
+class SheetRowView:
+    """Named-column view over a raw Sheets row; missing trailing cells read as ''."""
+
+    __slots__ = ('values',)
+    WIDTH = 0
+
+    def __init__(self, values):
+        self.values = values
+
+    def padded(self):
+        """Pads the underlying row in place to the full width so cells can be assigned."""
+        self.values.extend([''] * (self.WIDTH - len(self.values)))
+        return self.values
+
+class ClientRow(SheetRowView):
+    """Clients!A:H"""
+
+    __slots__ = ()
+    WIDTH = 8
+    first_name = _sheet_column(0)
+    last_name = _sheet_column(1)
+    email = _sheet_column(2)
+    phone = _sheet_column(3)
+    dob = _sheet_column(4)
+    address = _sheet_column(5)
+    square_customer_id = _sheet_column(6)
+    square_card_id = _sheet_column(7)
+
+class IntakeRow(SheetRowView):
+    """'Intake Forms'!A:J"""
+
+    __slots__ = ()
+    WIDTH = 10
+    submitted_at = _sheet_column(0)
+    booking = _sheet_column(1)
+    client_name = _sheet_column(2)
+    reason = _sheet_column(3)
+    conditions = _sheet_column(4)
+    allergies = _sheet_column(5)
+    drive_link = _sheet_column(6)
+    soap_notes = _sheet_column(7)
+    calendar_id = _sheet_column(8)
+    email = _sheet_column(9)
+
+class OnsiteRow(SheetRowView):
+    """'On-Site Requests'!A:H"""
+
+    __slots__ = ()
+    WIDTH = 8
+    full_name = _sheet_column(0)
+    email = _sheet_column(1)
+    phone = _sheet_column(2)
+    address = _sheet_column(3)
+
+class SingleColumnRow(SheetRowView):
+    """Any one-column range such as Clients!C:C or 'Intake Forms'!I:I."""
+
+    __slots__ = ()
+    WIDTH = 1
+    value = _sheet_column(0)
+
+def read_sheet_ranges(service, ranges, spreadsheet_id=None, value_render_option=None):
+    """
+    Reads several A1 ranges in a single values().batchGet().
+    `ranges` maps a caller-chosen name to (a1_range, row_view_class); returns name -> list of views.
+    """
+    names = list(ranges)
+    options = {'valueRenderOption': value_render_option} if value_render_option else {}
+    response = execute_with_retry(service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id or SPREADSHEET_ID,
+        ranges=[ranges[name][0] for name in names],
+        **options
+    ))
+    value_ranges = response.get('valueRanges', [])
+    result = {}
+    for position, name in enumerate(names):
+        row_class = ranges[name][1]
+        rows = value_ranges[position].get('values', []) if position < len(value_ranges) else []
+        result[name] = [row_class(list(row)) for row in rows]
+    return result
+
+# --- Sheet ID Resolver ---
+# Prepends need a tab's numeric sheetId. It was looked up by downloading the full spreadsheet
+# metadata on every write; tab IDs almost never change, so they are cached for the process.
+class SheetIdCache:
+    """Process-wide tab title -> sheetId map, refetched (properties only) on a miss or stale ID."""
+
+    def __init__(self):
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def get(self, service, title, refresh=False):
+        """Returns the sheetId for a tab title, or None if the spreadsheet has no such tab."""
+        with self._lock:
+            if refresh or self._ids is None or title not in self._ids:
+                spreadsheet = execute_with_retry(service.spreadsheets().get(
+                    spreadsheetId=SPREADSHEET_ID,
+                    fields='sheets.properties'
+                ))
+                self._ids = {
+                    sheet['properties']['title']: sheet['properties']['sheetId']
+                    for sheet in spreadsheet.get('sheets', [])
+                }
+            return self._ids.get(title)
 
-@app.route('/api/lookup-client', methods=['GET'])
-def lookup_client():
-    """Searches both Clients and On-Site Requests sheets for an existing profile."""
-    identifier = request.args.get('identifier', '').strip()
-    if not identifier:
-        return jsonify({"found": False}), 400
+_sheet_ids = SheetIdCache()
 
-    service = get_sheets_service()
-    if not service:
-        return jsonify({"error": "Sheets service unavailable"}), 500
+def batch_update_sheets(service, titles, build_requests):
+    """
+    Runs one spreadsheets().batchUpdate() with requests built by build_requests({title: sheet_id}).
+    If Sheets rejects a cached sheetId (tab deleted/recreated), the IDs are re-resolved once.
+    Row inserts are not idempotent, so the batch is not retried after a 5xx (see execute_with_retry).
+    """
+    for attempt in range(2):
+        sheet_ids = {}
+        for title in titles:
+            sheet_id = _sheet_ids.get(service, title, refresh=attempt > 0 and not sheet_ids)
+            if sheet_id is None:
+                raise LookupError(f"Tab '{title}' not found in the spreadsheet.")
+            sheet_ids[title] = sheet_id
+        try:
+            return execute_with_retry(service.spreadsheets().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={'requests': build_requests(sheet_ids)}
+            ), idempotent=False)
+        except HttpError as e:
+            if attempt == 0 and e.resp.status == 400 and 'grid' in str(e).lower():
+                print(f"DEBUG: SheetIdCache: cached sheetIds for {list(titles)} look stale; refreshing.")
+                continue
+            raise
 
-    try:
-        search_email = norm_email(identifier)
-        search_phone = "".join(filter(str.isdigit, identifier))
+def insert_top_rows_request(sheet_id, count):
+    """insertDimension request that pushes a tab's data down by `count` empty rows at SHEET_INSERT_START_INDEX."""
+    return {
+        "insertDimension": {
+            "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": SHEET_INSERT_START_INDEX, "endIndex": SHEET_INSERT_START_INDEX + count},
+            "inheritFromBefore": False
+        }
+    }
 
-        # 1. Search the primary "Clients" sheet
-        clients_result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='Clients!A:H'
-        ).execute()
-        clients_rows = clients_result.get('values', [])
+def _a1_column(index):
+    return string.ascii_uppercase[index]
 
-        for row in clients_rows:
-            if len(row) < 3:
-                continue
-            row_email = norm_email(row[2])
-            row_phone = "".join(filter(str.isdigit, row[3])) if len(row) > 3 else ""
+def _is_blank_row(values):
+    return all(cell == '' for cell in values)
 
-            if (row_email == search_email) or (search_phone and row_phone == search_phone):
-                # Check if square_card_id (Column H) exists
-                square_card_id = row[7] if len(row) > 7 else ""
-                full_name_to_match = f"{row[0]} {row[1]}".strip().lower()
+def _row_matches(written, read):
+    """
+    True if a row read back with valueRenderOption=FORMULA holds `written`: every cell Sheets kept
+    as text equals what we wrote, and cells it parsed into numbers, dates or booleans are skipped.
+    """
+    matched_text = False
+    for position in range(max(len(written), len(read))):
+        value = written[position] if position < len(written) else ''
+        text = '' if value is None else str(value)
+        cell = read[position] if position < len(read) else ''
+        if isinstance(cell, str):
+            if cell != text:
+                return False
+            matched_text = matched_text or bool(cell)
+        elif not text:
+            return False
+    return matched_text
+
+# --- Client Directory ---
+# /api/lookup-client used to download the whole Clients tab (plus Intake Forms and On-Site
+# Requests) on every lookup. The directory indexes those tabs in memory by normalized email and
+# phone digits. Our own Sheets writes are applied write-through, and a background reload picks
+# up manual edits every CLIENT_DIRECTORY_REFRESH_SECONDS.
+CLIENT_DIRECTORY_REFRESH_SECONDS = float(os.getenv("CLIENT_DIRECTORY_REFRESH_SECONDS", "300"))
+
+class ClientDirectory:
+    """
+    O(1) client lookups over the Clients, Intake Forms and On-Site Requests tabs.
+    Each key maps to (position, row view); rows are prepended to these tabs, so the lowest
+    position (topmost row) wins and is the latest entry.
+    """
 
-                # --- Fetch latest health info from Intake Forms ---
-                conditions = ""
-                allergies = ""
-                try:
-                    intake_res = service.spreadsheets().values().get(
-                        spreadsheetId=SPREADSHEET_ID,
-                        range="'Intake Forms'!A:J"
-                    ).execute()
-                    intake_rows = intake_res.get('values', [])
-                    # Search backwards for the most recent entry matching this email
-                    # Fallback to Name matching for older records that don't have email in Column J
-                    for i_row in reversed(intake_rows):
-                        row_intake_email = norm_email(i_row[9]) if len(i_row) > 9 else ""
-                        row_intake_name = i_row[2].strip().lower() if len(i_row) > 2 else ""
-
-                        if (row_intake_email == row_email) or (not row_intake_email and row_intake_name == full_name_to_match):
-                            conditions = i_row[4] if len(i_row) > 4 else ""
-                            allergies = i_row[5] if len(i_row) > 5 else ""
-                            break
-                except Exception as intake_err:
-                    print(f"DEBUG: Failed to fetch health info: {intake_err}")
-
-                has_card_on_file = bool(square_card_id)
-                card_last_4 = ""
-
-                if has_card_on_file:
-                    try:
-                        # Retrieve card details from Square to get last 4 digits
-                        card_res = square_client.cards.retrieve_card(card_id=square_card_id)
-                        if card_res.is_success():
-                            card_last_4 = card_res.body['card'].get('last_4', '')
-                    except Exception as e:
-                        print(f"DEBUG: Failed to retrieve card details from Square: {e}")
-
-                return jsonify({
-                    "found": True,
-                    "firstName": row[0], "lastName": row[1], "email": row[2],
-                    "phone": row[3], "dob": row[4] if len(row) > 4 else "",
-                    "address": row[5] if len(row) > 5 else "",
-                    "hasCard": has_card_on_file,
-                    "last4": card_last_4,
-                    "conditions": conditions,
-                    "allergies": allergies
-                })
-
-        # 2. Fallback: Search the "On-Site Requests" sheet
-        # Range A:D captures Full Name, Email, Phone, and Address
-        onsite_result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range="'On-Site Requests'!A:D"
-        ).execute()
-        onsite_rows = onsite_result.get('values', [])
-
-        for row in onsite_rows:
-            if len(row) < 2:
-                continue
-            row_email = norm_email(row[1])
-            row_phone = "".join(filter(str.isdigit, row[2])) if len(row) > 2 else ""
-
-            if (row_email == search_email) or (search_phone and row_phone == search_phone):
-                # Split the full name from column A into first and last parts
-                full_name = row[0]
-                name_parts = full_name.split(' ', 1)
-                first = name_parts[0]
-                last = name_parts[1] if len(name_parts) > 1 else ""
-
-                return jsonify({
-                    "found": True,
-                    "firstName": first,
-                    "lastName": last,
-                    "email": row[1],
-                    "phone": row[2] if len(row) > 2 else "",
-                    "dob": "", # DOB is not collected during on-site requests
-                    "address": row[3] if len(row) > 3 else "",
-                    "hasCard": False, # On-site requests don't store cards on file
-                    "conditions": "",
-                    "allergies": ""
-                })
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._index = None
+        self._loaded_at = None
+        self._reloading = False
+        self._writes_during_reload = []
+        self._next_position = -1
+
+    @staticmethod
+    def _put(table, key, position, row):
+        if key and (key not in table or position < table[key][0]):
+            table[key] = (position, row)
+
+    @classmethod
+    def _add_client(cls, index, position, row):
+        cls._put(index["clients_by_email"], norm_email(row.email), position, row)
+        cls._put(index["clients_by_phone"], norm_phone_digits(row.phone), position, row)
+
+    @classmethod
+    def _add_intake(cls, index, position, row):
+        intake_email = norm_email(row.email)
+        if intake_email:
+            cls._put(index["intake_by_email"], intake_email, position, row)
+        else:
+            # Older intake rows have no email (Column J); they are matched by full name instead.
+            cls._put(index["intake_by_name"], row.client_name.strip().lower(), position, row)
+
+    @classmethod
+    def _add_onsite(cls, index, position, row):
+        cls._put(index["onsite_by_email"], norm_email(row.email), position, row)
+        cls._put(index["onsite_by_phone"], norm_phone_digits(row.phone), position, row)
+
+    @classmethod
+    def build_index(cls, clients_rows, intake_rows, onsite_rows):
+        index = {
+            "clients_by_email": {}, "clients_by_phone": {},
+            "intake_by_email": {}, "intake_by_name": {},
+            "onsite_by_email": {}, "onsite_by_phone": {},
+        }
+        for position, row in enumerate(clients_rows):
+            if len(row.values) >= 3:
+                cls._add_client(index, position, row)
+        for position, row in enumerate(intake_rows):
+            cls._add_intake(index, position, row)
+        for position, row in enumerate(onsite_rows):
+            if len(row.values) >= 2:
+                cls._add_onsite(index, position, row)
+        return index
+
+    def _load(self, service):
+        tabs = read_sheet_ranges(service, {
+            'clients': ('Clients!A:H', ClientRow),
+            'intake': ("'Intake Forms'!A:J", IntakeRow),
+            'onsite': ("'On-Site Requests'!A:D", OnsiteRow),
+        })
+        return self.build_index(tabs['clients'], tabs['intake'], tabs['onsite'])
 
-        return jsonify({"found": False})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    def _reload_background(self, service):
+        try:
+            index = self._load(service)
+            with self._lock:
+                # Re-apply writes that landed while the reload was reading Sheets.
+                for apply_write in self._writes_during_reload:
+                    apply_write(index)
+                self._index = index
+                self._loaded_at = time.monotonic()
+            print("DEBUG: ClientDirectory: Reloaded client index from Sheets.")
+        except Exception as e:
+            print(f"ERROR: ClientDirectory: Background reload failed: {e}")
+        finally:
+            with self._lock:
+                self._reloading = False
+                self._writes_during_reload = []
+
+    def _current_index(self, service):
+        with self._lock:
+            index = self._index
+            if index is not None:
+                if time.monotonic() - self._loaded_at >= self.refresh_seconds and not self._reloading:
+                    self._reloading = True
+                    threading.Thread(target=self._reload_background, name="client_directory_reload", args=(service,), daemon=True).start()
+                return index
+
+        with self._load_lock:
+            if self._index is None:
+                index = self._load(service)
+                with self._lock:
+                    self._index = index
+                    self._loaded_at = time.monotonic()
+            return self._index
+
+    def lookup(self, service, identifier):
+        """
+        Returns (source, row, intake_row) for the identifier (email or phone), where source is
+        'clients' (ClientRow), 'onsite' (OnsiteRow) or None. Returned views are copies.
+        """
+        index = self._current_index(service)
+        search_email = norm_email(identifier)
+        search_phone = norm_phone_digits(identifier)
 
-@app.route('/api/available-days', methods=['GET'])
-def get_available_days():
-    """Scans a date range and returns a list of dates ('YYYY-MM-DD')."""
-    # Get range from query params, default to 180 days (6 months)
-    days = request.args.get('range', default=180, type=int)
-    available_dates = _get_available_dates_list(days_to_scan=days)
-    return jsonify(available_dates)
+        with self._lock:
+            match = min(
+                filter(None, [index["clients_by_email"].get(search_email), index["clients_by_phone"].get(search_phone)]),
+                default=None,
+                key=lambda entry: entry[0],
+            )
+            if match:
+                row = match[1]
+                full_name = f"{row.first_name} {row.last_name}".strip().lower()
+                intake = min(
+                    filter(None, [index["intake_by_email"].get(norm_email(row.email)), index["intake_by_name"].get(full_name)]),
+                    default=None,
+                    key=lambda entry: entry[0],
+                )
+                return 'clients', ClientRow(list(row.values)), IntakeRow(list(intake[1].values)) if intake else None
 
-@app.route('/api/availability', methods=['GET'])
-def get_availability():
+            match = min(
+                filter(None, [index["onsite_by_email"].get(search_email), index["onsite_by_phone"].get(search_phone)]),
+                default=None,
+                key=lambda entry: entry[0],
+            )
+            if match:
+                return 'onsite', OnsiteRow(list(match[1].values)), None
+        return None, None, None
+
+    def _write_through(self, apply_write):
+        with self._lock:
+            if self._index is not None:
+                apply_write(self._index)
+            if self._reloading:
+                self._writes_during_reload.append(apply_write)
+
+    def _prepend_position(self):
+        with self._lock:
+            position = self._next_position
+            self._next_position -= 1
+            return position
+
+    def record_client_row(self, values):
+        """Applies a Clients row we just prepended."""
+        position = self._prepend_position()
+        self._write_through(lambda index: self._add_client(index, position, ClientRow(list(values))))
+
+    @classmethod
+    def _apply_client_update(cls, index, key, values_by_column):
+        entry = index["clients_by_email"].get(key)
+        if not entry:
+            return False
+        position, row = entry
+        old_phone = norm_phone_digits(row.phone)
+        cells = row.padded()
+        for column, value in values_by_column.items():
+            cells[column] = value
+        new_phone = norm_phone_digits(row.phone)
+        if new_phone != old_phone:
+            if index["clients_by_phone"].get(old_phone, (None, None))[1] is row:
+                del index["clients_by_phone"][old_phone]
+            cls._put(index["clients_by_phone"], new_phone, position, row)
+        return True
+
+    def update_client(self, email, values_by_column):
+        """Applies in-place Clients cell updates (column index -> value) for the client with this email."""
+        key = norm_email(email)
+        self._write_through(lambda index: self._apply_client_update(index, key, values_by_column))
+
+    def upsert_client(self, values, values_by_column):
+        """Mirrors SheetsWriteBehind.upsert_client(): update the client's columns, or add `values` as a new row."""
+        key = norm_email(values[2])
+        position = self._prepend_position()
+
+        def apply_write(index):
+            if not self._apply_client_update(index, key, values_by_column):
+                self._add_client(index, position, ClientRow(list(values)))
+
+        self._write_through(apply_write)
+
+    def record_intake_row(self, values):
+        """Applies an Intake Forms row we just prepended."""
+        position = self._prepend_position()
+        self._write_through(lambda index: self._add_intake(index, position, IntakeRow(list(values))))
+
+    def record_onsite_row(self, values):
+        """Applies an On-Site Requests row we just prepended."""
+        position = self._prepend_position()
+        cells = ['' if value is None else str(value) for value in values]
+        self._write_through(lambda index: self._add_onsite(index, position, OnsiteRow(cells)))
+
+_client_directory = ClientDirectory(CLIENT_DIRECTORY_REFRESH_SECONDS)
+
+# --- Local State (SQLite) ---
+# Small on-disk store for state that must survive a worker recycle (gunicorn max_requests).
+LOCAL_STATE_DB = os.getenv("LOCAL_STATE_DB", "local_state.sqlite3").strip()
+
+def local_state_db():
+    """Opens a connection to the local state database (WAL, so the old and new worker can overlap)."""
+    conn = sqlite3.connect(LOCAL_STATE_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def acquire_local_lease(conn, name, owner, ttl_seconds):
+    """Takes (or renews) a named cross-process lease; returns True if `owner` now holds it."""
+    now = time.time()
+    conn.execute("INSERT OR IGNORE INTO leases (name, owner, expires_at) VALUES (?, NULL, 0)", (name,))
+    cursor = conn.execute(
+        "UPDATE leases SET owner = ?, expires_at = ? WHERE name = ? AND (owner IS NULL OR owner = ? OR expires_at < ?)",
+        (owner, now + ttl_seconds, name, owner, now)
+    )
+    return cursor.rowcount == 1
+
+def release_local_lease(conn, name, owner):
+    conn.execute("UPDATE leases SET owner = NULL WHERE name = ? AND owner = ?", (name, owner))
+
+def _init_local_state_db():
+    with closing(local_state_db()) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL NOT NULL)")
+
+# --- Sheets Write-Behind Queue ---
+# Booking, intake, waitlist and on-site writes each used to call the Sheets API directly, and a
+# burst of bookings could hit the per-user write quota. Mutations are now journaled to SQLite and
+# flushed every SHEETS_FLUSH_INTERVAL_SECONDS (or once SHEETS_FLUSH_MAX_BATCH are pending) as one
+# row-insert batchUpdate plus one USER_ENTERED values().batchUpdate. Only one process flushes at a
+# time (lease), and rows are deleted from the journal only after Sheets accepts the batch, so
+# nothing is lost when a worker is recycled. A re-sent batch is first checked against the top of
+# each tab, so a send whose outcome was unknown is never applied twice.
+# A batch Sheets rejects as invalid (4xx) is re-sent in halves until the offending writes are
+# found; those move to a dead-letter table (payload and error kept, replayable through
+# /api/internal/sheets-dead-letters/replay) so they cannot block every later write. Quota,
+# auth and server errors never dead-letter anything: the journal just backs off and retries.
+SHEETS_FLUSH_INTERVAL_SECONDS = float(os.getenv("SHEETS_FLUSH_INTERVAL_SECONDS", "2"))
+SHEETS_FLUSH_MAX_BATCH = int(os.getenv("SHEETS_FLUSH_MAX_BATCH", "50"))
+SHEETS_FLUSH_MAX_BACKOFF_SECONDS = float(os.getenv("SHEETS_FLUSH_MAX_BACKOFF_SECONDS", "300"))
+SHEETS_FLUSH_LEASE_SECONDS = 120
+
+def is_rejected_sheets_request(error):
+    """True for an HttpError that re-sending the same request cannot fix (invalid request, too large)."""
+    return isinstance(error, HttpError) and 400 <= error.resp.status < 500 and error.resp.status not in (401, 403, 408, 429)
+
+class SheetsWriteBehind:
     """
-    API endpoint to get available start times for a given date and service duration.
-    Expects 'date' (YYYY-MM-DD) and 'duration' (in minutes) query parameters.
+    Durable, coalescing queue for Sheets mutations. Two operations are supported:
+      - prepend(tab, values): insert `values` as the new top row of a tab (order preserved).
+      - upsert_client(email, values, values_by_column): on the Clients tab, set the given
+        columns on the client's row if the email exists, otherwise prepend `values`
+        (values=None means update-only). Upserts for the same email merge, last write wins.
     """
-    date_str = request.args.get('date')
-    duration_str = request.args.get('duration')
 
-    if not date_str or not duration_str:
-        return jsonify({"error": "Both 'date' and 'duration' query parameters are required."}), 400
+    def __init__(self, interval, max_batch, max_backoff):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._hint_lock = threading.Lock()
+        self._pending_hint = 0
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        self._flushes = 0
+        self._flushed_ops = 0
+        self._failures = 0
+        self._last_error = None
+
+    def _init_schema(self):
+        _init_local_state_db()
+        with closing(local_state_db()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sheets_write_journal ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, sent_at REAL)"
+            )
+            # Journals created by older workers lack the newer columns.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sheets_write_journal)")}
+            if 'attempts' not in columns:
+                conn.execute("ALTER TABLE sheets_write_journal ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            if 'sent_at' not in columns:
+                conn.execute("ALTER TABLE sheets_write_journal ADD COLUMN sent_at REAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sheets_write_dead_letter ("
+                "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL)"
+            )
 
-    # --- New Availability Logic ---
-    try:
-        service_duration = int(duration_str)
-        total_block_duration = service_duration + 15 # Increased buffer from 10 to 15 minutes
-        start_of_day = datetime.datetime.fromisoformat(date_str).replace(hour=0, minute=0, second=0, tzinfo=timezone.utc)
-        end_of_day = start_of_day + timedelta(days=1)
-    except (ValueError, TypeError):
-        return jsonify({
-            "error": "Invalid date or duration format. Date should be YYYY-MM-DD and duration should be an integer."
-        }), 400
+    def start(self):
+        """Creates the journal and starts the flusher thread (idempotent)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._init_schema()
+                self._thread = threading.Thread(target=self._run, name="sheets_write_behind", daemon=True)
+                self._thread.start()
+
+    def _enqueue(self, kind, payload):
+        self.start()
+        with closing(local_state_db()) as conn:
+            conn.execute(
+                "INSERT INTO sheets_write_journal (kind, payload, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload, default=str), time.time())
+            )
+        with self._hint_lock:
+            self._pending_hint += 1
+            batch_ready = self._pending_hint >= self.max_batch
+        if batch_ready:
+            self._wake.set()
+
+    def prepend(self, tab, values):
+        self._enqueue('prepend', {'tab': tab, 'values': list(values)})
+
+    def upsert_client(self, email, values, values_by_column):
+        self._enqueue('client', {
+            'email': email,
+            'values': list(values) if values is not None else None,
+            'columns': {str(column): value for column, value in values_by_column.items()},
+        })
 
-    service = get_calendar_service()
-    if not service:
-        return jsonify({"error": "Could not connect to Google Calendar service."}), 500
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ERROR: SheetsWriteBehind: Flush loop error: {e}")
 
-    open_windows = []
-    busy_slots = []
+    @staticmethod
+    def _plan(ops, client_rows):
+        """
+        Resolves journaled ops into (updates, prepends): updates is a list of
+        (row_index, column, value) against the current Clients tab, prepends a list of
+        (tab, values) in journal order.
+        """
+        existing = {}
+        for position, row in enumerate(client_rows):
+            key = norm_email(row.value)
+            if key and key not in existing:
+                existing[key] = position
+        new_clients = {}
+        updates = {}
+        prepends = []
+        for kind, payload in ops:
+            if kind == 'prepend':
+                prepends.append((payload['tab'], payload['values']))
+                continue
+            key = norm_email(payload['email'])
+            columns = {int(column): value for column, value in payload['columns'].items()}
+            if key in new_clients:
+                # The client's row is being added in this same batch; fold the update into it.
+                for column, value in columns.items():
+                    new_clients[key][column] = value
+            elif key in existing:
+                updates.setdefault(key, {}).update(columns)
+            elif payload['values'] is not None:
+                values = ClientRow(list(payload['values'])).padded()
+                new_clients[key] = values
+                prepends.append(('Clients', values))
+        cell_updates = [
+            (existing[key], column, value)
+            for key, columns in updates.items()
+            for column, value in sorted(columns.items())
+        ]
+        return cell_updates, prepends
 
-    try:
-        # Scan all calendars to collect busy time, and scan for 'Open for Bookings' windows
-        for calendar_id in CALENDAR_IDS:
+    def flush(self):
+        """Sends everything journaled so far (up to max_batch per call) in one batchUpdate."""
+        with self._flush_lock, closing(local_state_db()) as conn:
+            if not acquire_local_lease(conn, 'sheets_write_behind', self.owner, SHEETS_FLUSH_LEASE_SECONDS):
+                return 0
+            try:
+                rows = conn.execute(
+                    "SELECT id, kind, payload, created_at, attempts, sent_at FROM sheets_write_journal ORDER BY id LIMIT ?", (self.max_batch,)
+                ).fetchall()
+                if not rows:
+                    with self._hint_lock:
+                        self._pending_hint = 0
+                    return 0
+                # Rows that were sent before may be in the sheet already (a 5xx or a timeout does not
+                # say whether the change was applied), so they are checked against it before re-sending.
+                verify = any(row[5] is not None for row in rows)
+                conn.execute("UPDATE sheets_write_journal SET sent_at = ? WHERE id <= ? AND sent_at IS NULL", (time.time(), rows[-1][0]))
+                try:
+                    self._send(self._ops(rows), verify=verify)
+                except Exception as e:
+                    self._failures += 1
+                    self._last_error = str(e)
+                    if not is_rejected_sheets_request(e):
+                        # Quota, auth, server or network trouble is not the writes' fault; keep them
+                        # journaled and back off (doubling per failure) instead of splitting the batch.
+                        self._consecutive_failures += 1
+                        delay = min(self.max_backoff, self.interval * (2 ** self._consecutive_failures)) * random.uniform(0.5, 1.0)
+                        self._retry_at = time.monotonic() + delay
+                        print(f"ERROR: SheetsWriteBehind: Failed to flush {len(rows)} queued writes (retrying in {delay:.0f}s): {e}")
+                        return 0
+                    conn.execute("UPDATE sheets_write_journal SET attempts = attempts + 1 WHERE id <= ?", (rows[-1][0],))
+                    rows = [row[:4] + (row[4] + 1,) + row[5:] for row in rows]
+                    print(f"ERROR: SheetsWriteBehind: Sheets rejected a batch of {len(rows)} writes; isolating the bad ones: {e}")
+                    sent = self._isolate(conn, rows)
+                else:
+                    conn.execute("DELETE FROM sheets_write_journal WHERE id <= ?", (rows[-1][0],))
+                    self._flushes += 1
+                    self._flushed_ops += len(rows)
+                    sent = len(rows)
+                self._consecutive_failures = 0
+                self._retry_at = 0.0
+                with self._hint_lock:
+                    self._pending_hint = max(0, self._pending_hint - len(rows))
+                if len(rows) == self.max_batch:
+                    self._wake.set()
+                return sent
+            finally:
+                release_local_lease(conn, 'sheets_write_behind', self.owner)
+
+    @staticmethod
+    def _ops(rows):
+        return [(kind, json.loads(payload)) for _, kind, payload, *_ in rows]
+
+    def _isolate(self, conn, rows):
+        """
+        Re-sends a rejected batch in halves, in journal order. A single write that Sheets still
+        rejects as invalid is moved to the dead-letter table; the rest are sent and removed.
+        Stops (leaving rows journaled) on any other error. Returns the number of writes sent.
+        """
+        sent = 0
+        pending = [rows]
+        while pending:
+            batch = pending.pop()
             try:
-                events_result = service.events().list(
-                    calendarId=calendar_id,
-                    timeMin=start_of_day.isoformat(),
-                    timeMax=end_of_day.isoformat(),
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-                all_events = events_result.get('items', [])
-
-                for event in all_events:
-                    summary = event.get('summary', '').strip().lower()
-                    if 'dateTime' not in event['start']:
-                        continue
-
-                    start = datetime.datetime.fromisoformat(event['start']['dateTime'].replace('Z', '+00:00'))
-                    end = datetime.datetime.fromisoformat(event['end']['dateTime'].replace('Z', '+00:00'))
-
-                    if summary == 'open for bookings':
-                        open_windows.append({'start': start, 'end': end})
-                    else:
-                        busy_slots.append({'start': start, 'end': end})
+                self._send(self._ops(batch), verify=True)
             except Exception as e:
-                print(f"ERROR: get_availability: Failed to scan {calendar_id}: {e}")
-
-        valid_start_times = []
-        time_slot_interval = timedelta(minutes=15)
-        earliest_bookable_start = datetime.datetime.now(timezone.utc) + timedelta(hours=1)
-
-        # Calculate availability based on the MERGED data from all calendars
-        for window in open_windows:
-            potential_start = window['start']
-            while potential_start < window['end']:
-                potential_end = potential_start + timedelta(minutes=total_block_duration)
-                if potential_end > window['end']:
-                    break
-                # Skip times within 1 hour of the current time.
-                if potential_start < earliest_bookable_start:
-                    potential_start += time_slot_interval
+                if not is_rejected_sheets_request(e):
+                    return sent
+                if len(batch) > 1:
+                    middle = len(batch) // 2
+                    pending.extend([batch[middle:], batch[:middle]])
                     continue
+                row_id, kind, payload, created_at, attempts, _ = batch[0]
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO sheets_write_dead_letter (id, kind, payload, created_at, attempts, error, failed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row_id, kind, payload, created_at, attempts, str(e), time.time())
+                )
+                conn.execute("DELETE FROM sheets_write_journal WHERE id = ?", (row_id,))
+                conn.execute("COMMIT")
+                print(f"ERROR: SheetsWriteBehind: Moved queued write {row_id} ('{kind}') to the dead-letter table: {e}")
+                continue
+            conn.executemany("DELETE FROM sheets_write_journal WHERE id = ?", [(row[0],) for row in batch])
+            self._flushes += 1
+            self._flushed_ops += len(batch)
+            sent += len(batch)
+        return sent
 
-                is_valid = True
-                for busy in busy_slots:
-                    if potential_start < busy['end'] and potential_end > busy['start']:
-                        is_valid = False
-                        break
+    def _send(self, ops, verify=False):
+        """
+        Applies ops in at most two calls: one batchUpdate inserting the new top rows, then one
+        values().batchUpdate (USER_ENTERED, so dates and numbers are parsed as if typed in) that
+        fills them and applies the in-place Clients updates. With verify, an earlier send of these
+        ops may have been applied in full or in part: rows already at the top of their tab are
+        skipped, and rows that were inserted but left empty are filled instead of inserting more.
+        """
+        sheets_service = get_sheets_service()
+        if not sheets_service:
+            raise RuntimeError("Sheets service unavailable")
+
+        # Everything this send needs is read in one batchGet: the Clients emails for upserts and,
+        # when verifying, the top rows of every tab that may get new rows (at most 2 * max_batch:
+        # up to max_batch rows left empty by an earlier send plus this batch's rows).
+        ranges = {}
+        if any(kind == 'client' for kind, _ in ops):
+            ranges['emails'] = ('Clients!C:C', SingleColumnRow)
+        if verify:
+            first_row = SHEET_INSERT_START_INDEX + 1
+            for tab in {payload['tab'] for kind, payload in ops if kind == 'prepend'} | (
+                {'Clients'} if any(kind == 'client' and payload['values'] is not None for kind, payload in ops) else set()
+            ):
+                ranges[('top', tab)] = (f"'{tab}'!A{first_row}:Z{first_row + 2 * self.max_batch - 1}", SheetRowView)
+        read = read_sheet_ranges(sheets_service, ranges, value_render_option='FORMULA' if verify else None) if ranges else {}
+        cell_updates, prepends = self._plan(ops, read.get('emails', []))
+
+        tabs = []
+        for tab in (['Clients'] if cell_updates else []) + [tab for tab, _ in prepends]:
+            if tab not in tabs:
+                if _sheet_ids.get(sheets_service, tab) is None:
+                    print(f"BACKGROUND_TASK WARNING: Tab '{tab}' not found in the spreadsheet; dropping its queued rows.")
+                    continue
+                tabs.append(tab)
+        prepends = [(tab, values) for tab, values in prepends if tab in tabs]
+        if not cell_updates and not prepends:
+            return
+
+        # Each prepend becomes the new top row, so a tab's rows end up newest first.
+        new_rows = {}
+        for tab, values in prepends:
+            new_rows.setdefault(tab, []).insert(0, ['' if value is None else value for value in values])
+
+        inserts = {}
+        data = []
+        for tab, rows in new_rows.items():
+            existing = [view.values for view in read.get(('top', tab), [])]
+            rows = [row for row in rows if not any(_row_matches(row, old) for old in existing)]
+            if not rows:
+                continue
+            # Empty rows above the tab's data were inserted by a send that failed before filling them.
+            empty = 0
+            if not all(_is_blank_row(old) for old in existing):
+                while _is_blank_row(existing[empty]):
+                    empty += 1
+            if len(rows) > empty:
+                inserts[tab] = len(rows) - empty
+            first_row = SHEET_INSERT_START_INDEX + 1 + max(empty, len(rows)) - len(rows)
+            data.append({'range': f"'{tab}'!A{first_row}", 'values': rows})
+
+        # In-place updates address row positions read before the inserts, which push data rows down.
+        shift = inserts.get('Clients', 0)
+        for row_index, column, value in cell_updates:
+            row_number = row_index + 1 + (shift if row_index >= SHEET_INSERT_START_INDEX else 0)
+            data.append({'range': f"Clients!{_a1_column(column)}{row_number}", 'values': [['' if value is None else value]]})
+
+        if inserts:
+            batch_update_sheets(sheets_service, list(inserts), lambda sheet_ids: [
+                insert_top_rows_request(sheet_ids[tab], count) for tab, count in inserts.items()
+            ])
+        if data:
+            execute_with_retry(sheets_service.spreadsheets().values().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={'valueInputOption': 'USER_ENTERED', 'data': data}
+            ))
+        print(f"BACKGROUND_TASK: SheetsWriteBehind: Flushed {len(ops)} writes ({len(cell_updates)} cell updates, {sum(inserts.values())} new rows).")
+
+    def stats(self):
+        try:
+            with closing(local_state_db()) as conn:
+                pending = conn.execute("SELECT COUNT(*) FROM sheets_write_journal").fetchone()[0]
+                dead_lettered = conn.execute("SELECT COUNT(*) FROM sheets_write_dead_letter").fetchone()[0]
+        except sqlite3.Error:
+            pending = dead_lettered = None
+        return {
+            "pending": pending,
+            "dead_lettered": dead_lettered,
+            "flushes": self._flushes,
+            "flushed_ops": self._flushed_ops,
+            "failures": self._failures,
+            "consecutive_failures": self._consecutive_failures,
+            "last_error": self._last_error,
+        }
+
+    def replay_dead_letters(self, ids=None):
+        """
+        Moves dead-lettered writes (all, or the given IDs) back to the end of the journal, e.g.
+        after fixing the tab or the data that Sheets rejected. Returns the number requeued.
+        """
+        self.start()
+        where, params = ("", ())
+        if ids is not None:
+            ids = [int(row_id) for row_id in ids]
+            if not ids:
+                return 0
+            where, params = (f" WHERE id IN ({','.join('?' * len(ids))})", tuple(ids))
+        with closing(local_state_db()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT id, kind, payload, created_at FROM sheets_write_dead_letter{where} ORDER BY id", params
+                ).fetchall()
+                conn.executemany(
+                    "INSERT INTO sheets_write_journal (kind, payload, created_at) VALUES (?, ?, ?)",
+                    [(kind, payload, created_at) for _, kind, payload, created_at in rows]
+                )
+                conn.executemany("DELETE FROM sheets_write_dead_letter WHERE id = ?", [(row[0],) for row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if rows:
+            print(f"DEBUG: SheetsWriteBehind: Requeued {len(rows)} dead-lettered writes.")
+            self._wake.set()
+        return len(rows)
+
+    def flush_on_exit(self):
+        if self._thread is None:
+            return
+        try:
+            while self.flush():
+                pass
+        except Exception as e:
+            print(f"ERROR: SheetsWriteBehind: Final flush failed; writes stay journaled: {e}")
+
+_sheets_writes = SheetsWriteBehind(SHEETS_FLUSH_INTERVAL_SECONDS, SHEETS_FLUSH_MAX_BATCH, SHEETS_FLUSH_MAX_BACKOFF_SECONDS)
+atexit.register(_sheets_writes.flush_on_exit)
+if os.path.exists(LOCAL_STATE_DB) and multiprocessing.parent_process() is None:
+    # A previous worker may have left writes in the journal. (Not in intake PDF render
+    # processes, which re-import this module when started via `python app.py`.)
+    _sheets_writes.start()
+
+# --- Background Job Runner ---
+# Booking, intake, waitlist and on-site follow-up work (emails, Drive, Sheets, calendar patches)
+# used to start a new thread per request, so a burst meant unbounded threads and memory on the
+# 512MB instance. Jobs now go through a fixed pool with a bounded queue. When the queue is full
+# the job runs in the submitting request thread instead (backpressure), and gunicorn's
+# worker_exit hook drains the queue so max_requests recycling doesn't drop in-flight jobs.
+BACKGROUND_JOB_WORKERS = int(os.getenv("BACKGROUND_JOB_WORKERS", "2"))
+BACKGROUND_JOB_QUEUE_SIZE = int(os.getenv("BACKGROUND_JOB_QUEUE_SIZE", "50"))
+BACKGROUND_JOB_MAX_ATTEMPTS = int(os.getenv("BACKGROUND_JOB_MAX_ATTEMPTS", "3"))
+BACKGROUND_JOB_RETRY_BASE_SECONDS = float(os.getenv("BACKGROUND_JOB_RETRY_BASE_SECONDS", "2"))
+BACKGROUND_JOB_QUEUE_WAIT_SECONDS = 2
+BACKGROUND_JOB_DRAIN_TIMEOUT_SECONDS = float(os.getenv("BACKGROUND_JOB_DRAIN_TIMEOUT_SECONDS", "25"))
+
+class BackgroundJobRunner:
+    """
+    Fixed-size worker pool for named background jobs. A job that raises is retried up to
+    max_attempts times with jittered exponential backoff; per-type counters and latencies
+    are kept for /api/internal/metrics.
+    """
+
+    def __init__(self, workers, queue_size, max_attempts, retry_base_seconds):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = True
+        self._in_flight = 0
+        self._stats = {}
+
+    def _type_stats(self, job_type):
+        return self._stats.setdefault(job_type, {
+            "submitted": 0, "completed": 0, "failed": 0, "retries": 0, "ran_inline": 0,
+            "wait_seconds_total": 0.0, "run_seconds_total": 0.0, "run_seconds_max": 0.0,
+        })
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, name=f"background_job_{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job_type, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) under a job type name. Runs it inline if the queue stays full or the runner is draining."""
+        job = (job_type, fn, args, kwargs, time.monotonic())
+        with self._lock:
+            self._type_stats(job_type)["submitted"] += 1
+            accepting = self._accepting
+        if accepting:
+            self._ensure_workers()
+            try:
+                self._queue.put(job, timeout=BACKGROUND_JOB_QUEUE_WAIT_SECONDS)
+                return
+            except queue.Full:
+                print(f"WARNING: BackgroundJobRunner: Queue full; running '{job_type}' in the request thread.")
+        with self._lock:
+            self._type_stats(job_type)["ran_inline"] += 1
+        self._run(job)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job_type, fn, args, kwargs, queued_at = job
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+            self._type_stats(job_type)["wait_seconds_total"] += started - queued_at
+        outcome = "failed"
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    fn(*args, **kwargs)
+                    outcome = "completed"
+                    break
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        print(f"ERROR: BackgroundJobRunner: Job '{job_type}' failed after {attempt} attempts: {e}")
+                        break
+                    delay = self.retry_base_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                    print(f"WARNING: BackgroundJobRunner: Job '{job_type}' failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                    with self._lock:
+                        self._type_stats(job_type)["retries"] += 1
+                    time.sleep(delay)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                stats = self._type_stats(job_type)
+                stats[outcome] += 1
+                stats["run_seconds_total"] += elapsed
+                stats["run_seconds_max"] = max(stats["run_seconds_max"], elapsed)
+
+    def drain(self, timeout):
+        """Stops accepting new jobs, lets queued and running jobs finish, and stops the workers (bounded by timeout)."""
+        with self._lock:
+            self._accepting = False
+            threads = list(self._threads)
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self._queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        remaining = self._queue.qsize()
+        if remaining or any(thread.is_alive() for thread in threads):
+            print(f"WARNING: BackgroundJobRunner: Drain timed out with {remaining} queued jobs remaining.")
+        else:
+            print("DEBUG: BackgroundJobRunner: Drained all background jobs.")
+
+    def stats(self):
+        with self._lock:
+            job_types = {}
+            for job_type, stats in self._stats.items():
+                finished = stats["completed"] + stats["failed"]
+                job_types[job_type] = {
+                    "submitted": stats["submitted"],
+                    "completed": stats["completed"],
+                    "failed": stats["failed"],
+                    "retries": stats["retries"],
+                    "ran_inline": stats["ran_inline"],
+                    "avg_wait_seconds": round(stats["wait_seconds_total"] / finished, 3) if finished else None,
+                    "avg_run_seconds": round(stats["run_seconds_total"] / finished, 3) if finished else None,
+                    "max_run_seconds": round(stats["run_seconds_max"], 3),
+                }
+            return {
+                "queue_depth": self._queue.qsize(),
+                "in_flight": self._in_flight,
+                "workers": len(self._threads),
+                "accepting": self._accepting,
+                "job_types": job_types,
+            }
+
+_background_jobs = BackgroundJobRunner(
+    BACKGROUND_JOB_WORKERS, BACKGROUND_JOB_QUEUE_SIZE, BACKGROUND_JOB_MAX_ATTEMPTS, BACKGROUND_JOB_RETRY_BASE_SECONDS
+)
+
+# --- Persistent Job Queue ---
+# Background work used to live only in memory, so a job still running when gunicorn recycled the
+# worker (max_requests) was lost: no confirmation email, no Clients row, no Drive PDF. Jobs are now
+# stored as JSON in the local state database and run by a consumer loop on _background_jobs.
+# Execution is at-least-once: a job is claimed with a lease, and a lease that expires without the
+# job finishing (worker killed) makes it runnable again. An idempotency key makes re-submitting
+# the same work a no-op.
+PERSISTENT_JOB_MAX_ATTEMPTS = int(os.getenv("PERSISTENT_JOB_MAX_ATTEMPTS", "5"))
+PERSISTENT_JOB_LEASE_SECONDS = float(os.getenv("PERSISTENT_JOB_LEASE_SECONDS", "300"))
+PERSISTENT_JOB_POLL_SECONDS = 5
+PERSISTENT_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+def _encode_job_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__} in a job payload")
+
+def _decode_job_object(obj):
+    if set(obj) == {"__bytes__"}:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+class PersistentJobQueue:
+    """
+    SQLite-backed job table. Handlers are registered per job type with @handler(job_type) and
+    are called as handler(**payload); bytes payload values round-trip through base64.
+    """
+
+    def __init__(self, runner, slots, max_attempts, lease_seconds):
+        self.runner = runner
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers = {}
+        self._slots = threading.BoundedSemaphore(slots)
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def handler(self, job_type):
+        def register(fn):
+            self._handlers[job_type] = fn
+            return fn
+        return register
+
+    def _init_schema(self):
+        with closing(local_state_db()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_type TEXT NOT NULL, idempotency_key TEXT NOT NULL UNIQUE, "
+                "payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                "available_at REAL NOT NULL, lease_owner TEXT, lease_expires_at REAL, last_error TEXT, "
+                "created_at REAL NOT NULL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_queue_runnable ON job_queue (status, available_at)")
+
+    def start(self):
+        """Creates the job table and starts the consumer loop (idempotent)."""
+        with self._start_lock:
+            if self._thread is None and not self._stopping:
+                self._init_schema()
+                self._thread = threading.Thread(target=self._consume, name="job_queue_consumer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, job_type, idempotency_key, **payload):
+        """Stores a job; returns False if a job with this idempotency key already exists."""
+        if job_type not in self._handlers:
+            raise ValueError(f"No handler registered for job type '{job_type}'")
+        self.start()
+        now = time.time()
+        with closing(local_state_db()) as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO job_queue (job_type, idempotency_key, payload, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_type, idempotency_key, json.dumps(payload, default=_encode_job_value), now, now)
+            )
+        if cursor.rowcount == 0:
+            print(f"DEBUG: PersistentJobQueue: Job '{idempotency_key}' already queued; skipping duplicate.")
+            return False
+        self._wake.set()
+        return True
+
+    def _claim(self):
+        now = time.time()
+        with closing(local_state_db()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, job_type, payload, attempts FROM job_queue "
+                    "WHERE (status = 'pending' AND available_at <= ?) OR (status = 'running' AND lease_expires_at < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE job_queue SET status = 'running', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (self.owner, now + self.lease_seconds, row[0])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _consume(self):
+        while not self._stopping:
+            # Wait for a free slot with a timeout rather than having stop() release an extra one,
+            # which would over-release the semaphore when an in-flight job finishes.
+            if not self._slots.acquire(timeout=PERSISTENT_JOB_POLL_SECONDS):
+                continue
+            try:
+                job = None if self._stopping else self._claim()
+            except Exception as e:
+                print(f"ERROR: PersistentJobQueue: Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                self._purge_finished()
+                self._wake.wait(PERSISTENT_JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self.runner.submit(job[1], self._execute, *job)
+
+    def _execute(self, job_id, job_type, payload, attempts):
+        # Nothing may escape from here: the runner retries a raising job, which would run a handler
+        # that already succeeded (and re-send its emails) again. Queue bookkeeping errors are logged;
+        # a job whose status could not be written is picked up again when its lease expires.
+        try:
+            attempts += 1
+            try:
+                handler = self._handlers[job_type]
+                handler(**json.loads(payload, object_hook=_decode_job_object))
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    print(f"ERROR: PersistentJobQueue: Job {job_id} ('{job_type}') failed permanently after {attempts} attempts: {e}")
+                    self._finish(job_id, 'failed', str(e))
+                else:
+                    delay = 30 * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+                    print(f"WARNING: PersistentJobQueue: Job {job_id} ('{job_type}') failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                    self._finish(job_id, 'pending', str(e), available_at=time.time() + delay)
+                return
+            self._finish(job_id, 'done')
+        finally:
+            try:
+                self._slots.release()
+            except ValueError as e:
+                print(f"ERROR: PersistentJobQueue: Failed to release the slot of job {job_id}: {e}")
+            self._wake.set()
+
+    def _finish(self, job_id, status, error=None, available_at=None):
+        try:
+            with closing(local_state_db()) as conn:
+                conn.execute(
+                    "UPDATE job_queue SET status = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                    "available_at = COALESCE(?, available_at), finished_at = ? WHERE id = ? AND lease_owner = ?",
+                    (status, error, available_at, time.time() if status in ('done', 'failed') else None, job_id, self.owner)
+                )
+        except Exception as e:
+            print(f"ERROR: PersistentJobQueue: Failed to mark job {job_id} as '{status}': {e}")
+
+    def _purge_finished(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            with closing(local_state_db()) as conn:
+                # Failed jobs are kept for inspection; idempotency keys of finished jobs expire with them.
+                conn.execute(
+                    "DELETE FROM job_queue WHERE status = 'done' AND finished_at < ?",
+                    (now - PERSISTENT_JOB_RETENTION_SECONDS,)
+                )
+        except sqlite3.Error as e:
+            print(f"ERROR: PersistentJobQueue: Failed to purge finished jobs: {e}")
+
+    def stop(self):
+        """Stops claiming new jobs; claimed jobs finish on the runner, unclaimed ones wait for the next worker."""
+        self._stopping = True
+        self._wake.set()
+
+    def stats(self):
+        try:
+            with closing(local_state_db()) as conn:
+                counts = dict(conn.execute("SELECT status, COUNT(*) FROM job_queue GROUP BY status").fetchall())
+        except sqlite3.Error:
+            counts = {}
+        return {status: counts.get(status, 0) for status in ('pending', 'running', 'done', 'failed')}
+
+def payload_idempotency_key(job_type, payload):
+    """Idempotency key for jobs without a natural ID: identical submissions map to the same key."""
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f"{job_type}:{digest}"
+
+_job_queue = PersistentJobQueue(
+    _background_jobs, BACKGROUND_JOB_WORKERS, PERSISTENT_JOB_MAX_ATTEMPTS, PERSISTENT_JOB_LEASE_SECONDS
+)
+
+# --- API Endpoints ---
+
+@app.route('/api/lookup-client', methods=['GET'])
+def lookup_client():
+    """Searches both Clients and On-Site Requests sheets for an existing profile."""
+    identifier = request.args.get('identifier', '').strip()
+    if not identifier:
+        return jsonify({"found": False}), 400
+
+    service = get_sheets_service()
+    if not service:
+        return jsonify({"error": "Sheets service unavailable"}), 500
+
+    try:
+        source, row, intake_row = _client_directory.lookup(service, identifier)
 
-                if is_valid:
-                    valid_start_times.append(potential_start.isoformat())
+        # 1. Matches from the primary "Clients" sheet
+        if source == 'clients':
+            # Check if square_card_id (Column H) exists
+            square_card_id = row.square_card_id
 
-                potential_start += time_slot_interval
+            # --- Latest health info from Intake Forms ---
+            conditions = intake_row.conditions if intake_row else ""
+            allergies = intake_row.allergies if intake_row else ""
 
+            has_card_on_file = bool(square_card_id)
+            card_last_4 = ""
+
+            if has_card_on_file:
+                try:
+                    # Retrieve card details from Square to get last 4 digits
+                    card_res = square_client.cards.retrieve_card(card_id=square_card_id)
+                    if card_res.is_success():
+                        card_last_4 = card_res.body['card'].get('last_4', '')
+                except Exception as e:
+                    print(f"DEBUG: Failed to retrieve card details from Square: {e}")
+
+            return jsonify({
+                "found": True,
+                "firstName": row.first_name, "lastName": row.last_name, "email": row.email,
+                "phone": row.phone, "dob": row.dob,
+                "address": row.address,
+                "hasCard": has_card_on_file,
+                "last4": card_last_4,
+                "conditions": conditions,
+                "allergies": allergies
+            })
+
+        # 2. Fallback: matches from the "On-Site Requests" sheet (Full Name, Email, Phone, Address)
+        if source == 'onsite':
+            # Split the full name from column A into first and last parts
+            full_name = row.full_name
+            name_parts = full_name.split(' ', 1)
+            first = name_parts[0]
+            last = name_parts[1] if len(name_parts) > 1 else ""
+
+            return jsonify({
+                "found": True,
+                "firstName": first,
+                "lastName": last,
+                "email": row.email,
+                "phone": row.phone,
+                "dob": "", # DOB is not collected during on-site requests
+                "address": row.address,
+                "hasCard": False, # On-site requests don't store cards on file
+                "conditions": "",
+                "allergies": ""
+            })
+
+        return jsonify({"found": False})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/available-days', methods=['GET'])
+def get_available_days():
+    """Scans a date range and returns a list of dates ('YYYY-MM-DD')."""
+    # Get range from query params, default to 180 days (6 months)
+    days = request.args.get('range', default=180, type=int)
+    days = max(1, min(days, AVAILABLE_DAYS_MAX_RANGE))
+    available_dates = _get_available_dates_list(days_to_scan=days)
+    return jsonify(available_dates)
+
+AVAILABILITY_RANGE_MAX_DAYS = 62
+# Each distinct duration is a full slot computation over the range, so a request may only list a
+# handful of real session lengths (the booking page sends 30, 60 and 90).
+AVAILABILITY_RANGE_MAX_DURATIONS = 8
+AVAILABILITY_MAX_DURATION_MINUTES = 480
+
+def _collect_open_windows_and_busy(service, time_min, time_max, caller):
+    """Splits mirrored events from all calendars into 'Open for Bookings' windows and a busy index."""
+    open_windows = []
+    busy_slots = []
+    for calendar_events in list_events_across_calendars(service, time_min, time_max, caller).values():
+        for event in calendar_events:
+            if 'dateTime' not in event['start']:
+                continue
+
+            start = parse_iso_datetime(event['start']['dateTime'])
+            end = parse_iso_datetime(event['end']['dateTime'])
+
+            if event.get('summary', '').strip().lower() == 'open for bookings':
+                open_windows.append({'start': start, 'end': end})
+            else:
+                busy_slots.append((start, end))
+
+    open_windows.sort(key=lambda window: window['start'])
+    return open_windows, BusyIntervalIndex(busy_slots)
+
+def _valid_start_times(open_windows, busy_index, total_block_duration):
+    """Yields bookable start times (15-minute grid) across the open windows for a block length in minutes."""
+    time_slot_interval = timedelta(minutes=15)
+    # Skip times within 1 hour of the current time.
+    earliest_bookable_start = datetime.datetime.now(timezone.utc) + timedelta(hours=1)
+    for window in open_windows:
+        yield from busy_index.free_slots(
+            window['start'],
+            window['end'],
+            timedelta(minutes=total_block_duration),
+            time_slot_interval,
+            not_before=earliest_bookable_start,
+        )
+
+@app.route('/api/availability', methods=['GET'])
+def get_availability():
+    """
+    API endpoint to get available start times for a given date and service duration.
+    Expects 'date' (YYYY-MM-DD) and 'duration' (in minutes) query parameters.
+    """
+    date_str = request.args.get('date')
+    duration_str = request.args.get('duration')
+
+    if not date_str or not duration_str:
+        return jsonify({"error": "Both 'date' and 'duration' query parameters are required."}), 400
+
+    # --- New Availability Logic ---
+    try:
+        service_duration = int(duration_str)
+        total_block_duration = service_duration + 15 # Increased buffer from 10 to 15 minutes
+        start_of_day = parse_utc_day(date_str)
+        end_of_day = start_of_day + timedelta(days=1)
+    except (ValueError, TypeError):
+        return jsonify({
+            "error": "Invalid date or duration format. Date should be YYYY-MM-DD and duration should be an integer."
+        }), 400
+
+    service = get_calendar_service()
+    if not service:
+        return jsonify({"error": "Could not connect to Google Calendar service."}), 500
+
+    try:
+        open_windows, busy_index = _collect_open_windows_and_busy(service, start_of_day, end_of_day, "get_availability")
+        valid_start_times = [
+            potential_start.isoformat()
+            for potential_start in _valid_start_times(open_windows, busy_index, total_block_duration)
+        ]
         return jsonify(valid_start_times)
 
     except Exception as e:
         return jsonify({"error": f"Failed to retrieve calendar events: {e}"}), 500
 
+@app.route('/api/availability/range', methods=['GET'])
+def get_availability_range():
+    """
+    Batched availability for several days and durations in one call, so the booking page can prefetch.
+    Expects 'start' and 'end' (YYYY-MM-DD, inclusive) and 'durations' (comma-separated minutes).
+    Returns {"start", "end", "days": {"YYYY-MM-DD": {"<duration>": [iso start times]}}}; days with no
+    open times are omitted.
+    """
+    start_str = request.args.get('start')
+    end_str = request.args.get('end')
+    durations_str = request.args.get('durations')
+
+    if not start_str or not end_str or not durations_str:
+        return jsonify({"error": "'start', 'end' and 'durations' query parameters are required."}), 400
+
+    try:
+        first_day = parse_utc_day(start_str)
+        last_day = parse_utc_day(end_str)
+        duration_parts = [d for d in durations_str.split(',') if d.strip()]
+        if len(duration_parts) > AVAILABILITY_RANGE_MAX_DURATIONS:
+            return jsonify({"error": f"At most {AVAILABILITY_RANGE_MAX_DURATIONS} durations may be requested at once."}), 400
+        service_durations = sorted({int(d) for d in duration_parts})
+    except (ValueError, TypeError):
+        return jsonify({
+            "error": "Invalid date or duration format. Dates should be YYYY-MM-DD and durations comma-separated integers."
+        }), 400
+
+    if any(d < 1 or d > AVAILABILITY_MAX_DURATION_MINUTES for d in service_durations):
+        return jsonify({"error": f"Durations must be between 1 and {AVAILABILITY_MAX_DURATION_MINUTES} minutes."}), 400
+
+    num_days = (last_day - first_day).days + 1
+    if not service_durations or num_days < 1 or num_days > AVAILABILITY_RANGE_MAX_DAYS:
+        return jsonify({
+            "error": f"Range must cover 1 to {AVAILABILITY_RANGE_MAX_DAYS} days with at least one duration."
+        }), 400
+
+    service = get_calendar_service()
+    if not service:
+        return jsonify({"error": "Could not connect to Google Calendar service."}), 500
+
+    try:
+        range_end = last_day + timedelta(days=1)
+        open_windows, busy_index = _collect_open_windows_and_busy(service, first_day, range_end, "get_availability_range")
+        days = {}
+        for service_duration in service_durations:
+            # Slots are computed once per window and then filed under every UTC day the window
+            # overlaps, exactly as the single-day endpoint would report them.
+            for window in open_windows:
+                window_starts = [
+                    potential_start.isoformat()
+                    for potential_start in _valid_start_times([window], busy_index, service_duration + 15)
+                ]
+                if not window_starts:
+                    continue
+                day = max(window['start'], first_day).replace(hour=0, minute=0, second=0, microsecond=0)
+                while day < min(window['end'], range_end):
+                    days.setdefault(day.date().isoformat(), {}).setdefault(str(service_duration), []).extend(window_starts)
+                    day += timedelta(days=1)
+
+        return jsonify({"start": first_day.date().isoformat(), "end": last_day.date().isoformat(), "days": days})
+
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve calendar events: {e}"}), 500
+
 
 @app.route('/api/book', methods=['POST'])
 def book_appointment():
@@ -935,27 +2676,16 @@ def book_appointment():
     check_end = end_time + timedelta(hours=1)
 
     all_busy_events = []
-    for calendar_id in CALENDAR_IDS:
-        try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=check_start.isoformat(),
-                timeMax=check_end.isoformat(),
-                singleEvents=True
-            ).execute()
-            all_busy_events.extend([
-                e for e in events_result.get('items', [])
-                if e.get('summary', '').lower() != 'open for bookings' and 'dateTime' in e.get('start', {})
-            ])
-        except Exception as e:
-            print(f"ERROR: /api/book: Failed overlap check for {calendar_id}: {e}")
+    # Force a delta sync so events added moments ago (e.g. manually) are never missed.
+    for calendar_events in list_events_across_calendars(service, check_start, check_end, "/api/book overlap check", max_age=0).values():
+        all_busy_events.extend([
+            e for e in calendar_events
+            if e.get('summary', '').lower() != 'open for bookings' and 'dateTime' in e.get('start', {})
+        ])
 
     try:
-        for busy_event in all_busy_events:
-            busy_start = parse_iso_datetime(busy_event['start']['dateTime'])
-            busy_end = parse_iso_datetime(busy_event['end']['dateTime'])
-            if start_time < busy_end and end_time > busy_start:
-                return jsonify({"error": "The selected time slot is no longer available. Please choose another time."}), 409
+        if not BusyIntervalIndex.from_events(all_busy_events).is_free(start_time, end_time):
+            return jsonify({"error": "The selected time slot is no longer available. Please choose another time."}), 409
     except Exception as e:
         print(f"ERROR: /api/book: Failed during overlap check: {e}")
         return jsonify({"error": "Could not verify appointment availability. Please try again."}), 500
@@ -971,15 +2701,11 @@ def book_appointment():
             sheets_service = get_sheets_service()
             if sheets_service:
                 normalized_email = norm_email(client_email)
-                result = sheets_service.spreadsheets().values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range='Clients!A:H'
-                ).execute()
-                rows = result.get('values', [])
-                for row_val in rows:
-                    if row_val and len(row_val) > 2 and row_val[2].strip().lower() == normalized_email:
-                        square_customer_id = row_val[6] if len(row_val) > 6 else ""
-                        square_card_id = row_val[7] if len(row_val) > 7 else ""
+                rows = read_sheet_ranges(sheets_service, {'clients': ('Clients!A:H', ClientRow)})['clients']
+                for client_row in rows:
+                    if norm_email(client_row.email) == normalized_email:
+                        square_customer_id = client_row.square_customer_id
+                        square_card_id = client_row.square_card_id
                         break
 
             if not square_card_id:
@@ -1046,28 +2772,33 @@ def book_appointment():
         f"Service: {service_type}"
     )
 
-    # Pass the determined color ID to the create_event function
-    created_event = create_event(service, summary, start_time, end_time, full_description, PRIMARY_CALENDAR_ID, color_id=event_color_id)
-
-    if not created_event:
-        return jsonify({"error": "Failed to create calendar event."}), 500
-
-    calendar_event_id = created_event.get('id')
+    # The event ID is chosen up front so the SOAP link (which embeds it) and the Square
+    # profile link go into the initial insert instead of follow-up GET + PATCH round trips.
+    calendar_event_id = uuid.uuid4().hex
 
     # --- Generate Pre-filled SOAP Note URL ---
     local_tz = ZoneInfo(LOCAL_TIMEZONE)
     local_start_time = start_time.astimezone(local_tz)
     booking_date_formatted = local_start_time.strftime('%B %d, %Y')
     booking_time_formatted = local_start_time.strftime('%I:%M %p')
+    # Use the full summary (Service for Client Name)
+    soap_url = build_soap_form_url(summary, booking_date_formatted, booking_time_formatted, description, calendar_event_id)
+    full_description = safe_append_description(full_description, "--- ADMIN: SOAP NOTE LINK ---", f"<a href=\"{soap_url}\">SOAP Form</a>")
+
+    # Square IDs for Admin reference
+    if square_customer_id:
+        customer_link = f"https://squareup.com/dashboard/customers/directory/customer/{square_customer_id}"
+        full_description = safe_append_description(
+            full_description, "--- ADMIN: SQUARE INFO ---", f"Customer Profile: <a href=\"{customer_link}\">Square Card Link</a>"
+        )
 
-    soap_form_base = "https://docs.google.com/forms/d/1maaknBVFgUMKRQQ1Sc47wOhNc99j77icwZG-jDK_I90/viewform" # Ensure this is the correct form ID
-    soap_query = {
-        'entry.971462728': summary, # Use the full summary (Service for Client Name)
-        'entry.353806943': f"{booking_date_formatted} {booking_time_formatted}",
-        'entry.804944025': description.replace('Comments: ', ''),
-        'entry.175378350': calendar_event_id
-    }
-    soap_url = f"{soap_form_base}?{urlencode(soap_query)}"
+    # Pass the determined color ID to the create_event function
+    created_event = create_event(service, summary, start_time, end_time, full_description, PRIMARY_CALENDAR_ID, color_id=event_color_id, event_id=calendar_event_id)
+
+    if not created_event:
+        return jsonify({"error": "Failed to create calendar event."}), 500
+
+    _available_days_cache.invalidate()
 
     # --- Generate Intake Form URL ---
     client_email = client_info.get('email')
@@ -1085,182 +2816,130 @@ def book_appointment():
     }
     intake_url = url_for('intake_page', _external=True) + '?' + urlencode(intake_params)
 
-    # Update the Calendar Event description with SOAP and Intake links
-    try:
-        # Fetch the event again to get the full_description we just created (containing Phone/Service)
-        current_event = execute_with_retry(service.events().get(calendarId=PRIMARY_CALENDAR_ID, eventId=calendar_event_id))
-        latest_desc = current_event.get('description', '')
-
-        soap_tag = "--- ADMIN: SOAP NOTE LINK ---"
-        updated_desc = safe_append_description(latest_desc, soap_tag, f"<a href=\"{soap_url}\">SOAP Form</a>")
-        execute_with_retry(service.events().patch(calendarId=PRIMARY_CALENDAR_ID, eventId=calendar_event_id, body={'description': updated_desc}))
-    except Exception as e:
-        print(f"ERROR: Failed to update calendar event with links: {e}")
-
-    # --- Prepare Data for Emails ---
-    client_first_name = client_info.get('first_name', 'Valued Client')
+    # --- Queue Background Job ---
+    _job_queue.enqueue(
+        'booking', f"booking:{calendar_event_id}",
+        calendar_event_id=calendar_event_id,
+        client_info=client_info,
+        summary=summary,
+        local_start_time=local_start_time,
+        comments=data.get('description', '').replace('Comments: ', ''),
+        intake_url=intake_url,
+        square_customer_id=square_customer_id,
+        square_card_id=square_card_id,
+    )
 
-    # --- Define Async Task for Emails and Sheets ---
-    def _handle_booking_background(square_customer_id, square_card_id):
-        service = get_calendar_service()
-        # Update Calendar description with Square IDs for Admin reference
-        if square_customer_id:
-            customer_link = f"https://squareup.com/dashboard/customers/directory/customer/{square_customer_id}"
-            square_tag = "--- ADMIN: SQUARE INFO ---"
-            square_content = f"Customer Profile: <a href=\"{customer_link}\">Square Card Link</a>"
-            try:
-                # Fetch latest description again to include the SOAP link just added
-                latest_event = execute_with_retry(service.events().get(calendarId=PRIMARY_CALENDAR_ID, eventId=calendar_event_id))
-                final_desc = latest_event.get('description', '')
-                execute_with_retry(service.events().patch(calendarId=PRIMARY_CALENDAR_ID, eventId=calendar_event_id, body={'description': safe_append_description(final_desc, square_tag, square_content)}))
-            except Exception as e:
-                print(f"ERROR: Failed to update calendar event with Square IDs: {e}")
+    return jsonify({
+        "message": "Booking successful!",
+        "event_link": created_event.get('htmlLink'),
+        "calendar_event_id": calendar_event_id
+    })
 
-        # 1. Update "Clients" Sheet immediately upon booking
-        try:
-            sheets_service = get_sheets_service()
-            if sheets_service and client_email:
-                normalized_email = norm_email(client_email)
+BOOKING_CONFIRMATION_EMAIL = EmailTemplate(
+    "Your Massage Appointment is Confirmed!",
+    """
+        <html>
+        <head>
+            <style>
+                .email-cta:hover {
+                    background-color: #ffffff !important;
+                    color: #000000 !important;
+                }
+            </style>
+        </head>
+        <body>
+        <p>Hi $first_name,</p>
+        <p>Thank you for booking your appointment! I look forward to seeing you on <strong>$booking_date</strong> at <strong>$booking_time</strong>.</p>
+        <p>As a next step, if you have not already, please complete our secure client intake form by clicking the link below:</p>
+        <p><a href="$intake_url" class="email-cta" style="display: inline-block; padding: 12px 24px; border: 1px solid #000; background-color: #000; color: #fff; font-size: 1rem; font-weight: bold; text-decoration: none; border-radius: 50px; transition: background-color 0.3s ease, color 0.3s ease;">Complete Intake Form</a></p>
+        <p>Free parking is located behind the building.</p>
+        <p>High Five!<br>Chelsea Vaccaro <br> Therapeutic Massage</p>
+        </body>
+        </html>
+        """
+)
 
-                # Check for existing client
-                result = sheets_service.spreadsheets().values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range='Clients!C:C'
-                ).execute()
+BOOKING_ADMIN_EMAIL = EmailTemplate(
+    "New Booking: $summary",
+    """
+        <p><strong>You have a new booking!</strong></p>
+        <p><strong>Client:</strong> $first_name $last_name</p>
+        <p><strong>Service:</strong> $summary</p>
+        <p><strong>When:</strong> $when</p>
+        <p><strong>Client Email:</strong> $client_email</p>
+        <p><strong>Client Phone:</strong> $client_phone</p>
+        <p><strong>Comments:</strong> $comments</p>
+        <p>The event has been added to your Google Calendar.</p>
+        """
+)
 
-                existing_emails = [
-                    norm_email(item) for sublist in result.get('values', [])
-                    for item in sublist if item and isinstance(item, str)
-                ]
+@_job_queue.handler('booking')
+def _handle_booking_background(calendar_event_id, client_info, summary, local_start_time, comments, intake_url, square_customer_id, square_card_id):
+    """Post-booking follow-up: Clients sheet upsert, client and admin emails."""
+    local_start_time = datetime.datetime.fromisoformat(local_start_time)
+    booking_date_formatted = local_start_time.strftime('%B %d, %Y')
+    booking_time_formatted = local_start_time.strftime('%I:%M %p')
+    client_email = client_info.get('email')
+    client_first_name = client_info.get('first_name', 'Valued Client')
 
-                if normalized_email not in existing_emails:
-                    print(f"BACKGROUND_TASK: New client booking: {client_email}. Adding to 'Clients' sheet.")
-                    # Fetch sheet ID for prepend
-                    spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-                    client_sheet_metadata = next(s for s in spreadsheet.get('sheets', []) if s['properties']['title'] == 'Clients')
-                    client_sheet_id = client_sheet_metadata['properties']['sheetId']
-
-                    client_row = [
-                        client_info.get('first_name', ''),
-                        client_info.get('last_name', ''),
-                        client_email,
-                        client_info.get('phone', ''),
-                        '',  # DOB (Collected at intake)
-                        '',  # Address (Collected at intake)
-                        square_customer_id,  # Column G: Square Customer ID
-                        square_card_id       # Column H: Square Card ID
-                    ]
-
-                    # Always insert a new row at Row 2 (index 1) to push existing data down
-                    request_body = {
-                        "requests": [{
-                            "insertDimension": {
-                                "range": {"sheetId": client_sheet_id, "dimension": "ROWS", "startIndex": SHEET_INSERT_START_INDEX, "endIndex": SHEET_INSERT_END_INDEX},
-                                "inheritFromBefore": False
-                            }
-                        }]
-                    }
-                    sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=request_body).execute()
-
-                    sheets_service.spreadsheets().values().update(
-                        spreadsheetId=SPREADSHEET_ID,
-                        range=f'Clients!A{SHEET_START_ROW_REF}',
-                        valueInputOption='USER_ENTERED',
-                        body={'values': [client_row]}
-                    ).execute()
-                else:
-                    print(f"BACKGROUND_TASK: Existing client {client_email} found. Updating latest Square IDs.")
-                    # Find the row index for this email to update the Card ID
-                    target_row_index = -1
-                    for idx, row_val in enumerate(result.get('values', [])):
-                        if row_val and norm_email(row_val[0]) == normalized_email:
-                            target_row_index = idx + 1 # Sheets is 1-indexed
-                            break
-
-                    if target_row_index != -1:
-                        # Update the Square Customer ID and Card ID for the existing client
-                        # This ensures the 'Clients' sheet always has the LATEST authorized card
-                        update_range = f'Clients!G{target_row_index}:H{target_row_index}'
-                        sheets_service.spreadsheets().values().update(
-                            spreadsheetId=SPREADSHEET_ID,
-                            range=update_range,
-                            valueInputOption='USER_ENTERED',
-                            body={'values': [[square_customer_id, square_card_id]]}
-                        ).execute()
-
-                        # Also update Phone if they provided a new one
-                        sheets_service.spreadsheets().values().update(
-                            spreadsheetId=SPREADSHEET_ID,
-                            range=f'Clients!D{target_row_index}',
-                            valueInputOption='USER_ENTERED',
-                            body={'values': [[client_info.get('phone', '')]]}
-                        ).execute()
-        except Exception as sheet_e:
-            print(f"ERROR (background): Failed to update Clients sheet during booking: {sheet_e}")
-
-        # 2. Send Emails
-        print(f"BACKGROUND_TASK: Starting email delivery for: {client_email}")
+    # 1. Queue the "Clients" Sheet upsert (new row, or latest phone + Square IDs for an existing client)
+    try:
         if client_email:
-            email_subject = "Your Massage Appointment is Confirmed!"
-            esc = html.escape
-            # (Existing email body logic stays exactly as is)
-            email_body_html = f"""
-            <html>
-            <head>
-                <style>
-                    .email-cta:hover {{
-                        background-color: #ffffff !important;
-                        color: #000000 !important;
-                    }}
-                </style>
-            </head>
-            <body>
-            <p>Hi {esc(client_first_name)},</p>
-            <p>Thank you for booking your appointment! I look forward to seeing you on <strong>{booking_date_formatted}</strong> at <strong>{booking_time_formatted}</strong>.</p>
-            <p>As a next step, if you have not already, please complete our secure client intake form by clicking the link below:</p>
-            <p><a href="{intake_url}" class="email-cta" style="display: inline-block; padding: 12px 24px; border: 1px solid #000; background-color: #000; color: #fff; font-size: 1rem; font-weight: bold; text-decoration: none; border-radius: 50px; transition: background-color 0.3s ease, color 0.3s ease;">Complete Intake Form</a></p>
-            <p>Free parking is located behind the building.</p>
-            <p>High Five!<br>Chelsea Vaccaro <br> Therapeutic Massage</p>
-            </body>
-            </html>
-            """
-            client_email_sent, _ = send_email(client_email, email_subject, email_body_html)
-            if client_email_sent:
-                print("BACKGROUND_TASK: Successfully sent confirmation email to client.")
-            else:
-                print("BACKGROUND_TASK: WARNING: Failed to send confirmation email to client.")
-
-        print("BACKGROUND_TASK: Starting to send admin notification email.")
-        try:
-            admin_email = SENDER_EMAIL
-            esc = html.escape
-            admin_subject = f"New Booking: {esc(summary)}"
-            admin_body_html = f"""
-            <p><strong>You have a new booking!</strong></p>
-            <p><strong>Client:</strong> {esc(client_info.get('first_name'))} {esc(client_info.get('last_name'))}</p>
-            <p><strong>Service:</strong> {esc(summary)}</p>
-            <p><strong>When:</strong> {local_start_time.strftime('%A, %B %d, %Y at %I:%M %p')}</p>
-            <p><strong>Client Email:</strong> {esc(client_info.get('email', 'N/A'))}</p>
-            <p><strong>Client Phone:</strong> {esc(client_info.get('phone', 'N/A'))}</p>
-            <p><strong>Comments:</strong> {esc(data.get('description', '').replace('Comments: ', ''))}</p>
-            <p>The event has been added to your Google Calendar.</p>
-            """
-            admin_email_sent, _ = send_email(admin_email, admin_subject, admin_body_html)
-            if admin_email_sent:
-                print("BACKGROUND_TASK: Successfully sent notification email to admin.")
-            else:
-                print("BACKGROUND_TASK: WARNING: Failed to send notification email to admin.")
-        except Exception as e:
-            print(f"CRITICAL: Failed to send admin notification email for booking. Error: {e}")
-
-    # --- Start Background Thread ---
-    threading.Thread(target=_handle_booking_background, name="booking_bg", args=(square_customer_id, square_card_id)).start()
+            client_row = [
+                client_info.get('first_name', ''),
+                client_info.get('last_name', ''),
+                client_email,
+                client_info.get('phone', ''),
+                '',  # DOB (Collected at intake)
+                '',  # Address (Collected at intake)
+                square_customer_id,  # Column G: Square Customer ID
+                square_card_id       # Column H: Square Card ID
+            ]
+            # For an existing client, the 'Clients' sheet always gets the LATEST authorized card
+            latest_columns = {3: client_info.get('phone', ''), 6: square_customer_id, 7: square_card_id}
+            _sheets_writes.upsert_client(client_email, client_row, latest_columns)
+            _client_directory.upsert_client(client_row, latest_columns)
+            print(f"BACKGROUND_TASK: Queued 'Clients' sheet upsert for {client_email}.")
+    except Exception as sheet_e:
+        print(f"ERROR (background): Failed to update Clients sheet during booking: {sheet_e}")
+
+    # 2. Send Emails (client confirmation + admin notification in one batch)
+    print(f"BACKGROUND_TASK: Starting email delivery for: {client_email}")
+    esc = html.escape
+    messages = []
+    if client_email:
+        messages.append((client_email,) + BOOKING_CONFIRMATION_EMAIL.render(
+            first_name=esc(client_first_name),
+            booking_date=booking_date_formatted,
+            booking_time=booking_time_formatted,
+            intake_url=intake_url,
+        ))
+    try:
+        messages.append((SENDER_EMAIL,) + BOOKING_ADMIN_EMAIL.render(
+            summary=esc(summary),
+            first_name=esc(client_info.get('first_name')),
+            last_name=esc(client_info.get('last_name')),
+            when=local_start_time.strftime('%A, %B %d, %Y at %I:%M %p'),
+            client_email=esc(client_info.get('email', 'N/A')),
+            client_phone=esc(client_info.get('phone', 'N/A')),
+            comments=esc(comments),
+        ))
+    except Exception as e:
+        print(f"CRITICAL: Failed to send admin notification email for booking. Error: {e}")
 
-    return jsonify({
-        "message": "Booking successful!",
-        "event_link": created_event.get('htmlLink'),
-        "calendar_event_id": calendar_event_id
-    })
+    results = send_emails(messages)
+    if client_email:
+        client_email_sent, _ = results.pop(0)
+        if client_email_sent:
+            print("BACKGROUND_TASK: Successfully sent confirmation email to client.")
+        else:
+            print("BACKGROUND_TASK: WARNING: Failed to send confirmation email to client.")
+    if results:
+        admin_email_sent, _ = results[0]
+        if admin_email_sent:
+            print("BACKGROUND_TASK: Successfully sent notification email to admin.")
+        else:
+            print("BACKGROUND_TASK: WARNING: Failed to send notification email to admin.")
 
 @app.route('/api/charge-cancellation', methods=['POST'])
 def charge_cancellation():
@@ -1369,30 +3048,74 @@ def send_sms(phone_number, message_body):
     print(msg)
     return False, msg
 
-@app.route('/api/cron/reminders', methods=['GET']) # This is the cron job endpoint
-def trigger_reminders():
-    """Cron endpoint to send SMS reminders 26 hours before appointments."""
-    # Security check: Ensure only authorized requests can trigger reminders
-    cron_key = os.getenv("CRON_SECRET_KEY")
-    if cron_key and request.args.get('key') != cron_key:
-        return jsonify({"error": "Unauthorized"}), 401
+# --- Reminder Engine ---
+# The SMS and email cron jobs each listed the next 48 hours, then did sleep + GET + PATCH + GET for
+# every event before even checking whether it was due. The engine lists the 26h±1h window once
+# (with descriptions, ETags and extended properties), filters locally, and gives each due event
+# one If-Match PATCH that records every channel due on it. A 412 means another worker got there
+# first. A cron run therefore costs one list plus one PATCH per due event.
+#
+# Sent state lives in the event's extendedProperties.private (<channel>ReminderSentFor = start
+# time) and is mirrored in the local reminder_state table. Older events may still carry the
+# SMS_/EMAIL_REMINDER_SENT_FOR description lines, which are honored but no longer written.
+REMINDER_TARGET_HOURS = 26
+REMINDER_TOLERANCE_HOURS = 1.0
+REMINDER_EVENT_FIELDS = EVENT_LIST_FIELDS + ('description', 'extendedProperties')
+REMINDER_STATE_RETENTION_SECONDS = 7 * 24 * 3600
+
+class ReminderStateStore:
+    """Local mirror of reminder sent-state, keyed by (calendar, event, channel, start time)."""
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = local_state_db()
+        if not self._schema_ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reminder_state ("
+                "calendar_id TEXT NOT NULL, event_id TEXT NOT NULL, channel TEXT NOT NULL, start_iso TEXT NOT NULL, "
+                "start_ts REAL NOT NULL, sent_at REAL NOT NULL, PRIMARY KEY (calendar_id, event_id, channel, start_iso))"
+            )
+            self._schema_ready = True
+        return conn
 
-    now = datetime.datetime.now(timezone.utc)
-    time_min = now # Look from now...
-    time_max = now + timedelta(hours=48) # ...to 48 hours ahead to ensure no one is missed
+    def sent_keys(self, calendar_id, window_start, window_end):
+        """Returns {(event_id, channel, start_iso)} already sent for events starting in the window."""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM reminder_state WHERE start_ts < ?", (time.time() - REMINDER_STATE_RETENTION_SECONDS,))
+                rows = conn.execute(
+                    "SELECT event_id, channel, start_iso FROM reminder_state WHERE calendar_id = ? AND start_ts BETWEEN ? AND ?",
+                    (calendar_id, window_start.timestamp(), window_end.timestamp())
+                ).fetchall()
+            return set(rows)
+        except sqlite3.Error as e:
+            # Calendar's extendedProperties remain the source of truth.
+            print(f"ERROR: ReminderStateStore: Failed to read local reminder state: {e}")
+            return set()
+
+    def record(self, calendar_id, event_id, channel, start_dt):
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reminder_state (calendar_id, event_id, channel, start_iso, start_ts, sent_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (calendar_id, event_id, channel, start_dt.isoformat(), start_dt.timestamp(), time.time())
+                )
+        except sqlite3.Error as e:
+            print(f"ERROR: ReminderStateStore: Failed to record {channel} reminder for {event_id}: {e}")
 
-    service = get_calendar_service()
-    if not service:
-        print("CRON ERROR: Google Calendar service unavailable. Cannot fetch events for reminders.")
-        return jsonify({"error": "Google Calendar service unavailable"}), 500
+_reminder_state = ReminderStateStore()
 
-    debug_mode = request.args.get('debug', '').lower() in ('1', 'true', 'yes')
+class SmsReminderChannel:
+    """SMS reminders: needs a Phone line in the description; state key smsReminderSentFor."""
 
-    try:
-        sent_count = 0
-        local_tz = ZoneInfo(LOCAL_TIMEZONE)
-        processed_keys = set() # Prevent duplicate sends for synced calendars
-        debug_counts = {
+    name = "sms"
+    state_key = "smsReminderSentFor"
+
+    def __init__(self):
+        self.sent_count = 0
+        self.debug_counts = {
             "events_seen": 0,
             "skipped_open_for_bookings": 0,
             "skipped_all_day": 0,
@@ -1405,169 +3128,486 @@ def trigger_reminders():
             "last_error": None
         }
 
-        for calendar_id in [PRIMARY_CALENDAR_ID]:
-            res = service.events().list(
-                calendarId=calendar_id,
-                timeMin=time_min.isoformat(),
-                timeMax=time_max.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            for event in res.get('items', []):
-                summary = event.get('summary', '')
-                if summary.lower().strip() == 'open for bookings':
-                    debug_counts["skipped_open_for_bookings"] += 1
-                    continue
+    def skips_summary(self, summary):
+        return summary.lower().strip() == 'open for bookings'
+
+    def sent_per_description(self, description, norm_current, current_start_iso):
+        # Legacy marker. Do not treat EMAIL_REMINDER_SENT_FOR as an SMS sent marker.
+        return description_has_sms_reminder_tag(description, norm_current, current_start_iso)
+
+    def prepare(self, event, description, start_dt):
+        """Returns the delivery context if this event is due an SMS, else None."""
+        summary = event.get('summary', '')
+        # Metadata is found regardless of HTML tags or line position
+        meta = _description_metadata.get(event)
+        phone = meta["phone"]
+        if not phone:
+            self.debug_counts["skipped_no_phone"] += 1
+            print(f"DEBUG CRON: Skipping '{summary}' (ID: {event['id']}) - no phone metadata found.")
+            return None
+
+        return {
+            "event_id": event['id'],
+            "summary": summary,
+            "start_dt": start_dt,
+            "phone": phone,
+            "duration": meta["duration"],
+            "service_type": meta["service"],
+            "links": [],
+        }
+
+    def deliver(self, delivery):
+        """Sends the SMS; runs on a dispatch thread and returns (success, error_message)."""
+        summary = delivery["summary"]
+        local_start = delivery["start_dt"].astimezone(ZoneInfo(LOCAL_TIMEZONE))
+        client_full_name = summary.split(" for ")[-1].strip() if " for " in summary.lower() else "Valued Client"
+        first_name = client_full_name.split(' ')[0]
+        formatted_date = local_start.strftime('%B %d')
+        formatted_time = local_start.strftime('%I:%M %p')
+        msg_body = (
+            f"Hi {first_name}! This is a reminder of your {delivery['duration']} {delivery['service_type']} appointment "
+            f"tomorrow {formatted_date} at {formatted_time} at Chelsea Vaccaro Therapeutic Massage. "
+            "If you have not done so already, please fill out your client intake form via the link "
+            "within your booking confirmation or reminder email. I look forward to seeing you! -Chelsea"
+        )
+
+        return send_sms(delivery["phone"], msg_body)
+
+    def record(self, delivery, sms_success, sms_error_message):
+        summary = delivery["summary"]
+        self.debug_counts["sms_attempted"] += 1
+        if sms_success:
+            self.sent_count += 1
+            print(f"INFO: REMINDER SENT: to {delivery['phone']} for '{summary}' (ID: {delivery['event_id']})")
+        else: # SMS failed
+            self.debug_counts["sms_failed"] += 1
+            self.debug_counts["last_error"] = sms_error_message
+            # Keep the sent state to prevent duplicate texts on the next cron run.
+            print(f"WARNING: SMS failed for '{summary}' (ID: {delivery['event_id']}) with error: {sms_error_message}")
+
+REMINDER_EMAIL = EmailTemplate(
+    "Appointment Reminder - Chelsea Vaccaro Therapeutic Massage",
+    """
+        <html>
+        <head>
+            <style>
+                .email-cta:hover {
+                    background-color: #ffffff !important;
+                    color: #000000 !important;
+                }
+            </style>
+        </head>
+        <body>
+        <p>Hi $first_name!</p>
+        <p>This is a reminder of your <strong>$duration $service_type</strong> appointment
+        tomorrow <strong>$formatted_date</strong> at <strong>$formatted_time</strong>
+        at Chelsea Vaccaro Therapeutic Massage.</p>
+        <p>If you have not done so already, please fill out your client intake form here:</p>
+        <p><a href="$intake_url" class="email-cta" style="display: inline-block; padding: 12px 24px; border: 1px solid #000; background-color: #000; color: #fff; font-size: 1rem; font-weight: bold; text-decoration: none; border-radius: 50px;">Complete Intake Form</a></p>
+        <p>I look forward to seeing you!<br>-Chelsea</p>
+        </body>
+        </html>
+        """
+)
+
+class EmailReminderChannel:
+    """
+    Email reminders: need Email, Duration and Service in the description; state key
+    emailReminderSentFor. Manual bookings (no SOAP link yet) also get intake + SOAP links.
+    """
+
+    name = "email"
+    state_key = "emailReminderSentFor"
+    legacy_sent_tag_prefix = "EMAIL_REMINDER_SENT_FOR: "
+    soap_tag = "--- ADMIN: SOAP NOTE LINK ---"
+    intake_link_tag = "--- ADMIN: CLIENT INTAKE FORM ---"
+
+    def __init__(self):
+        self.sent_count = 0
+        self.debug_counts = {
+            "events_seen": 0,
+            "skipped_open_for_bookings": 0,
+            "skipped_all_day": 0,
+            "skipped_already_sent": 0,
+            "skipped_missing_required_fields": 0,
+            "skipped_outside_time_window": 0,
+            "mark_sent_conflicts": 0,
+            "email_attempted": 0,
+            "email_failed": 0,
+            "manual_links_added": 0,
+            "last_error": None
+        }
+
+    def skips_summary(self, summary):
+        return summary.lower().strip() == 'open for bookings' or summary.upper().startswith('WAITLIST:')
+
+    def sent_per_description(self, description, norm_current, current_start_iso):
+        return (
+            f"{self.legacy_sent_tag_prefix}{norm_current}" in description
+            or f"{self.legacy_sent_tag_prefix}{current_start_iso}" in description
+        )
+
+    def prepare(self, event, description, start_dt):
+        """Returns the delivery context if this event is due a reminder email, else None."""
+        summary = event.get('summary', '')
+        meta = _description_metadata.get(event)
+        if not meta["email"] or not meta["duration"] or not meta["service"]:
+            self.debug_counts["skipped_missing_required_fields"] += 1
+            print(
+                f"DEBUG EMAIL CRON: Skipping '{summary}' (ID: {event['id']}) - "
+                f"missing Email/Duration/Service metadata."
+            )
+            return None
 
-                debug_counts["events_seen"] += 1
+        local_start = start_dt.astimezone(ZoneInfo(LOCAL_TIMEZONE))
+        booking_date_formatted = local_start.strftime('%B %d, %Y')
+        booking_time_formatted = local_start.strftime('%I:%M %p')
 
-                # Smart logic: Skip if a reminder was already sent for THIS specific start time
-                current_start_iso = event['start'].get('dateTime')
-                if not current_start_iso:
-                    debug_counts["skipped_all_day"] += 1
-                    continue # Skip all-day events
+        client_full_name = (
+            summary.split(" for ")[-1].strip()
+            if " for " in summary.lower()
+            else "Valued Client"
+        )
+        name_parts = client_full_name.split(' ')
+        first_name = name_parts[0] if name_parts else "Valued"
+        last_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
+
+        calendar_event_id = event['id']
+        intake_url = build_intake_form_url(
+            first_name=first_name,
+            last_name=last_name,
+            booking_date_formatted=booking_date_formatted,
+            booking_time_formatted=booking_time_formatted,
+            email=meta["email"],
+            phone=meta["phone"],
+            comments=meta["comments"],
+            calendar_event_id=calendar_event_id
+        )
+
+        # Manual bookings only: if SOAP link is missing, append intake + SOAP links.
+        # Online bookings already have the SOAP tag, so their descriptions are left alone.
+        links = []
+        if self.soap_tag not in description:
+            soap_url = build_soap_form_url(
+                summary=summary,
+                booking_date_formatted=booking_date_formatted,
+                booking_time_formatted=booking_time_formatted,
+                comments=meta["comments"],
+                calendar_event_id=calendar_event_id
+            )
+            links = [
+                (self.soap_tag, f'<a href="{soap_url}">SOAP Form</a>'),
+                (self.intake_link_tag, f'<a href="{intake_url}">Client Intake Form</a>'),
+            ]
+            self.debug_counts["manual_links_added"] += 1
+            print(
+                f"DEBUG EMAIL CRON: Added intake/SOAP links for manual booking "
+                f"'{summary}' (ID: {calendar_event_id})."
+            )
+
+        return {
+            "event_id": calendar_event_id,
+            "summary": summary,
+            "client_email": meta["email"],
+            "first_name": first_name,
+            "duration": meta["duration"],
+            "service_type": meta["service"],
+            "formatted_date": local_start.strftime('%B %d'),
+            "formatted_time": local_start.strftime('%I:%M %p'),
+            "intake_url": intake_url,
+            "links": links,
+        }
+
+    def deliver(self, delivery):
+        """Sends the reminder email; runs on a dispatch thread and returns (success, error_message)."""
+        esc = html.escape
+        email_subject, email_body_html = REMINDER_EMAIL.render(
+            first_name=esc(delivery['first_name']),
+            duration=esc(delivery['duration']),
+            service_type=esc(delivery['service_type']),
+            formatted_date=esc(delivery['formatted_date']),
+            formatted_time=esc(delivery['formatted_time']),
+            intake_url=delivery['intake_url'],
+        )
+        return send_email(delivery["client_email"], email_subject, email_body_html)
+
+    def record(self, delivery, email_success, email_error):
+        self.debug_counts["email_attempted"] += 1
+        if email_success:
+            self.sent_count += 1
+            print(
+                f"INFO: EMAIL REMINDER SENT: to {delivery['client_email']} for '{delivery['summary']}' "
+                f"(ID: {delivery['event_id']})"
+            )
+        else:
+            self.debug_counts["email_failed"] += 1
+            self.debug_counts["last_error"] = email_error
+            print(
+                f"WARNING: Email reminder failed for '{delivery['summary']}' "
+                f"(ID: {delivery['event_id']}) with error: {email_error}"
+            )
+
+# --- Reminder Dispatch ---
+# Sends used to run one after another, so one slow provider (TextBee allows a 30s timeout)
+# stalled the whole cron request. Due reminders are sent on a small pool instead, with a
+# concurrency cap and a start-rate limit per provider.
+REMINDER_SMS_CONCURRENCY = int(os.getenv("REMINDER_SMS_CONCURRENCY", "2"))
+REMINDER_SMS_RATE_PER_SECOND = float(os.getenv("REMINDER_SMS_RATE_PER_SECOND", "1"))
+REMINDER_EMAIL_CONCURRENCY = int(os.getenv("REMINDER_EMAIL_CONCURRENCY", "4"))
+REMINDER_EMAIL_RATE_PER_SECOND = float(os.getenv("REMINDER_EMAIL_RATE_PER_SECOND", "5"))
+
+class ProviderLimiter:
+    """Context manager capping concurrent calls to one provider and spacing call starts to rate_per_second."""
+
+    def __init__(self, concurrency, rate_per_second):
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+
+_reminder_limiters = {
+    "sms": ProviderLimiter(REMINDER_SMS_CONCURRENCY, REMINDER_SMS_RATE_PER_SECOND),
+    "email": ProviderLimiter(REMINDER_EMAIL_CONCURRENCY, REMINDER_EMAIL_RATE_PER_SECOND),
+}
+
+_reminder_executor = ThreadPoolExecutor(
+    max_workers=max(1, REMINDER_SMS_CONCURRENCY) + max(1, REMINDER_EMAIL_CONCURRENCY),
+    thread_name_prefix="reminder_dispatch",
+)
+
+def _deliver_reminder(channel, delivery):
+    with _reminder_limiters[channel.name]:
+        return channel.deliver(delivery)
+
+def dispatch_reminders(marked):
+    """Sends (channel, delivery) pairs in parallel and records each outcome in its channel's debug_counts."""
+    futures = {
+        _reminder_executor.submit(_deliver_reminder, channel, delivery): (channel, delivery)
+        for channel, delivery in marked
+    }
+    for future in as_completed(futures):
+        channel, delivery = futures[future]
+        try:
+            success, error_message = future.result()
+        except Exception as e:
+            success, error_message = False, str(e)
+        # Outcomes are recorded on the calling thread, so debug_counts needs no locking.
+        channel.record(delivery, success, error_message)
+
+REMINDER_MARK_MAX_ATTEMPTS = 3
+
+def _mark_reminders_sent(service, calendar_id, event, due, norm_current, run_id):
+    """
+    Writes the due channels' sent markers (tagged with this run's ID) in one If-Match patch and
+    returns the (channel, delivery) pairs this run may send. A 412 (the SMS and email crons share
+    the event's ETag) or a 5xx (the patch may have been applied anyway) re-reads the event:
+    channels marked by this run are kept, channels marked by another run are dropped, and the
+    rest are patched again under the new ETag.
+    """
+    summary = event.get('summary', '')
+    owned = []
+    for _ in range(REMINDER_MARK_MAX_ATTEMPTS):
+        description = event.get('description', '') or ""
+        private = {}
+        linked_desc = description
+        for channel, delivery in due:
+            private[channel.state_key] = norm_current
+            private[f"{channel.state_key}_run"] = run_id
+            for tag, content in delivery["links"]:
+                linked_desc = safe_append_description(linked_desc, tag, content)
+        body = {'extendedProperties': {'private': private}}
+        if linked_desc != description:
+            body['description'] = linked_desc
+        try:
+            patched = patch_event_with_etag(
+                service=service,
+                calendar_id=calendar_id,
+                event_id=event['id'],
+                body=body,
+                etag=event.get('etag')
+            )
+        except HttpError as e:
+            if e.resp.status != 412 and e.resp.status < 500:
+                print(f"ERROR: Failed to lock reminders for event {event['id']}: {e}")
+                return owned
+            print(f"DEBUG CRON: Patch for '{summary}' returned {e.resp.status}; re-reading the event.")
+        except Exception as e:
+            print(f"ERROR: Failed to lock reminders for event {event['id']}: {e}")
+            return owned
+        else:
+            _event_descriptions.remember(calendar_id, patched)
+            patched_props = (patched.get('extendedProperties') or {}).get('private') or {}
+            print(f"DEBUG CRON: Marked event '{summary}' as sent for: {', '.join(channel.name for channel, _ in due)}.")
+            for channel, delivery in due:
+                if patched_props.get(channel.state_key) != norm_current:
+                    print(
+                        f"ERROR: {channel.state_key} did not persist on '{summary}' "
+                        f"(ID: {event['id']}); skipping {channel.name} reminder to avoid duplicates."
+                    )
+                    continue
+                owned.append((channel, delivery))
+            return owned
+
+        try:
+            event = execute_with_retry(service.events().get(
+                calendarId=calendar_id, eventId=event['id'], fields=','.join(REMINDER_EVENT_FIELDS)
+            ))
+        except Exception as e:
+            print(f"ERROR: Failed to re-read event {event['id']} after a failed reminder mark: {e}")
+            return owned
+        start_iso = (event.get('start') or {}).get('dateTime')
+        if event.get('status') == 'cancelled' or not start_iso or parse_iso_datetime(start_iso).isoformat() != norm_current:
+            print(f"DEBUG CRON: '{summary}' was moved or cancelled meanwhile; not sending its reminders.")
+            return owned
+        props = (event.get('extendedProperties') or {}).get('private') or {}
+        still_due = []
+        for channel, delivery in due:
+            if props.get(channel.state_key) not in (norm_current, start_iso):
+                still_due.append((channel, delivery))
+            elif props.get(f"{channel.state_key}_run") == run_id:
+                owned.append((channel, delivery))  # our earlier patch was applied after all
+            else:
+                channel.debug_counts["mark_sent_conflicts"] += 1
+                print(f"DEBUG CRON: {channel.name} reminder for '{summary}' was already marked by another run.")
+        due = still_due
+        if not due:
+            return owned
+    print(f"ERROR: Event {event['id']} kept changing; gave up marking reminders after {REMINDER_MARK_MAX_ATTEMPTS} attempts.")
+    return owned
+
+def run_reminder_pass(service, channels, now=None):
+    """
+    Lists the reminder window once and runs every channel over it. For each event due on at
+    least one channel, the channels' sent markers are written in one ETag-guarded patch
+    before anything is sent, so a concurrent run can never send the same reminder twice.
+    The marked reminders are then sent in parallel by dispatch_reminders().
+    """
+    now = now or datetime.datetime.now(timezone.utc)
+    window_start = now + timedelta(hours=REMINDER_TARGET_HOURS - REMINDER_TOLERANCE_HOURS)
+    window_end = now + timedelta(hours=REMINDER_TARGET_HOURS + REMINDER_TOLERANCE_HOURS)
+    processed_keys = set() # Prevent duplicate sends for synced calendars
+    marked = []
+    run_id = uuid.uuid4().hex[:12]
+
+    for calendar_id in [PRIMARY_CALENDAR_ID]:
+        # timeMin/timeMax match events overlapping the window; the start time is checked below.
+        events = iter_calendar_events(
+            service,
+            calendar_id,
+            item_fields=REMINDER_EVENT_FIELDS,
+            timeMin=window_start.isoformat(),
+            timeMax=window_end.isoformat(),
+            singleEvents=True,
+            orderBy='startTime'
+        )
+        sent_keys = _reminder_state.sent_keys(calendar_id, window_start, window_end)
+
+        for event in events:
+            summary = event.get('summary', '')
+            active = []
+            for channel in channels:
+                if channel.skips_summary(summary):
+                    channel.debug_counts["skipped_open_for_bookings"] += 1
+                else:
+                    channel.debug_counts["events_seen"] += 1
+                    active.append(channel)
+            if not active:
+                continue
 
-                # Normalize ISO strings to ensure reliable comparison
-                norm_current = datetime.datetime.fromisoformat(current_start_iso.replace('Z', '+00:00')).isoformat()
+            current_start_iso = event['start'].get('dateTime')
+            if not current_start_iso:
+                for channel in active:
+                    channel.debug_counts["skipped_all_day"] += 1
+                continue # Skip all-day events
 
-                # Skip if already processed in this specific run
-                event_key = f"{event['id']}_{norm_current}"
-                if event_key in processed_keys:
-                    continue
-                processed_keys.add(event_key)
+            # Normalize ISO strings to ensure reliable comparison
+            start_dt = parse_iso_datetime(current_start_iso)
+            norm_current = start_dt.isoformat()
 
-                reminder_sent_tag_prefix = "SMS_REMINDER_SENT_FOR: "
-                legacy_reminder_sent_tag_prefix = "REMINDER_SENT_FOR: "
-                reminder_lock_tag_prefix = "REMINDER_LOCKED_FOR: "
-                specific_sent_tag = f"{reminder_sent_tag_prefix}{norm_current}"
+            # Skip if already processed in this specific run
+            event_key = f"{event['id']}_{norm_current}"
+            if event_key in processed_keys:
+                continue
+            processed_keys.add(event_key)
 
-                # 1. DISPERSE WORKERS: Add random jitter to prevent synchronized race conditions
-                time.sleep(random.uniform(0.1, 1.2))
+            hours_until_appt = (start_dt - now).total_seconds() / 3600
+            if abs(hours_until_appt - REMINDER_TARGET_HOURS) > REMINDER_TOLERANCE_HOURS:
+                for channel in active:
+                    channel.debug_counts["skipped_outside_time_window"] += 1
+                continue
 
-                # 2. ATOMIC LOCK: Re-fetch the event to check for a tag added by another worker
-                try:
-                    fresh_event = execute_with_retry(service.events().get(calendarId=calendar_id, eventId=event['id']))
-                    fresh_desc = fresh_event.get('description', '') or ""
-
-                    # Skip if an SMS reminder was already sent for THIS start time.
-                    # Do not treat EMAIL_REMINDER_SENT_FOR as an SMS sent marker.
-                    if description_has_sms_reminder_tag(fresh_desc, norm_current, current_start_iso):
-                        debug_counts["skipped_already_sent"] += 1
-                        print(f"DEBUG CRON: Skipping '{summary}' (ID: {event['id']}) - Reminder already sent for {norm_current}.")
-                        continue
-                except Exception as e:
-                    print(f"ERROR: Failed to verify status for event {event['id']}: {e}")
+            description = event.get('description', '') or ""
+            private_props = (event.get('extendedProperties') or {}).get('private') or {}
+            due = []
+            for channel in active:
+                # Skip if this channel already sent for THIS start time (a moved event is due again).
+                if (
+                    (event['id'], channel.name, norm_current) in sent_keys
+                    or private_props.get(channel.state_key) in (norm_current, current_start_iso)
+                    or channel.sent_per_description(description, norm_current, current_start_iso)
+                ):
+                    channel.debug_counts["skipped_already_sent"] += 1
+                    print(
+                        f"DEBUG CRON: Skipping '{summary}' (ID: {event['id']}) - "
+                        f"{channel.name} reminder already sent for {norm_current}."
+                    )
                     continue
+                delivery = channel.prepare(event, description, start_dt)
+                if delivery:
+                    due.append((channel, delivery))
+            if not due:
+                continue
 
-                # Parse metadata
-                phone = None
-                # Use Regex to find metadata regardless of HTML tags or line position
-                phone_match = re.search(r'phone:\s*([\+\d\s\-\(\)]+)', fresh_desc, re.IGNORECASE)
-                duration_match = re.search(r'duration:\s*([^<\n\r]+)', fresh_desc, re.IGNORECASE)
-                service_match = re.search(r'service:\s*([^<\n\r]+)', fresh_desc, re.IGNORECASE)
-
-                if phone_match:
-                    phone = phone_match.group(1).strip()
-                duration = duration_match.group(1).strip() if duration_match else ""
-                service_type = service_match.group(1).strip() if service_match else ""
-
-                if not phone:
-                    debug_counts["skipped_no_phone"] += 1
-                    print(f"DEBUG CRON: Skipping '{summary}' (ID: {event['id']}) - no phone metadata found.")
-                    continue
+            # ATOMIC SEND MARK: write the sent state under the listed ETag, then send.
+            # If a send fails, the state stays so the next cron run does not send a duplicate.
+            for channel, delivery in _mark_reminders_sent(service, calendar_id, event, due, norm_current, run_id):
+                _reminder_state.record(calendar_id, event['id'], channel.name, start_dt)
+                marked.append((channel, delivery))
 
-                start_dt = datetime.datetime.fromisoformat(current_start_iso.replace('Z', '+00:00'))
+    dispatch_reminders(marked)
 
-                TARGET_HOURS = 26
-                TOLERANCE = 1.0
+def _authorize_cron_request():
+    """Returns an error response unless the request carries the cron key (when one is configured)."""
+    cron_key = os.getenv("CRON_SECRET_KEY")
+    if cron_key and request.args.get('key') != cron_key:
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
 
-                hours_until_appt = (start_dt - now).total_seconds() / 3600
+@app.route('/api/cron/reminders', methods=['GET']) # This is the cron job endpoint
+def trigger_reminders():
+    """Cron endpoint to send SMS reminders 26 hours before appointments."""
+    # Security check: Ensure only authorized requests can trigger reminders
+    unauthorized = _authorize_cron_request()
+    if unauthorized:
+        return unauthorized
 
-                if abs(hours_until_appt - TARGET_HOURS) > TOLERANCE:
-                    debug_counts["skipped_outside_time_window"] += 1
-                    print(
-                        f"DEBUG CRON: Skipping '{summary}' (ID: {event['id']}) - "
-                        f"hours_until_appt={hours_until_appt:.2f}, target={TARGET_HOURS}±{TOLERANCE}."
-                    )
-                    continue
+    service = get_calendar_service()
+    if not service:
+        print("CRON ERROR: Google Calendar service unavailable. Cannot fetch events for reminders.")
+        return jsonify({"error": "Google Calendar service unavailable"}), 500
 
-                # 3. ATOMIC SEND MARK:
-                # Mark SMS reminder sent first under ETag, then send SMS.
-                # If SMS fails, keep the tag so cron does not send duplicate reminders.
-                try:
-                    # Remove any previous SMS sent/lock markers for this appointment,
-                    # then write the "sent" marker exactly once. Never strip EMAIL_ tags.
-                    clean_lines = []
-                    for line in fresh_desc.split('\n'):
-                        stripped = line.strip()
-                        if stripped.startswith("EMAIL_REMINDER_SENT_FOR:"):
-                            clean_lines.append(line)
-                            continue
-                        if (
-                            stripped.startswith(reminder_sent_tag_prefix)
-                            or stripped.startswith(legacy_reminder_sent_tag_prefix)
-                            or stripped.startswith(reminder_lock_tag_prefix)
-                        ):
-                            continue
-                        clean_lines.append(line)
-                    locked_desc = "\n".join(clean_lines).rstrip() + f"\n{specific_sent_tag}"
-                    patch_event_description_with_etag(
-                        service=service,
-                        calendar_id=calendar_id,
-                        event_id=event['id'],
-                        description=locked_desc,
-                        etag=fresh_event.get('etag')
-                    )
-                    verified_event = execute_with_retry(
-                        service.events().get(calendarId=calendar_id, eventId=event['id'])
-                    )
-                    verified_desc = verified_event.get('description', '') or ""
-                    if not description_has_sms_reminder_tag(verified_desc, norm_current, current_start_iso):
-                        print(
-                            f"ERROR: SMS_REMINDER_SENT tag did not persist on '{summary}' "
-                            f"(ID: {event['id']}); skipping SMS to avoid duplicates."
-                        )
-                        continue
-                    print(f"DEBUG CRON: Marked event '{summary}' as SMS-sent.")
-                except HttpError as e:
-                    if e.resp.status == 412:
-                        debug_counts["mark_sent_conflicts"] += 1
-                        print(f"DEBUG CRON: Conflict detected for '{summary}'. Another worker already sent this.")
-                        continue
-                    print(f"ERROR: Failed to lock event {event['id']}: {e}")
-                    continue
-                except Exception as e:
-                    print(f"ERROR: Failed to lock event {event['id']}: {e}")
-                    continue
+    debug_mode = request.args.get('debug', '').lower() in ('1', 'true', 'yes')
 
-                # 4. SEND SMS: Only reachable if the 'lock' above succeeded
-                local_start = start_dt.astimezone(local_tz)
-                client_full_name = summary.split(" for ")[-1].strip() if " for " in summary.lower() else "Valued Client"
-                first_name = client_full_name.split(' ')[0]
-                formatted_date = local_start.strftime('%B %d')
-                formatted_time = local_start.strftime('%I:%M %p')
-                msg_body = (
-                    f"Hi {first_name}! This is a reminder of your {duration} {service_type} appointment "
-                    f"tomorrow {formatted_date} at {formatted_time} at Chelsea Vaccaro Therapeutic Massage. "
-                    "If you have not done so already, please fill out your client intake form via the link "
-                    "within your booking confirmation or reminder email. I look forward to seeing you! -Chelsea"
-                )
+    try:
+        sms = SmsReminderChannel()
+        run_reminder_pass(service, [sms])
 
-                debug_counts["sms_attempted"] += 1
-                sms_success, sms_error_message = send_sms(phone, msg_body)
-                if sms_success:
-                    sent_count += 1
-                    print(f"INFO: REMINDER SENT: to {phone} for '{summary}' (ID: {event['id']})")
-                else: # SMS failed
-                    debug_counts["sms_failed"] += 1
-                    debug_counts["last_error"] = sms_error_message
-                    # Keep REMINDER_SENT_FOR tag to prevent duplicate texts on the next cron run.
-                    print(f"WARNING: SMS failed for '{summary}' (ID: {event['id']}) with error: {sms_error_message}")
-
-        response_payload = {"status": "success", "reminders_sent": sent_count}
+        response_payload = {"status": "success", "reminders_sent": sms.sent_count}
         if debug_mode:
-            response_payload["debug"] = debug_counts
+            response_payload["debug"] = sms.debug_counts
         return jsonify(response_payload)
     except Exception as e:
         print(f"CRON ERROR: {e}")
@@ -1580,13 +3620,9 @@ def trigger_email_reminders():
     Separate from SMS reminders. Requires Email, Duration, and Service in the event description.
     For manual bookings (no existing SOAP link), also appends intake + SOAP links.
     """
-    cron_key = os.getenv("CRON_SECRET_KEY")
-    if cron_key and request.args.get('key') != cron_key:
-        return jsonify({"error": "Unauthorized"}), 401
-
-    now = datetime.datetime.now(timezone.utc)
-    time_min = now
-    time_max = now + timedelta(hours=48)
+    unauthorized = _authorize_cron_request()
+    if unauthorized:
+        return unauthorized
 
     service = get_calendar_service()
     if not service:
@@ -1596,250 +3632,82 @@ def trigger_email_reminders():
     debug_mode = request.args.get('debug', '').lower() in ('1', 'true', 'yes')
 
     try:
-        sent_count = 0
-        local_tz = ZoneInfo(LOCAL_TIMEZONE)
-        processed_keys = set()
-        debug_counts = {
-            "events_seen": 0,
-            "skipped_open_for_bookings": 0,
-            "skipped_all_day": 0,
-            "skipped_already_sent": 0,
-            "skipped_missing_required_fields": 0,
-            "skipped_outside_time_window": 0,
-            "mark_sent_conflicts": 0,
-            "email_attempted": 0,
-            "email_failed": 0,
-            "manual_links_added": 0,
-            "last_error": None
-        }
-
-        soap_tag = "--- ADMIN: SOAP NOTE LINK ---"
-        intake_link_tag = "--- ADMIN: CLIENT INTAKE FORM ---"
-        email_sent_tag_prefix = "EMAIL_REMINDER_SENT_FOR: "
-
-        for calendar_id in [PRIMARY_CALENDAR_ID]:
-            res = service.events().list(
-                calendarId=calendar_id,
-                timeMin=time_min.isoformat(),
-                timeMax=time_max.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            for event in res.get('items', []):
-                summary = event.get('summary', '')
-                if summary.lower().strip() == 'open for bookings':
-                    debug_counts["skipped_open_for_bookings"] += 1
-                    continue
-                if summary.upper().startswith('WAITLIST:'):
-                    debug_counts["skipped_open_for_bookings"] += 1
-                    continue
-
-                debug_counts["events_seen"] += 1
-
-                current_start_iso = event['start'].get('dateTime')
-                if not current_start_iso:
-                    debug_counts["skipped_all_day"] += 1
-                    continue
-
-                norm_current = datetime.datetime.fromisoformat(
-                    current_start_iso.replace('Z', '+00:00')
-                ).isoformat()
-
-                event_key = f"{event['id']}_{norm_current}"
-                if event_key in processed_keys:
-                    continue
-                processed_keys.add(event_key)
+        email = EmailReminderChannel()
+        run_reminder_pass(service, [email])
 
-                specific_sent_tag = f"{email_sent_tag_prefix}{norm_current}"
-
-                time.sleep(random.uniform(0.1, 1.2))
-
-                try:
-                    fresh_event = execute_with_retry(
-                        service.events().get(calendarId=calendar_id, eventId=event['id'])
-                    )
-                    fresh_desc = fresh_event.get('description', '') or ""
-
-                    if (
-                        specific_sent_tag in fresh_desc
-                        or f"{email_sent_tag_prefix}{current_start_iso}" in fresh_desc
-                    ):
-                        debug_counts["skipped_already_sent"] += 1
-                        print(
-                            f"DEBUG EMAIL CRON: Skipping '{summary}' (ID: {event['id']}) - "
-                            f"Email reminder already sent for {norm_current}."
-                        )
-                        continue
-                except Exception as e:
-                    print(f"ERROR: Failed to verify email-reminder status for event {event['id']}: {e}")
-                    continue
-
-                meta = parse_appointment_description_metadata(fresh_desc)
-                client_email = meta["email"]
-                duration = meta["duration"]
-                service_type = meta["service"]
-                phone = meta["phone"]
-                comments = meta["comments"]
-
-                if not client_email or not duration or not service_type:
-                    debug_counts["skipped_missing_required_fields"] += 1
-                    print(
-                        f"DEBUG EMAIL CRON: Skipping '{summary}' (ID: {event['id']}) - "
-                        f"missing Email/Duration/Service metadata."
-                    )
-                    continue
-
-                start_dt = datetime.datetime.fromisoformat(current_start_iso.replace('Z', '+00:00'))
-                TARGET_HOURS = 26
-                TOLERANCE = 1.0
-                hours_until_appt = (start_dt - now).total_seconds() / 3600
-
-                if abs(hours_until_appt - TARGET_HOURS) > TOLERANCE:
-                    debug_counts["skipped_outside_time_window"] += 1
-                    print(
-                        f"DEBUG EMAIL CRON: Skipping '{summary}' (ID: {event['id']}) - "
-                        f"hours_until_appt={hours_until_appt:.2f}, target={TARGET_HOURS}±{TOLERANCE}."
-                    )
-                    continue
-
-                local_start = start_dt.astimezone(local_tz)
-                booking_date_formatted = local_start.strftime('%B %d, %Y')
-                booking_time_formatted = local_start.strftime('%I:%M %p')
-                formatted_date = local_start.strftime('%B %d')
-                formatted_time = local_start.strftime('%I:%M %p')
-
-                client_full_name = (
-                    summary.split(" for ")[-1].strip()
-                    if " for " in summary.lower()
-                    else "Valued Client"
-                )
-                name_parts = client_full_name.split(' ')
-                first_name = name_parts[0] if name_parts else "Valued"
-                last_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
-
-                calendar_event_id = event['id']
-                intake_url = build_intake_form_url(
-                    first_name=first_name,
-                    last_name=last_name,
-                    booking_date_formatted=booking_date_formatted,
-                    booking_time_formatted=booking_time_formatted,
-                    email=client_email,
-                    phone=phone,
-                    comments=comments,
-                    calendar_event_id=calendar_event_id
-                )
+        response_payload = {"status": "success", "email_reminders_sent": email.sent_count}
+        if debug_mode:
+            response_payload["debug"] = email.debug_counts
+        return jsonify(response_payload)
+    except Exception as e:
+        print(f"EMAIL CRON ERROR: {e}")
+        return jsonify({"error": str(e)}), 500
 
-                # Manual bookings only: if SOAP link is missing, append intake + SOAP links.
-                # Online bookings already have the SOAP tag, so their descriptions are left alone.
-                working_desc = fresh_desc
-                if soap_tag not in working_desc:
-                    soap_url = build_soap_form_url(
-                        summary=summary,
-                        booking_date_formatted=booking_date_formatted,
-                        booking_time_formatted=booking_time_formatted,
-                        comments=comments,
-                        calendar_event_id=calendar_event_id
-                    )
-                    working_desc = safe_append_description(
-                        working_desc, soap_tag, f'<a href="{soap_url}">SOAP Form</a>'
-                    )
-                    working_desc = safe_append_description(
-                        working_desc, intake_link_tag, f'<a href="{intake_url}">Client Intake Form</a>'
-                    )
-                    debug_counts["manual_links_added"] += 1
-                    print(
-                        f"DEBUG EMAIL CRON: Added intake/SOAP links for manual booking "
-                        f"'{summary}' (ID: {calendar_event_id})."
-                    )
+@app.route('/api/cron/all-reminders', methods=['GET'])
+def trigger_all_reminders():
+    """Cron endpoint that sends SMS and email reminders from a single pass over the calendar."""
+    unauthorized = _authorize_cron_request()
+    if unauthorized:
+        return unauthorized
 
-                # Atomic mark: write EMAIL_REMINDER_SENT_FOR before sending
-                try:
-                    clean_lines = [
-                        line for line in working_desc.split('\n')
-                        if not line.strip().startswith(email_sent_tag_prefix)
-                    ]
-                    locked_desc = "\n".join(clean_lines).rstrip() + f"\n{specific_sent_tag}"
-                    patch_event_description_with_etag(
-                        service=service,
-                        calendar_id=calendar_id,
-                        event_id=calendar_event_id,
-                        description=locked_desc,
-                        etag=fresh_event.get('etag')
-                    )
-                    verified_event = execute_with_retry(
-                        service.events().get(calendarId=calendar_id, eventId=calendar_event_id)
-                    )
-                    verified_desc = verified_event.get('description', '') or ""
-                    if specific_sent_tag not in verified_desc:
-                        print(
-                            f"ERROR: EMAIL_REMINDER_SENT tag did not persist on '{summary}' "
-                            f"(ID: {calendar_event_id}); skipping email to avoid duplicates."
-                        )
-                        continue
-                    print(f"DEBUG EMAIL CRON: Marked event '{summary}' as email-reminder-sent.")
-                except HttpError as e:
-                    if e.resp.status == 412:
-                        debug_counts["mark_sent_conflicts"] += 1
-                        print(
-                            f"DEBUG EMAIL CRON: Conflict detected for '{summary}'. "
-                            "Another worker already processed this."
-                        )
-                        continue
-                    print(f"ERROR: Failed to lock email reminder for event {calendar_event_id}: {e}")
-                    continue
-                except Exception as e:
-                    print(f"ERROR: Failed to lock email reminder for event {calendar_event_id}: {e}")
-                    continue
+    service = get_calendar_service()
+    if not service:
+        print("CRON ERROR: Google Calendar service unavailable. Cannot fetch events for reminders.")
+        return jsonify({"error": "Google Calendar service unavailable"}), 500
 
-                esc = html.escape
-                email_subject = "Appointment Reminder - Chelsea Vaccaro Therapeutic Massage"
-                email_body_html = f"""
-                <html>
-                <head>
-                    <style>
-                        .email-cta:hover {{
-                            background-color: #ffffff !important;
-                            color: #000000 !important;
-                        }}
-                    </style>
-                </head>
-                <body>
-                <p>Hi {esc(first_name)}!</p>
-                <p>This is a reminder of your <strong>{esc(duration)} {esc(service_type)}</strong> appointment
-                tomorrow <strong>{esc(formatted_date)}</strong> at <strong>{esc(formatted_time)}</strong>
-                at Chelsea Vaccaro Therapeutic Massage.</p>
-                <p>If you have not done so already, please fill out your client intake form here:</p>
-                <p><a href="{intake_url}" class="email-cta" style="display: inline-block; padding: 12px 24px; border: 1px solid #000; background-color: #000; color: #fff; font-size: 1rem; font-weight: bold; text-decoration: none; border-radius: 50px;">Complete Intake Form</a></p>
-                <p>I look forward to seeing you!<br>-Chelsea</p>
-                </body>
-                </html>
-                """
-
-                debug_counts["email_attempted"] += 1
-                email_success, email_error = send_email(client_email, email_subject, email_body_html)
-                if email_success:
-                    sent_count += 1
-                    print(
-                        f"INFO: EMAIL REMINDER SENT: to {client_email} for '{summary}' "
-                        f"(ID: {calendar_event_id})"
-                    )
-                else:
-                    debug_counts["email_failed"] += 1
-                    debug_counts["last_error"] = email_error
-                    print(
-                        f"WARNING: Email reminder failed for '{summary}' "
-                        f"(ID: {calendar_event_id}) with error: {email_error}"
-                    )
+    debug_mode = request.args.get('debug', '').lower() in ('1', 'true', 'yes')
 
-        response_payload = {"status": "success", "email_reminders_sent": sent_count}
+    try:
+        sms = SmsReminderChannel()
+        email = EmailReminderChannel()
+        run_reminder_pass(service, [sms, email])
+
+        response_payload = {
+            "status": "success",
+            "reminders_sent": sms.sent_count,
+            "email_reminders_sent": email.sent_count
+        }
         if debug_mode:
-            response_payload["debug"] = debug_counts
+            response_payload["debug"] = {"sms": sms.debug_counts, "email": email.debug_counts}
         return jsonify(response_payload)
     except Exception as e:
-        print(f"EMAIL CRON ERROR: {e}")
+        print(f"CRON ERROR: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/internal/metrics', methods=['GET'])
+def internal_metrics():
+    """Operational counters for in-process caches. Protected by the cron key like the cron endpoints."""
+    unauthorized = _authorize_cron_request()
+    if unauthorized:
+        return unauthorized
+
+    return jsonify({
+        "available_days_cache": _available_days_cache.stats(),
+        "sheets_write_behind": _sheets_writes.stats(),
+        "background_jobs": _background_jobs.stats(),
+        "persistent_jobs": _job_queue.stats(),
+        "google_http_pool": _google_http_pool.stats(),
+        "intake_uploads": _intake_spool.stats(),
+    })
+
+@app.route('/api/internal/sheets-dead-letters/replay', methods=['POST'])
+def replay_sheets_dead_letters():
+    """Requeues dead-lettered Sheets writes (all, or ?ids=1,2,3). Protected by the cron key."""
+    unauthorized = _authorize_cron_request()
+    if unauthorized:
+        return unauthorized
+
+    ids_str = request.args.get('ids')
+    try:
+        ids = [int(row_id) for row_id in ids_str.split(',') if row_id.strip()] if ids_str else None
+    except ValueError:
+        return jsonify({"error": "'ids' must be comma-separated integers."}), 400
+    try:
+        requeued = _sheets_writes.replay_dead_letters(ids)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Failed to requeue dead-lettered writes: {e}"}), 500
+    return jsonify({"requeued": requeued})
+
 @app.route('/api/webhooks/textbee', methods=['POST'])
 def textbee_webhook():
     """Webhook listener for TextBee SMS status updates."""
@@ -1875,11 +3743,411 @@ def textbee_webhook():
 
     return 'OK', 200
 
-def _handle_intake_submission_background(data, pdf_output):
-    """Handles slow tasks (Sheets, Email) for intake form in the background."""
+# --- Intake Upload Streaming ---
+# /api/submit-intake used to request.get_json() a body holding two full-resolution base64 canvas
+# drawings, then split and decode them, so several full copies were alive at once. The body is
+# now parsed straight off the request stream. Ordinary fields are read one at a time (each capped
+# at INTAKE_MAX_FIELD_BYTES). The drawingFront/drawingBack data URLs are base64-decoded chunk by
+# chunk into files in INTAKE_SPOOL_DIR, and only those paths travel through the job queue into
+# the render process. Memory per intake stays around one read chunk (see intake_uploads in
+# /api/internal/metrics).
+INTAKE_IMAGE_FIELDS = ('drawingFront', 'drawingBack')
+INTAKE_MAX_FIELD_BYTES = int(os.getenv("INTAKE_MAX_FIELD_BYTES", str(64 * 1024)))
+INTAKE_STREAM_CHUNK_BYTES = 64 * 1024
+INTAKE_SPOOL_DIR = os.getenv("INTAKE_SPOOL_DIR", "").strip() or os.path.join(
+    os.path.dirname(os.path.abspath(LOCAL_STATE_DB)), "intake_spool"
+)
+INTAKE_SPOOL_RETENTION_SECONDS = 7 * 24 * 3600
+
+class IntakeStreamDecoder:
+    """Parses one JSON object from a byte stream, spooling base64 data-URL image fields to files."""
+
+    _WHITESPACE = b' \t\r\n'
+
+    def __init__(self, stream, image_fields, spool_dir, max_field_bytes, chunk_size=INTAKE_STREAM_CHUNK_BYTES):
+        self._stream = stream
+        self._image_fields = image_fields
+        self._spool_dir = spool_dir
+        self._max_field_bytes = max_field_bytes
+        self._chunk_size = chunk_size
+        self._buf = b''
+        self._pos = 0
+        self.peak_buffer_bytes = 0
+        self.drawings = {}  # field -> {"path", "sha256", "bytes"}
+
+    def _fill(self):
+        """Reads the next chunk, keeping the unconsumed tail. Returns False at end of stream."""
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self.peak_buffer_bytes = max(self.peak_buffer_bytes, len(self._buf))
+        return True
+
+    def _next_char(self, skip_whitespace=True):
+        while True:
+            if self._pos >= len(self._buf) and not self._fill():
+                raise ValueError("Unexpected end of JSON body.")
+            ch = self._buf[self._pos:self._pos + 1]
+            self._pos += 1
+            if not (skip_whitespace and ch in self._WHITESPACE):
+                return ch
+
+    def _read_raw_value(self, first):
+        """Returns the raw bytes of the JSON value starting with `first` (already consumed)."""
+        raw = bytearray(first)
+        in_string = first == b'"'
+        depth = 1 if first in (b'[', b'{') else 0
+        escaped = False
+        is_scalar = first not in (b'"', b'[', b'{')
+        while in_string or depth > 0 or is_scalar:
+            if len(raw) > self._max_field_bytes:
+                raise ValueError(f"JSON field exceeds {self._max_field_bytes} bytes.")
+            if self._pos >= len(self._buf) and not self._fill():
+                if depth == 0 and not in_string:
+                    break
+                raise ValueError("Unexpected end of JSON body.")
+            ch = self._buf[self._pos:self._pos + 1]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == b'\\':
+                    escaped = True
+                elif ch == b'"':
+                    in_string = False
+            elif ch == b'"':
+                in_string = True
+            elif ch in (b'[', b'{'):
+                depth += 1
+            elif ch in (b']', b'}', b','):
+                if depth == 0:
+                    break # End of a bare scalar; the delimiter belongs to the enclosing object.
+                if ch != b',':
+                    depth -= 1
+            raw += ch
+            self._pos += 1
+        return bytes(raw)
+
+    def _spool_image_string(self, field):
+        """
+        Reads the rest of a JSON string (opening quote consumed). A base64 data URL is decoded
+        into a new spool file and its {path, sha256, bytes} returned; anything else returns None.
+        """
+        header = bytearray()
+        while b'base64,' not in header:
+            ch = self._next_char(skip_whitespace=False)
+            if ch == b'"':
+                return None
+            if ch == b'\\':
+                ch += self._next_char(skip_whitespace=False)
+            header += ch
+            if len(header) > 256:
+                self._read_raw_value(b'"') # Not a data URL: skip the rest of the string.
+                return None
+
+        os.makedirs(self._spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self._spool_dir, prefix=f"{field}-", suffix=".img")
+        digest = hashlib.sha256()
+        size = 0
+        carry = b''
+        corrupt = False
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    end = self._buf.find(b'"', self._pos)
+                    stop = end if end != -1 else len(self._buf)
+                    if end == -1 and self._buf.endswith(b'\\', self._pos):
+                        stop -= 1 # Keep a "\/" escape split across chunks together.
+                    encoded = carry + self._buf[self._pos:stop].replace(b'\\/', b'/')
+                    self._pos = stop + 1 if end != -1 else stop
+                    usable = len(encoded) if end != -1 else len(encoded) - len(encoded) % 4
+                    if usable and not corrupt:
+                        try:
+                            decoded = base64.b64decode(encoded[:usable])
+                        except binascii.Error:
+                            # Like the old split/decode, a bad image is left for the PDF step to
+                            # report as "[Image could not be rendered]".
+                            corrupt = True
+                        else:
+                            out.write(decoded)
+                            digest.update(decoded)
+                            size += len(decoded)
+                    carry = encoded[usable:]
+                    if end != -1:
+                        break
+                    if not self._fill():
+                        raise ValueError(f"Unterminated {field} string.")
+        except BaseException:
+            _remove_spool_file(path)
+            raise
+        return {"path": path, "sha256": digest.hexdigest(), "bytes": size}
+
+    def parse(self):
+        """Returns (data, drawings); spooled image fields are left out of data."""
+        if self._next_char() != b'{':
+            raise ValueError("Expected a JSON object.")
+        data = {}
+        ch = self._next_char()
+        while ch != b'}':
+            if ch != b'"':
+                raise ValueError("Expected a field name.")
+            key = json.loads(self._read_raw_value(ch))
+            if self._next_char() != b':':
+                raise ValueError("Expected ':' after a field name.")
+            first = self._next_char()
+            if key in self._image_fields and first == b'"':
+                spooled = self._spool_image_string(key)
+                previous = self.drawings.pop(key, None)
+                if previous:
+                    _remove_spool_file(previous["path"])
+                if spooled:
+                    self.drawings[key] = spooled
+                data.pop(key, None)
+            else:
+                data[key] = json.loads(self._read_raw_value(first))
+            ch = self._next_char()
+            if ch == b',':
+                ch = self._next_char()
+                if ch != b'"':
+                    raise ValueError("Expected a field name after ','.")
+            elif ch != b'}':
+                raise ValueError("Expected ',' or '}'.")
+        return data, self.drawings
+
+def _remove_spool_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"WARNING: Could not remove intake spool file {path}: {e}")
+
+class IntakeSpool:
+    """Owns the intake drawing spool directory: streaming decode, cleanup and stats."""
+
+    def __init__(self, directory, retention_seconds, max_field_bytes):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self.max_field_bytes = max_field_bytes
+        self._lock = threading.Lock()
+        self._stats = {"decoded": 0, "rejected": 0, "spooled_bytes": 0, "peak_buffer_bytes": 0}
+
+    def decode(self, stream):
+        """Returns (data, drawings) for a JSON body stream; raises ValueError on malformed input."""
+        decoder = IntakeStreamDecoder(stream, INTAKE_IMAGE_FIELDS, self.directory, self.max_field_bytes)
+        try:
+            data, drawings = decoder.parse()
+        except BaseException:
+            self.discard(drawing["path"] for drawing in decoder.drawings.values())
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise
+        with self._lock:
+            self._stats["decoded"] += 1
+            self._stats["spooled_bytes"] += sum(drawing["bytes"] for drawing in drawings.values())
+            self._stats["peak_buffer_bytes"] = max(self._stats["peak_buffer_bytes"], decoder.peak_buffer_bytes)
+        return data, drawings
+
+    def discard(self, paths):
+        for path in paths:
+            _remove_spool_file(path)
+
+    def purge_stale(self):
+        """Removes spool files left by jobs that never completed (older than the retention)."""
+        cutoff = time.time() - self.retention_seconds
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        _remove_spool_file(entry.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+_intake_spool = IntakeSpool(INTAKE_SPOOL_DIR, INTAKE_SPOOL_RETENTION_SECONDS, INTAKE_MAX_FIELD_BYTES)
+
+# --- Drive Upload ---
+# Intake PDFs used to go up in one non-resumable request, and without DRIVE_FOLDER_ID every
+# upload first searched Drive for the folder. The folder ID is now resolved once per process,
+# and uploads are resumable and sent in chunks: a transient failure resumes from the last byte
+# Drive acknowledged instead of starting over.
+INTAKE_DRIVE_FOLDER_NAME = 'Client Intake Forms'
+DRIVE_UPLOAD_CHUNK_BYTES = int(os.getenv("DRIVE_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))  # multiple of 256 KiB
+DRIVE_UPLOAD_NUM_RETRIES = int(os.getenv("DRIVE_UPLOAD_NUM_RETRIES", "3"))
+DRIVE_UPLOAD_MAX_RESUMES = int(os.getenv("DRIVE_UPLOAD_MAX_RESUMES", "3"))
+
+class DriveFolderCache:
+    """Resolves Drive folder IDs by name once per process (misses are searched again next time)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def resolve(self, service, name):
+        with self._lock:
+            folder_id = self._ids.get(name)
+        if folder_id:
+            return folder_id
+        # Search by name with broader permissions (Shared Drives included)
+        response = execute_with_retry(service.files().list(
+            q=f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false",
+            spaces='drive',
+            fields='files(id)',
+            includeItemsFromAllDrives=True,
+            supportsAllDrives=True
+        ))
+        folders = response.get('files', [])
+        if not folders:
+            return None
+        with self._lock:
+            self._ids[name] = folders[0]['id']
+        return folders[0]['id']
+
+_drive_folders = DriveFolderCache()
+
+def upload_pdf_to_drive(service, filename, pdf_bytes, parent_id=None):
+    """Uploads pdf_bytes as a resumable, chunked upload and returns the file's {id, webViewLink}."""
+    file_metadata = {'name': filename}
+    if parent_id:
+        file_metadata['parents'] = [parent_id]
+
+    # BytesIO over the bytes shares their buffer; each chunk is read from it as it is sent.
+    media = MediaIoBaseUpload(
+        io.BytesIO(pdf_bytes),
+        mimetype='application/pdf',
+        chunksize=DRIVE_UPLOAD_CHUNK_BYTES,
+        resumable=True
+    )
+    upload = service.files().create(
+        body=file_metadata,
+        media_body=media,
+        supportsAllDrives=True, # Required for Workspace Shared Drives
+        fields='id, webViewLink'
+    )
+    response = None
+    resumes = 0
+    while response is None:
+        try:
+            # next_chunk retries 429/5xx itself; after an error it asks Drive how much arrived.
+            _, response = upload.next_chunk(num_retries=DRIVE_UPLOAD_NUM_RETRIES)
+        except (HttpError, OSError) as e:
+            transient = not isinstance(e, HttpError) or e.resp.status in [429, 500, 502, 503, 504]
+            if not transient or resumes >= DRIVE_UPLOAD_MAX_RESUMES:
+                raise
+            resumes += 1
+            print(f"WARNING: Drive upload of {filename} interrupted ({e}); resuming (attempt {resumes}).")
+            time.sleep((2 ** resumes) + random.random())
+    return response
+
+# --- Intake PDF Rendering ---
+# Building the intake PDF (FPDF layout plus decoding and re-encoding both body-chart drawings)
+# used to run inside the /api/submit-intake request, holding one of the two gunicorn threads
+# and the GIL for the whole render. The request now only validates and enqueues; the intake job
+# renders the PDF in a small 'spawn' process pool, so bursts of intakes cannot starve
+# availability or booking requests. The pool starts on first use and recycles its processes
+# every INTAKE_PDF_MAX_TASKS_PER_CHILD renders. Set INTAKE_PDF_RENDER_WORKERS=0 to render in
+# the job thread instead.
+INTAKE_PDF_RENDER_WORKERS = int(os.getenv("INTAKE_PDF_RENDER_WORKERS", "1"))
+INTAKE_PDF_RENDER_TIMEOUT_SECONDS = float(os.getenv("INTAKE_PDF_RENDER_TIMEOUT_SECONDS", "120"))
+INTAKE_PDF_MAX_TASKS_PER_CHILD = int(os.getenv("INTAKE_PDF_MAX_TASKS_PER_CHILD", "50"))
+
+class IntakePdfRenderer:
+    """Runs render_intake_pdf() on a lazily started process pool and returns the PDF bytes."""
+
+    def __init__(self, workers, timeout, max_tasks_per_child):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    max_tasks_per_child=self.max_tasks_per_child or None,
+                )
+            return self._pool
+
+    def render(self, data, drawing_paths=None):
+        if self.workers <= 0:
+            return render_intake_pdf(data, drawing_paths)
+        pool = self._get_pool()
+        try:
+            return pool.submit(render_intake_pdf, data, drawing_paths).result(timeout=self.timeout)
+        except (BrokenProcessPool, FutureTimeoutError):
+            # A render process died (e.g. OOM-killed) or is stuck and would keep every later
+            # render queued behind it; start a fresh pool for the next render.
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            self._stop_pool(pool)
+            raise
+
+    @staticmethod
+    def _stop_pool(pool):
+        # shutdown() does not stop a render that is already running, so its processes are
+        # terminated. ProcessPoolExecutor has no public handle on them (before Python 3.14's
+        # terminate_workers()); this reads CPython's private `_processes` {pid: Process} map and
+        # only logs if a future version drops it.
+        processes = getattr(pool, '_processes', None)
+        if processes is None:
+            print("WARNING: IntakePdfRenderer: Cannot reach the pool's processes; a stuck render keeps running until it exits.")
+        processes = list((processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            self._stop_pool(pool)
+
+_intake_pdf_renderer = IntakePdfRenderer(
+    INTAKE_PDF_RENDER_WORKERS, INTAKE_PDF_RENDER_TIMEOUT_SECONDS, INTAKE_PDF_MAX_TASKS_PER_CHILD
+)
+
+INTAKE_ADMIN_EMAIL = EmailTemplate(
+    "New Intake Form Submitted by $client_name",
+    """
+        <p>A new client intake form has been submitted.</p>
+        <p><strong>Client:</strong> $client_name</p>
+        <p><strong>Email:</strong> $email</p>
+        <p><strong>Original Booking:</strong> $booking_date at $booking_time</p>
+        <p><strong>Google Drive Backup:</strong> <a href="$drive_link">View PDF in Drive</a></p>
+        $pdf_note
+        """
+)
+
+@_job_queue.handler('intake')
+def _handle_intake_submission_background(data, pdf_output=None, drawing_paths=None):
+    """Handles slow tasks (PDF, Drive, Sheets, Email) for intake form in the background."""
     client_name = f"{data.get('firstName', 'N/A')} {data.get('lastName', 'N/A')}"
     drive_link = "Link failed to generate"
 
+    # --- 0. Render the PDF (jobs queued by older workers already carry it) ---
+    # The client has already been told the form was received, so a render that fails on this
+    # data must not stop the Sheets row and the admin email; the email says the PDF is missing
+    # instead. A render process that died or hung is not the data's fault: nothing has been done
+    # yet and the drawings are still spooled, so the job is left to the queue's retry.
+    pdf_error = None
+    if pdf_output is None:
+        try:
+            pdf_output = _intake_pdf_renderer.render(data, drawing_paths)
+        except (BrokenProcessPool, FutureTimeoutError):
+            raise
+        except Exception as render_e:
+            pdf_error = f"{type(render_e).__name__}: {render_e}"
+            print(f"ERROR (background): Failed to render intake PDF for {client_name}: {pdf_error}")
+
     # --- 1. Construct Filename ---
     booking_date_raw = data.get('bookingDate')
     booking_time_raw = data.get('bookingTime')
@@ -1909,44 +4177,18 @@ def _handle_intake_submission_background(data, pdf_output):
     attachment_filename = f"{filename_date}_{filename_time}_{client_first_name}_{client_last_name}.pdf"
 
     # --- 2. Upload PDF to Google Drive ---
+    drive_uploaded = False
     try:
-        drive_service = get_drive_service()
+        drive_service = get_drive_service() if pdf_output is not None else None
         if drive_service:
-            parent_id = None
-
-            # 1. Try to use a hardcoded Folder ID first (Most reliable)
-            if DRIVE_FOLDER_ID:
-                parent_id = DRIVE_FOLDER_ID
-            else:
-                # 2. Fallback to searching by name with broader permissions
-                query = "name = 'Client Intake Forms' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-                response = drive_service.files().list(
-                    q=query,
-                    spaces='drive',
-                    fields='files(id)',
-                    includeItemsFromAllDrives=True,
-                    supportsAllDrives=True
-                ).execute()
-                folders = response.get('files', [])
-
-                if folders:
-                    parent_id = folders[0]['id']
-                else:
-                    print("BACKGROUND_TASK: Folder 'Client Intake Forms' not found via search. Uploading to root.")
-
-            file_metadata = {'name': attachment_filename}
-            if parent_id:
-                file_metadata['parents'] = [parent_id]
-
-            media = MediaIoBaseUpload(io.BytesIO(pdf_output), mimetype='application/pdf')
-            uploaded_file = execute_with_retry(drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                supportsAllDrives=True, # Required for Workspace Shared Drives
-                fields='id, webViewLink'
-            ))
+            # 1. Try to use a hardcoded Folder ID first (Most reliable), else the cached search result
+            parent_id = DRIVE_FOLDER_ID or _drive_folders.resolve(drive_service, INTAKE_DRIVE_FOLDER_NAME)
+            if not parent_id:
+                print(f"BACKGROUND_TASK: Folder '{INTAKE_DRIVE_FOLDER_NAME}' not found via search. Uploading to root.")
 
+            uploaded_file = upload_pdf_to_drive(drive_service, attachment_filename, pdf_output, parent_id)
             drive_link = uploaded_file.get('webViewLink')
+            drive_uploaded = True
             print(f"BACKGROUND_TASK: PDF uploaded to Drive successfully: {drive_link}")
     except Exception as drive_e:
         print(f"ERROR (background): Failed to upload PDF to Drive: {drive_e}")
@@ -1957,17 +4199,10 @@ def _handle_intake_submission_background(data, pdf_output):
         try:
             calendar_service = get_calendar_service()
             if calendar_service:
-                # Fetch current description to append, ensuring we don't wipe out SOAP or Square info
-                event = execute_with_retry(calendar_service.events().get(calendarId=PRIMARY_CALENDAR_ID, eventId=calendar_event_id))
-                latest_desc = event.get('description', '')
-
+                # Appended against the latest known description, so SOAP or Square info is never wiped out
                 intake_tag = "--- ADMIN: INTAKE FORM LINK ---"
                 intake_content = f"<a href=\"{drive_link}\">Intake Form</a>"
-                execute_with_retry(calendar_service.events().patch(
-                    calendarId=PRIMARY_CALENDAR_ID,
-                    eventId=calendar_event_id,
-                    body={'description': safe_append_description(latest_desc, intake_tag, intake_content)}
-                ))
+                _event_descriptions.append(calendar_service, PRIMARY_CALENDAR_ID, calendar_event_id, [(intake_tag, intake_content)])
                 print(f"BACKGROUND_TASK: Calendar event {calendar_event_id} updated with direct PDF link.")
         except Exception as cal_e:
             print(f"ERROR (background): Failed to update calendar event with PDF link: {cal_e}")
@@ -1976,11 +4211,6 @@ def _handle_intake_submission_background(data, pdf_output):
     try:
         sheets_service = get_sheets_service()
         if sheets_service:
-            # Fetch spreadsheet metadata to get sheet IDs for the prepend operation
-            spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-            intake_sheet_metadata = next(s for s in spreadsheet.get('sheets', []) if s['properties']['title'] == 'Intake Forms')
-            intake_sheet_id = intake_sheet_metadata['properties']['sheetId']
-
             intake_row = [
                 datetime.datetime.now(ZoneInfo(LOCAL_TIMEZONE)).strftime('%Y-%m-%d %I:%M:%S %p'),
                 f"{data.get('serviceType', 'N/A')} on {data.get('bookingDate', 'N/A')} at {data.get('bookingTime', 'N/A')}", # Column B
@@ -1994,58 +4224,21 @@ def _handle_intake_submission_background(data, pdf_output):
                 norm_email(data.get('email', '')) # Column J: Email for future lookups
             ]
 
-            if intake_sheet_id is not None:
-                # Always insert a new row at Row 2 (index 1) to push existing data down
-                request_body = {
-                    "requests": [{
-                        "insertDimension": {
-                            "range": {"sheetId": intake_sheet_id, "dimension": "ROWS", "startIndex": SHEET_INSERT_START_INDEX, "endIndex": SHEET_INSERT_END_INDEX},
-                            "inheritFromBefore": False
-                        }
-                    }]
-                }
-                sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=request_body).execute()
-
-                # Write the new intake data into the now-empty Row 2
-                sheets_service.spreadsheets().values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=f'Intake Forms!A{SHEET_START_ROW_REF}',
-                    valueInputOption='USER_ENTERED',
-                    body={'values': [intake_row]}
-                ).execute()
-            print("BACKGROUND_TASK: Successfully updated Google Sheets.")
+            _sheets_writes.prepend('Intake Forms', intake_row)
+            _client_directory.record_intake_row(intake_row)
+            print("BACKGROUND_TASK: Queued intake row for Google Sheets.")
     except Exception as sheets_e:
         print(f"ERROR (background): Failed to update Google Sheets: {sheets_e}")
 
     # --- 3.5 Update "Clients" tab with DOB and Address ---
     try:
         client_email = data.get('email')
-        if sheets_service and client_email:
-            normalized_email = norm_email(client_email)
-            # Fetch all emails from the Clients sheet (Column C)
-            client_data_result = sheets_service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='Clients!C:C'
-            ).execute()
-            client_rows = client_data_result.get('values', [])
-
-            # Find the row index where the email matches
-            target_row_index = -1
-            for idx, row_val in enumerate(client_rows):
-                if row_val and norm_email(row_val[0]) == normalized_email:
-                    target_row_index = idx + 1 # Sheets is 1-indexed
-                    break
-
-            if target_row_index != -1:
-                # Update DOB (Col E) and Address (Col F) for that specific row
-                update_range = f'Clients!E{target_row_index}:F{target_row_index}'
-                sheets_service.spreadsheets().values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=update_range,
-                    valueInputOption='USER_ENTERED',
-                    body={'values': [[data.get('dob', ''), data.get('address', '')]]}
-                ).execute()
-                print(f"BACKGROUND_TASK: Enriched client profile (DOB/Address) for {client_email}")
+        if client_email:
+            # Update DOB (Col E) and Address (Col F) if the client has a row
+            enrichment = {4: data.get('dob', ''), 5: data.get('address', '')}
+            _sheets_writes.upsert_client(client_email, None, enrichment)
+            _client_directory.update_client(client_email, enrichment)
+            print(f"BACKGROUND_TASK: Queued client profile enrichment (DOB/Address) for {client_email}")
     except Exception as e:
         print(f"ERROR (background): Failed to enrichment client data in Clients sheet: {e}")
 
@@ -2053,19 +4246,25 @@ def _handle_intake_submission_background(data, pdf_output):
     try:
         admin_email = SENDER_EMAIL
         esc = html.escape
-        email_subject = f"New Intake Form Submitted by {esc(client_name)}"
-        email_body_html = f"""
-        <p>A new client intake form has been submitted.</p>
-        <p><strong>Client:</strong> {esc(client_name)}</p>
-        <p><strong>Email:</strong> {esc(data.get('email', 'N/A'))}</p>
-        <p><strong>Original Booking:</strong> {esc(data.get('bookingDate', 'N/A'))} at {esc(data.get('bookingTime', 'N/A'))}</p>
-        <p><strong>Google Drive Backup:</strong> <a href="{drive_link}">View PDF in Drive</a></p>
-        """
+        email_subject, email_body_html = INTAKE_ADMIN_EMAIL.render(
+            client_name=esc(client_name),
+            email=esc(data.get('email', 'N/A')),
+            booking_date=esc(data.get('bookingDate', 'N/A')),
+            booking_time=esc(data.get('bookingTime', 'N/A')),
+            drive_link=drive_link,
+            pdf_note=(
+                f"<p><strong>PDF:</strong> The intake PDF could not be generated ({esc(pdf_error)}). "
+                "The submitted answers are in the Intake Forms sheet.</p>"
+            ) if pdf_error else "",
+        )
 
+        # Without a Drive copy, attach the PDF itself (the same bytes object, not a copy).
         email_sent, _ = send_email(
             receiver_email=admin_email,
             subject=email_subject,
-            body_html=email_body_html
+            body_html=email_body_html,
+            attachment_data=None if drive_uploaded else pdf_output,
+            attachment_filename=None if drive_uploaded else attachment_filename
         )
         if email_sent:
             print("BACKGROUND_TASK: Successfully sent intake form email to admin.")
@@ -2074,143 +4273,91 @@ def _handle_intake_submission_background(data, pdf_output):
     except Exception as e:
         print(f"ERROR (background): Failed to send intake form email: {e}")
 
+    # --- 5. Drop the spooled drawings (kept until now so a retried job can re-render) ---
+    _intake_spool.discard((drawing_paths or {}).values())
+
 @app.route('/api/submit-intake', methods=['POST'])
 def submit_intake():
     """
-    API endpoint to receive intake form data, generate a PDF,
-    and email it to the admin.
+    API endpoint to receive intake form data. The body is streamed (drawings go to spool
+    files); the PDF is generated, uploaded and emailed to the admin by the background intake job.
     """
-
-    data = request.get_json()
-    if not data:
+    if not request.is_json:
         return jsonify({"error": "Invalid JSON payload."}), 400
-
     try:
-        client_name = f"{data.get('firstName', 'N/A')} {data.get('lastName', 'N/A')}"
-
-        # --- 1. Generate PDF ---
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Helvetica", size=12)
-
-        # --- PDF Helper Functions ---
-        def write_line(label: str, value: str, is_multiline: bool = False) -> None:
-            if not value:
-                return
-            pdf.set_font("Helvetica", "B", size=12)
-            pdf.cell(40, 7, label, new_x=XPos.RIGHT, new_y=YPos.TOP)
-            pdf.set_font("Helvetica", "", size=12)
-            if is_multiline:
-                pdf.multi_cell(0, 7, value, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            else:
-                pdf.cell(0, 7, value, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-
-        def write_section_header(title):
-            pdf.ln(5)
-            pdf.set_font("Helvetica", "B", size=14)
-            pdf.cell(0, 8, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            pdf.set_draw_color(200, 200, 200)
-            pdf.line(pdf.get_x(), pdf.get_y(), pdf.get_x() + 190, pdf.get_y())
-            pdf.ln(2)
-
-        pdf.set_font("Helvetica", "B", size=18)
-        pdf.cell(0, 8, f"Client Intake Form: {client_name}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-        pdf.ln(5)
-
-        # --- Personal Information ---
-        write_section_header("Personal Information")
-        write_line("Name:", client_name)
-        write_line("DOB:", data.get('dob') or 'N/A')
-        write_line("Address:", data.get('address') or 'N/A', is_multiline=True)
-        write_line("Occupation:", data.get('occupation') or 'N/A', is_multiline=True)
-
-        # --- Booking & Visit Information ---
-        write_section_header("Visit Information")
-        write_line("Service:", data.get('serviceType') or 'N/A')
-        write_line("Booking:", f"{data.get('bookingDate') or 'N/A'} at {data.get('bookingTime') or 'N/A'}")
-        write_line("Email:", data.get('email') or 'N/A')
-        write_line("Phone:", data.get('phone') or 'N/A')
-        write_line("Intention for Treatment:", data.get('reason') or 'No comments provided.', is_multiline=True)
-
-        # --- Medical History ---
-        write_section_header("Medical History")
-        conditions = data.get('conditions')
-        if isinstance(conditions, list):
-            conditions = ', '.join(conditions)
-        write_line("Conditions:", conditions or 'N/A', is_multiline=True)
-        write_line("Allergies:", data.get('allergies') or 'N/A', is_multiline=True)
-        pdf.ln(5)
-
-        # --- Embed Body Chart Images Side-by-Side and Scaled ---
-        front_image_data = data.get('drawingFront')
-        back_image_data = data.get('drawingBack')
-
-        if front_image_data or back_image_data:
-            pdf.set_font("Helvetica", "B", size=14)
-            pdf.cell(0, 10, "Problem Areas", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            pdf.ln(2)
-
-            page_width = pdf.w - 2 * pdf.l_margin
-            image_width = page_width / 2 - 5
-
-            max_image_height_on_page = pdf.h - pdf.get_y() - pdf.b_margin - 15
-
-            current_y_for_images = pdf.get_y()
-            max_drawn_height = 0
-
-            def embed_image(b64_string, x_pos):
-                nonlocal max_drawn_height
-                if not b64_string or 'base64,' not in b64_string:
-                    return
-                try:
-                    image_data = base64.b64decode(b64_string.split('base64,')[1])
-                    img = Image.open(io.BytesIO(image_data))
-                    original_width, original_height = img.size
-
-                    width_ratio = image_width / original_width
-                    height_ratio = max_image_height_on_page / original_height
-                    scale_ratio = min(width_ratio, height_ratio)
-
-                    final_width = original_width * scale_ratio
-                    final_height = original_height * scale_ratio
-
-                    if final_height <= 0:
-                        raise ValueError("Calculated image height is zero or negative.")
+        data, drawings = _intake_spool.decode(request.stream)
+    except ValueError as e:
+        print(f"ERROR: /api/submit-intake: Invalid JSON payload: {e}")
+        return jsonify({"error": "Invalid JSON payload."}), 400
+    if not data and not drawings:
+        return jsonify({"error": "Invalid JSON payload."}), 400
 
-                    with io.BytesIO() as output_stream:
-                        img.save(output_stream, format="PNG")
-                        output_stream.seek(0)
-                        pdf.image(output_stream, x=x_pos, y=current_y_for_images, w=final_width, h=final_height)
+    drawing_paths = {field: drawing["path"] for field, drawing in drawings.items()}
+    try:
+        # --- Start Background Tasks (the PDF is rendered there, off the request thread) ---
+        key_payload = {"data": data, "drawings": {field: drawing["sha256"] for field, drawing in drawings.items()}}
+        if not _job_queue.enqueue('intake', payload_idempotency_key('intake', key_payload), data=data, drawing_paths=drawing_paths):
+            # Duplicate submission: the job already queued for it has its own spool files.
+            _intake_spool.discard(drawing_paths.values())
+        _intake_spool.purge_stale()
 
-                    max_drawn_height = max(max_drawn_height, final_height)
+        return jsonify({"message": "Intake form submitted successfully."}), 200
 
-                except Exception as img_e:
-                    print(f"ERROR: Could not process an image: {img_e}")
-                    pdf.set_xy(x_pos, current_y_for_images)
-                    pdf.set_font("Helvetica", "", size=8)
-                    pdf.multi_cell(image_width, 10, "[Image could not be rendered]", border=1, align='C')
-                    max_drawn_height = max(max_drawn_height, 10)
+    except Exception as e:
+        _intake_spool.discard(drawing_paths.values())
+        print(f"ERROR: /api/submit-intake: {e}")
+        return jsonify({"error": "Server error while processing the form."}), 500
 
-            embed_image(front_image_data, pdf.l_margin)
-            embed_image(back_image_data, pdf.l_margin + image_width + 10)
+WAITLIST_CONFIRMATION_EMAIL = EmailTemplate(
+    "Waitlist Confirmation",
+    """
+            <p>Hi $first_name!</p>
+            <p>Thanks for adding yourself to the waitlist for the following dates:</p>
+            <p>$date_lines_html</p>
+            <p>If any appointments open up that match your request I will be sure to reach out to you!</p>
+            <p>High Five!<br>Chelsea</p>
+            """
+)
 
-            pdf.set_y(current_y_for_images + max_drawn_height + 10)
+WAITLIST_ADMIN_EMAIL = EmailTemplate(
+    "Client added to waitlist",
+    '<pre style="font-family: inherit; white-space: pre-wrap;">$body_text</pre>'
+)
 
-        # Get PDF data as bytes
-        pdf_output: bytes = bytes(pdf.output())
+@_job_queue.handler('waitlist_emails')
+def _handle_waitlist_emails_background(first_name, client_email, data, event_descriptions):
+    """Background task to send waitlist confirmation emails to client and admin (one batch)."""
+    esc = html.escape
+    messages = []
 
-        # --- Start Background Tasks ---
-        threading.Thread(
-            target=_handle_intake_submission_background,
-            name="intake_bg",
-            kwargs={'data': data, 'pdf_output': pdf_output},
-        ).start()
+    if client_email:
+        try:
+            date_lines = [
+                _format_waitlist_client_date_line(option_num, data)
+                for option_num in range(1, 4)
+            ]
+            messages.append((client_email,) + WAITLIST_CONFIRMATION_EMAIL.render(
+                first_name=esc(first_name),
+                date_lines_html="<br>".join(esc(line) for line in date_lines),
+            ))
+        except Exception as e:
+            print(f"ERROR: Failed to send waitlist confirmation email to client: {e}")
 
-        return jsonify({"message": "Intake form submitted successfully."}), 200
+    admin_body_text = "\n\n---\n\n".join(event_descriptions)
+    messages.append((SENDER_EMAIL,) + WAITLIST_ADMIN_EMAIL.render(body_text=esc(admin_body_text)))
 
-    except Exception as e:
-        print(f"ERROR: /api/submit-intake: {e}")
-        return jsonify({"error": "Server error while processing the form."}), 500
+    results = send_emails(messages)
+    if len(results) > 1:
+        client_email_sent, _ = results.pop(0)
+        if client_email_sent:
+            print(f"BACKGROUND_TASK: Waitlist confirmation email sent to client {client_email}")
+        else:
+            print(f"BACKGROUND_TASK: WARNING: Failed to send waitlist confirmation email to client {client_email}")
+    admin_email_sent, _ = results[0]
+    if admin_email_sent:
+        print("BACKGROUND_TASK: Waitlist notification email sent to admin.")
+    else:
+        print("BACKGROUND_TASK: WARNING: Failed to send waitlist notification email to admin.")
 
 @app.route('/api/submit-waitlist', methods=['POST'])
 def submit_waitlist():
@@ -2256,55 +4403,10 @@ def submit_waitlist():
         return jsonify({"error": "At least one requested date is required."}), 400
 
     try:
-        normalized_email = norm_email(email)
-
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='Clients!A:D'
-        ).execute()
-        client_rows = result.get('values', [])
-
-        target_row_index = -1
-        for idx, row_val in enumerate(client_rows):
-            row_email = norm_email(row_val[2]) if len(row_val) > 2 else ""
-            if row_email == normalized_email:
-                target_row_index = idx + 1
-                break
-
-        if target_row_index != -1:
-            sheets_service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=f'Clients!A{target_row_index}:D{target_row_index}',
-                valueInputOption='USER_ENTERED',
-                body={'values': [[first_name, last_name, email, phone]]}
-            ).execute()
-        else:
-            spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-            client_sheet_metadata = next(s for s in spreadsheet.get('sheets', []) if s['properties']['title'] == 'Clients')
-            client_sheet_id = client_sheet_metadata['properties']['sheetId']
-
-            request_body = {
-                "requests": [{
-                    "insertDimension": {
-                        "range": {
-                            "sheetId": client_sheet_id,
-                            "dimension": "ROWS",
-                            "startIndex": SHEET_INSERT_START_INDEX,
-                            "endIndex": SHEET_INSERT_END_INDEX
-                        },
-                        "inheritFromBefore": False
-                    }
-                }]
-            }
-            sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=request_body).execute()
-
-            client_row = [first_name, last_name, email, phone, '', '', '', '']
-            sheets_service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=f'Clients!A{SHEET_START_ROW_REF}',
-                valueInputOption='USER_ENTERED',
-                body={'values': [client_row]}
-            ).execute()
+        client_row = [first_name, last_name, email, phone, '', '', '', '']
+        contact_columns = {0: first_name, 1: last_name, 2: email, 3: phone}
+        _sheets_writes.upsert_client(email, client_row, contact_columns)
+        _client_directory.upsert_client(client_row, contact_columns)
 
         service_labels = {
             "deep-tissue": "Deep Tissue",
@@ -2367,16 +4469,18 @@ def submit_waitlist():
             else:
                 skipped_dates.append(requested["date_text"])
 
+        if created_events:
+            _available_days_cache.invalidate()
+
         if not created_events:
             return jsonify({
                 "error": "No available waitlist calendar slots were found between 5:00 AM and 9:30 AM for the requested dates."
             }), 409
 
-        threading.Thread(
-            target=_handle_waitlist_emails_background,
-            name="waitlist_email_bg",
-            args=(first_name, email, data, event_descriptions)
-        ).start()
+        _job_queue.enqueue(
+            'waitlist_emails', f"waitlist_emails:{','.join(created_events)}",
+            first_name=first_name, client_email=email, data=data, event_descriptions=event_descriptions
+        )
 
         return jsonify({
             "message": "Waitlist request submitted successfully.",
@@ -2397,11 +4501,41 @@ def request_onsite():
     if not data:
         return jsonify({"error": "Invalid JSON payload."}), 400
 
-    # Start the background task to send emails
-    threading.Thread(target=_handle_onsite_request_background, name="onsite_bg", args=(data,)).start()
+    # Queue the background task to send emails
+    _job_queue.enqueue('onsite', payload_idempotency_key('onsite', data), data=data)
 
     return jsonify({"message": "On-site request submitted successfully."}), 200
 
+ONSITE_ADMIN_EMAIL = EmailTemplate(
+    "New On-Site Request: $full_name",
+    """
+        <h3>New On-Site Treatment Request</h3>
+        <p><strong>Client:</strong> $full_name</p>
+        <p><strong>Number of Clients:</strong> $num_clients</p>
+        <p><strong>Services Requested:</strong><ul>$client_services_html</ul></p>
+        <p><strong>Email:</strong> $client_email</p>
+        <p><strong>Phone:</strong> $phone</p>
+        <p><strong>Address:</strong> $address</p>
+        <p><strong>Requested Times:</strong></p>
+        $times_html
+        <p><strong>Preferred Contact:</strong> $contact_method</p>
+        <p><strong>Additional Details:</strong> $details</p>
+        """
+)
+
+ONSITE_CONFIRMATION_EMAIL = EmailTemplate(
+    "Your On-Site Treatment Request - Chelsea Vaccaro",
+    """
+            <p>Hi $first_name,</p>
+            <p>Thank you for requesting an on-site treatment with Chelsea Vaccaro Therapeutic Massage!</p>
+            <p>I have received your request for <strong>$services_summary</strong> at <strong>$address</strong> on <strong>$times_sentence</strong>.</p>
+            <p>I will check our schedules and reach out to you via <strong>$contact_method</strong> as soon as possible with options and pricing to finalize your appointment.</p>
+            <p>I look forward to helping you heal and refresh in the comfort of your home!</p>
+            <p>High Five!<br>Chelsea Vaccaro <br> Therapeutic Massage</p>
+            """
+)
+
+@_job_queue.handler('onsite')
 def _handle_onsite_request_background(data):
     """Background task to send notification emails for on-site requests."""
     first_name = data.get('firstName', 'Valued Client')
@@ -2410,11 +4544,11 @@ def _handle_onsite_request_background(data):
     client_email = data.get('email')
 
     num_clients = int(data.get('numberOfClients', 1))
+    messages = {} # Admin notification + client confirmation, sent as one batch
     # 1. Notify Admin
     try:
         admin_email = SENDER_EMAIL
         esc = html.escape
-        admin_subject = f"New On-Site Request: {esc(full_name)}"
 
         # Build requested times summary
         times = []
@@ -2433,21 +4567,17 @@ def _handle_onsite_request_background(data):
             client_services_html += f"<li><strong>{esc(client_name_i)}:</strong> {esc(treatment_type_i)}</li>"
             client_services_list.append(f"{esc(client_name_i)} ({esc(treatment_type_i)})")
 
-        admin_body_html = f"""
-        <h3>New On-Site Treatment Request</h3>
-        <p><strong>Client:</strong> {esc(full_name)}</p>
-        <p><strong>Number of Clients:</strong> {num_clients}</p>
-        <p><strong>Services Requested:</strong><ul>{client_services_html}</ul></p>
-        <p><strong>Email:</strong> {esc(client_email)}</p>
-        <p><strong>Phone:</strong> {esc(data.get('phone'))}</p>
-        <p><strong>Address:</strong> {esc(data.get('address'))}</p>
-        <p><strong>Requested Times:</strong></p>
-        {times_html}
-        <p><strong>Preferred Contact:</strong> {esc(data.get('contactMethod'))}</p>
-        <p><strong>Additional Details:</strong> {esc(data.get('details') or 'None')}</p>
-        """
-        send_email(admin_email, admin_subject, admin_body_html)
-        print(f"BACKGROUND_TASK: Admin notified of on-site request from {full_name}")
+        messages['admin'] = (admin_email,) + ONSITE_ADMIN_EMAIL.render(
+            full_name=esc(full_name),
+            num_clients=num_clients,
+            client_services_html=client_services_html,
+            client_email=esc(client_email),
+            phone=esc(data.get('phone')),
+            address=esc(data.get('address')),
+            times_html=times_html,
+            contact_method=esc(data.get('contactMethod')),
+            details=esc(data.get('details') or 'None'),
+        )
     except Exception as e:
         print(f"ERROR: Failed to send admin on-site request notification: {e}")
 
@@ -2455,7 +4585,6 @@ def _handle_onsite_request_background(data):
     if client_email:
         try:
             esc = html.escape
-            client_subject = "Your On-Site Treatment Request - Chelsea Vaccaro"
 
             # Construct a human-friendly list of dates
             date_list = []
@@ -2469,24 +4598,28 @@ def _handle_onsite_request_background(data):
 
             all_client_services_summary = ", ".join(client_services_list)
 
-            client_body_html = f"""
-            <p>Hi {esc(first_name)},</p>
-            <p>Thank you for requesting an on-site treatment with Chelsea Vaccaro Therapeutic Massage!</p>
-            <p>I have received your request for <strong>{all_client_services_summary}</strong> at <strong>{esc(data.get('address'))}</strong> on <strong>{esc(times_sentence)}</strong>.</p>
-            <p>I will check our schedules and reach out to you via <strong>{esc(data.get('contactMethod').lower())}</strong> as soon as possible with options and pricing to finalize your appointment.</p>
-            <p>I look forward to helping you heal and refresh in the comfort of your home!</p>
-            <p>High Five!<br>Chelsea Vaccaro <br> Therapeutic Massage</p>
-            """
-            send_email(client_email, client_subject, client_body_html)
-            print(f"BACKGROUND_TASK: Confirmation email sent to client {client_email}")
+            messages['client'] = (client_email,) + ONSITE_CONFIRMATION_EMAIL.render(
+                first_name=esc(first_name),
+                services_summary=all_client_services_summary,
+                address=esc(data.get('address')),
+                times_sentence=esc(times_sentence),
+                contact_method=esc(data.get('contactMethod').lower()),
+            )
         except Exception as e:
             print(f"ERROR: Failed to send client on-site request confirmation: {e}")
 
+    for recipient, (sent, _) in zip(messages, send_emails(list(messages.values()))):
+        if recipient == 'client':
+            print(f"BACKGROUND_TASK: Confirmation email sent to client {client_email}" if sent
+                  else f"BACKGROUND_TASK: WARNING: Failed to send confirmation email to client {client_email}")
+        else:
+            print(f"BACKGROUND_TASK: Admin notified of on-site request from {full_name}" if sent
+                  else f"BACKGROUND_TASK: WARNING: Failed to notify admin of on-site request from {full_name}")
+
     # 3. Update Google Sheets
     try:
         sheets_service = get_sheets_service()
         if sheets_service:
-            spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
             # Note: I used "On-Site Requests" here; please ensure the tab name matches exactly.
             target_tab = "On-Site Requests"
 
@@ -2512,33 +4645,18 @@ def _handle_onsite_request_background(data):
                 data.get('details', '')
             ]
 
-            sheet_metadata = next((s for s in spreadsheet.get('sheets', []) if s['properties']['title'] == target_tab), None)
-            if sheet_metadata:
-                sheet_id = sheet_metadata['properties']['sheetId']
-                # Always insert a new row at Row 2 (index 1) to push existing data down
-                request_body = {
-                    "requests": [{
-                        "insertDimension": {
-                            "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": SHEET_INSERT_START_INDEX, "endIndex": SHEET_INSERT_END_INDEX},
-                            "inheritFromBefore": False
-                        }
-                    }]
-                }
-                sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=request_body).execute()
-
-                # Write the new request data into Row 2
-                sheets_service.spreadsheets().values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=f"'{target_tab}'!A{SHEET_START_ROW_REF}",
-                    valueInputOption='USER_ENTERED',
-                    body={'values': [row_data]}
-                ).execute()
-                print(f"BACKGROUND_TASK: Logged on-site request for {full_name} to Google Sheets.")
-            else:
-                print(f"BACKGROUND_TASK WARNING: Tab '{target_tab}' not found in the spreadsheet.")
+            _sheets_writes.prepend(target_tab, row_data)
+            _client_directory.record_onsite_row(row_data)
+            print(f"BACKGROUND_TASK: Queued on-site request for {full_name} to Google Sheets.")
     except Exception as e:
         print(f"ERROR: Failed to update Google Sheets for on-site request: {e}")
 
+# --- Start Persistent Job Consumer ---
+# Started only after every @_job_queue.handler above is registered.
+if os.path.exists(LOCAL_STATE_DB) and multiprocessing.parent_process() is None:
+    # Pick up jobs a previous worker left queued or unfinished.
+    _job_queue.start()
+
 # --- Main Execution ---
 if __name__ == '__main__':
     # For deployment, Render sets the PORT environment variable.
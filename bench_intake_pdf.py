@@ -0,0 +1,87 @@
+"""Benchmark for intake PDF rendering: per-PDF render time and peak traced memory.
+
+Usage:
+    python bench_intake_pdf.py [--runs 50] [--drawing 600x900] [--baseline old_intake_pdf.py]
+
+--baseline loads another copy of intake_pdf.py (e.g. `git show <rev>:intake_pdf.py > old.py`)
+and reports it next to the current one, for before/after comparisons.
+"""
+
+import argparse
+import base64
+import importlib.util
+import io
+import statistics
+import time
+import tracemalloc
+
+from PIL import Image, ImageDraw
+
+import intake_pdf
+
+
+def drawing_data_url(width, height):
+    """A transparent canvas-style PNG with a few strokes, as the intake page sends it."""
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    for x in range(0, width, max(1, width // 12)):
+        draw.line((x, 0, width - x, height), fill=(200, 0, 0, 255), width=4)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+def sample_payload(drawing):
+    data = {
+        'firstName': 'Jordan', 'lastName': 'Sample', 'dob': '1990-04-12',
+        'address': '123 Main Street, Springfield', 'occupation': 'Teacher',
+        'serviceType': 'Deep Tissue', 'bookingDate': 'May 4, 2026', 'bookingTime': '10:00 AM',
+        'email': 'jordan@example.com', 'phone': '555-0100',
+        'reason': 'Lower back tension after long days at a desk. ' * 3,
+        'conditions': ['Back pain', 'Headaches'], 'allergies': 'None',
+    }
+    if drawing:
+        width, height = (int(part) for part in drawing.lower().split('x'))
+        data['drawingFront'] = data['drawingBack'] = drawing_data_url(width, height)
+    return data
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("baseline_intake_pdf", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench(render, data, runs):
+    render(data)  # warm-up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    size = len(render(data))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--drawing", default="600x900", help="WIDTHxHEIGHT of both drawings, or '' for none")
+    parser.add_argument("--baseline", help="path to another intake_pdf.py to compare against")
+    args = parser.parse_args()
+
+    data = sample_payload(args.drawing)
+    targets = [("current", intake_pdf)]
+    if args.baseline:
+        targets.insert(0, ("baseline", load_module(args.baseline)))
+    for name, module in targets:
+        median_ms, peak_kib, size = bench(module.render_intake_pdf, data, args.runs)
+        print(f"{name:>8}: {median_ms:8.2f} ms/PDF (median of {args.runs})  peak {peak_kib:9.0f} KiB  {size} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ bind = f"0.0.0.0:{port}"
 # Reduce concurrency to stay within memory limits on Render Free/Starter tier.
 # 1 worker / 2 threads is significantly safer for memory-intensive apps.
 workers = 1
-threads = 2
+threads = int(os.environ.get("GUNICORN_THREADS", "2"))  # also sizes the Google API transport pool in app.py
 
 # Increase timeout to prevent workers from being killed during slow API initializations
 timeout = 120
@@ -20,4 +20,17 @@ timeout = 120
 # old one fully exits, so there is no downtime or dropped requests.
 # jitter staggers the restart point so it isn't perfectly predictable/synchronized.
 max_requests = 500
-max_requests_jitter = 50
\ No newline at end of file
+max_requests_jitter = 50
+
+def worker_exit(server, worker):
+    # Stop claiming persisted jobs (the next worker picks them up), then let the ones already
+    # running (emails, Sheets, Drive) finish before a recycled worker exits.
+    from app import (
+        BACKGROUND_JOB_DRAIN_TIMEOUT_SECONDS,
+        _background_jobs,
+        _intake_pdf_renderer,
+        _job_queue,
+    )
+    _job_queue.stop()
+    _background_jobs.drain(BACKGROUND_JOB_DRAIN_TIMEOUT_SECONDS)
+    _intake_pdf_renderer.shutdown()
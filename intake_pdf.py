@@ -0,0 +1,210 @@
+"""Intake form PDF rendering.
+
+Kept free of Flask and Google imports so it can run in the render worker processes that
+app.py starts with the 'spawn' method (see IntakePdfRenderer).
+"""
+
+import base64
+import io
+import os
+import struct
+import unicodedata
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+from PIL import Image
+
+# Body-chart drawings are handed to FPDF as the decoded PNG bytes, with no Pillow decode and
+# PNG re-encode on our side. Only drawings above this many pixels are downscaled first.
+INTAKE_DRAWING_MAX_PIXELS = int(os.getenv("INTAKE_DRAWING_MAX_PIXELS", "1500000"))
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def image_size(image_data: bytes) -> tuple[int, int]:
+    """Returns (width, height) from the PNG IHDR chunk, or from the image header via Pillow."""
+    if image_data[:8] == PNG_SIGNATURE and image_data[12:16] == b"IHDR":
+        return struct.unpack_from(">II", image_data, 16)
+    with Image.open(io.BytesIO(image_data)) as img:
+        return img.size
+
+
+def fit_pixel_budget(image_data: bytes, width: int, height: int, max_pixels: int = INTAKE_DRAWING_MAX_PIXELS):
+    """Returns image_data itself when within max_pixels, else a downscaled Pillow image."""
+    if width * height <= max_pixels:
+        return image_data
+    scale = (max_pixels / (width * height)) ** 0.5
+    with Image.open(io.BytesIO(image_data)) as img:
+        return img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+
+def load_drawing(data: dict, drawing_paths: dict, field: str) -> bytes:
+    """Returns a drawing's image bytes from its spool file, or from a data URL left in data."""
+    path = drawing_paths.get(field)
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    return base64.b64decode(data[field].split('base64,')[1])
+
+
+# The core Helvetica font only covers latin-1, and FPDF raises on anything else. Phone keyboards
+# send curly quotes and dashes (O’Brien), so those are mapped to their plain forms, other
+# characters are reduced to their latin-1 base letter (ś -> s) and anything left becomes '?'.
+_PDF_PUNCTUATION = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201a': "'", '\u2032': "'",
+    '\u201c': '"', '\u201d': '"', '\u201e': '"', '\u2033': '"',
+    '\u2010': '-', '\u2011': '-', '\u2012': '-', '\u2013': '-', '\u2014': '-', '\u2212': '-',
+    '\u2022': '-', '\u2026': '...', '\u2028': '\n', '\u2029': '\n',
+})
+
+
+def pdf_text(value) -> str:
+    """Returns value as text the core PDF fonts can encode."""
+    text = str(value).translate(_PDF_PUNCTUATION)
+    if text.isascii():
+        return text
+    chars = []
+    for ch in text:
+        if ord(ch) < 256:
+            chars.append(ch)
+        else:
+            folded = unicodedata.normalize('NFKD', ch).encode('latin-1', 'ignore').decode('latin-1')
+            chars.append(folded or '?')
+    return ''.join(chars)
+
+
+def _conditions(data):
+    conditions = data.get('conditions')
+    if isinstance(conditions, list):
+        conditions = ', '.join(conditions)
+    return conditions
+
+
+# --- Intake Layout ---
+# The fixed part of the form (section titles, labels, which fields wrap) is declared once here
+# and shared by every render in the process; per submission only the client's values and
+# drawings are filled in. Each field is (label, value getter, is_multiline).
+INTAKE_SECTIONS = (
+    ("Personal Information", (
+        ("Name:", lambda data, client_name: client_name, False),
+        ("DOB:", lambda data, client_name: data.get('dob') or 'N/A', False),
+        ("Address:", lambda data, client_name: data.get('address') or 'N/A', True),
+        ("Occupation:", lambda data, client_name: data.get('occupation') or 'N/A', True),
+    )),
+    ("Visit Information", (
+        ("Service:", lambda data, client_name: data.get('serviceType') or 'N/A', False),
+        ("Booking:", lambda data, client_name: f"{data.get('bookingDate') or 'N/A'} at {data.get('bookingTime') or 'N/A'}", False),
+        ("Email:", lambda data, client_name: data.get('email') or 'N/A', False),
+        ("Phone:", lambda data, client_name: data.get('phone') or 'N/A', False),
+        ("Intention for Treatment:", lambda data, client_name: data.get('reason') or 'No comments provided.', True),
+    )),
+    ("Medical History", (
+        ("Conditions:", lambda data, client_name: _conditions(data) or 'N/A', True),
+        ("Allergies:", lambda data, client_name: data.get('allergies') or 'N/A', True),
+    )),
+)
+LABEL_WIDTH = 40
+LINE_HEIGHT = 7
+
+
+def render_intake_pdf(data: dict, drawing_paths: dict | None = None) -> bytes:
+    """
+    Builds the intake form PDF (details plus body-chart drawings) and returns its bytes.
+    drawing_paths maps drawingFront/drawingBack to spooled image files; without an entry the
+    field's data URL in data is used.
+    """
+    drawing_paths = drawing_paths or {}
+    client_name = f"{data.get('firstName', 'N/A')} {data.get('lastName', 'N/A')}"
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=12)
+
+    # --- PDF Helper Functions ---
+    def write_line(label: str, value: str, is_multiline: bool = False) -> None:
+        if not value:
+            return
+        value = pdf_text(value)
+        pdf.set_font("Helvetica", "B", size=12)
+        pdf.cell(LABEL_WIDTH, LINE_HEIGHT, label, new_x=XPos.RIGHT, new_y=YPos.TOP)
+        pdf.set_font("Helvetica", "", size=12)
+        # multi_cell's line breaking is the costliest step of the render, so values that fit on
+        # one line (the usual case) take the plain cell path, which draws the same thing.
+        if is_multiline and ('\n' in value or pdf.get_string_width(value) > pdf.w - pdf.r_margin - pdf.get_x() - 2 * pdf.c_margin):
+            pdf.multi_cell(0, LINE_HEIGHT, value, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        else:
+            pdf.cell(0, LINE_HEIGHT, value, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    def write_section_header(title):
+        pdf.ln(5)
+        pdf.set_font("Helvetica", "B", size=14)
+        pdf.cell(0, 8, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_draw_color(200, 200, 200)
+        pdf.line(pdf.get_x(), pdf.get_y(), pdf.get_x() + 190, pdf.get_y())
+        pdf.ln(2)
+
+    pdf.set_font("Helvetica", "B", size=18)
+    pdf.cell(0, 8, pdf_text(f"Client Intake Form: {client_name}"), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+    pdf.ln(5)
+
+    for title, fields in INTAKE_SECTIONS:
+        write_section_header(title)
+        for label, value_of, is_multiline in fields:
+            write_line(label, value_of(data, client_name), is_multiline=is_multiline)
+    pdf.ln(5)
+
+    # --- Embed Body Chart Images Side-by-Side and Scaled ---
+    def has_drawing(field):
+        b64_string = data.get(field)
+        return bool(drawing_paths.get(field)) or bool(b64_string and 'base64,' in b64_string)
+
+    if has_drawing('drawingFront') or has_drawing('drawingBack'):
+        pdf.set_font("Helvetica", "B", size=14)
+        pdf.cell(0, 10, "Problem Areas", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(2)
+
+        page_width = pdf.w - 2 * pdf.l_margin
+        image_width = page_width / 2 - 5
+
+        max_image_height_on_page = pdf.h - pdf.get_y() - pdf.b_margin - 15
+
+        current_y_for_images = pdf.get_y()
+        max_drawn_height = 0
+
+        def embed_image(field, x_pos):
+            nonlocal max_drawn_height
+            if not has_drawing(field):
+                return
+            try:
+                image_data = load_drawing(data, drawing_paths, field)
+                original_width, original_height = image_size(image_data)
+
+                width_ratio = image_width / original_width
+                height_ratio = max_image_height_on_page / original_height
+                scale_ratio = min(width_ratio, height_ratio)
+
+                final_width = original_width * scale_ratio
+                final_height = original_height * scale_ratio
+
+                if final_height <= 0:
+                    raise ValueError("Calculated image height is zero or negative.")
+
+                image_source = fit_pixel_budget(image_data, original_width, original_height)
+                pdf.image(image_source, x=x_pos, y=current_y_for_images, w=final_width, h=final_height)
+
+                max_drawn_height = max(max_drawn_height, final_height)
+
+            except Exception as img_e:
+                print(f"ERROR: Could not process an image: {img_e}")
+                pdf.set_xy(x_pos, current_y_for_images)
+                pdf.set_font("Helvetica", "", size=8)
+                pdf.multi_cell(image_width, 10, "[Image could not be rendered]", border=1, align='C')
+                max_drawn_height = max(max_drawn_height, 10)
+
+        embed_image('drawingFront', pdf.l_margin)
+        embed_image('drawingBack', pdf.l_margin + image_width + 10)
+
+        pdf.set_y(current_y_for_images + max_drawn_height + 10)
+
+    # Get PDF data as bytes
+    return bytes(pdf.output())
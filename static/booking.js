@@ -147,6 +147,55 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- 1. Fetch and Display Availability ---
 
+    // Prefetched availability from /api/availability/range, keyed by date then duration.
+    // Entries expire so a long-open tab falls back to live per-day lookups.
+    const PREFETCH_DAYS = 31;
+    const PREFETCH_TTL_MS = 5 * 60 * 1000;
+    const availabilityPrefetch = { days: null, start: null, end: null, durations: [], fetchedAt: 0 };
+
+    const formatDateParam = (date) => [
+        date.getFullYear(),
+        (date.getMonth() + 1).toString().padStart(2, '0'),
+        date.getDate().toString().padStart(2, '0')
+    ].join('-');
+
+    const prefetchAvailability = async (availableDays) => {
+        if (!availableDays || availableDays.length === 0) return;
+
+        const durations = [...new Set(
+            Object.values(servicePricing).flat().map(opt => opt.length)
+        )];
+        const start = availableDays[0];
+        const endDate = new Date(`${start}T00:00:00`);
+        endDate.setDate(endDate.getDate() + PREFETCH_DAYS - 1);
+        const end = formatDateParam(endDate);
+
+        try {
+            const response = await fetch(
+                `/api/availability/range?start=${start}&end=${end}&durations=${durations.join(',')}`
+            );
+            if (!response.ok) throw new Error('Network response was not ok');
+            const result = await response.json();
+            Object.assign(availabilityPrefetch, {
+                days: result.days || {},
+                start: result.start,
+                end: result.end,
+                durations: durations.map(String),
+                fetchedAt: Date.now()
+            });
+        } catch (error) {
+            // Prefetch is an optimization only; per-day lookups still work.
+            console.warn('Availability prefetch failed:', error);
+        }
+    };
+
+    const getPrefetchedTimes = (dateStr, duration) => {
+        const p = availabilityPrefetch;
+        if (!p.days || Date.now() - p.fetchedAt > PREFETCH_TTL_MS) return null;
+        if (dateStr < p.start || dateStr > p.end || !p.durations.includes(String(duration))) return null;
+        return (p.days[dateStr] && p.days[dateStr][String(duration)]) || [];
+    };
+
     let availabilityTimeout;
     const fetchAndDisplayAvailability = () => {
         clearTimeout(availabilityTimeout);
@@ -168,17 +217,20 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
+        // Format the date to YYYY-MM-DD manually to avoid UTC timezone shifts
+        const dateStr = formatDateParam(selectedDate);
+
+        const prefetchedTimes = getPrefetchedTimes(dateStr, duration);
+        if (prefetchedTimes) {
+            populateTimeSlots(prefetchedTimes);
+            return;
+        }
+
         // Clear previous times and show a loading message
         timeSelect.innerHTML = '<option>Fetching times...</option>';
         timeSelect.disabled = true;
 
         try {
-            // Format the date to YYYY-MM-DD manually to avoid UTC timezone shifts
-            const dateStr = [
-                selectedDate.getFullYear(),
-                (selectedDate.getMonth() + 1).toString().padStart(2, '0'),
-                selectedDate.getDate().toString().padStart(2, '0')
-            ].join('-');
             const response = await fetch(`/api/availability?date=${dateStr}&duration=${duration}`);
 
             if (!response.ok) {
@@ -517,9 +569,14 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!response.ok) throw new Error('Could not fetch available days.');
             const availableDays = await response.json();
 
+            // Warm the per-day time cache while the calendar renders.
+            const prefetch = prefetchAvailability(availableDays);
+
             // Update the existing calendar instance with the whitelisted dates from the server
             fp.set("enable", availableDays);
             availableDaysLoaded = true;
+            // A date pre-filled from the URL should wait for the prefetch rather than race it.
+            if (urlParams.get('date')) await prefetch;
             prefillScheduleFromURL();
 
         } catch (error) {